@@ -41,15 +41,18 @@ export default function PriceSuggestions({ apps }: PriceSuggestionsProps) {
     apps.length > 0 ? apps[0].id : null
   );
 
+  // Una sola petición con las sugerencias de todas las apps; el selector solo filtra
+  const appIds = apps.map((app) => app.id);
   const {
-    data: suggestion,
+    data: suggestions,
     isLoading,
     error,
-  } = useQuery<PriceSuggestion>({
-    queryKey: ['price-suggestion', selectedAppId],
-    queryFn: () => api.getPriceSuggestion(selectedAppId!),
-    enabled: !!selectedAppId,
+  } = useQuery<Array<PriceSuggestion & { app_id: number }>>({
+    queryKey: ['price-suggestions', appIds],
+    queryFn: () => api.getPriceSuggestions(appIds),
+    enabled: appIds.length > 0,
   });
+  const suggestion = suggestions?.find((item) => item.app_id === selectedAppId);
 
   if (apps.length === 0) {
     return (
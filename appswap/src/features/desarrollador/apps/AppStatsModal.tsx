@@ -1,8 +1,7 @@
 // components/AppStatsModal.tsx
-import React, { useEffect, useState } from 'react';
+import { useQuery } from '@tanstack/react-query';
 import { Dialog, DialogContent, DialogTitle, Typography, IconButton, Box } from '@mui/material';
 import CloseIcon from '@mui/icons-material/Close';
-import type { Stats } from '../../../types/types';
 import { api } from '../../../services/api';
 
 interface AppStatsModalProps {
@@ -12,19 +11,13 @@ interface AppStatsModalProps {
 }
 
 export const AppStatsModal = ({ open, onClose, appId }: AppStatsModalProps) => {
-  const [stats, setStats] = useState<Stats | null>(null);
-
-  useEffect(() => {
-    if (!appId) return;
-    (async () => {
-      try {
-        const data = await api.getAppStats(appId);
-        setStats(data);
-      } catch (error) {
-        console.error('Error al obtener estadísticas:', error);
-      }
-    })();
-  }, [appId]);
+  // Todas las tarjetas comparten la misma query: una sola petición para el dashboard
+  const { data: allStats } = useQuery({
+    queryKey: ['app-stats'],
+    queryFn: api.getAllAppStats,
+    enabled: open && !!appId,
+  });
+  const stats = allStats?.get(appId) ?? null;
 
   return (
     <Dialog open={open} onClose={onClose} maxWidth="sm" fullWidth>
@@ -1,5 +1,5 @@
 import { useState, useMemo } from 'react';
-import { useQuery, useMutation } from '@tanstack/react-query';
+import { useInfiniteQuery, useMutation } from '@tanstack/react-query';
 import { api } from '../../services/api';
 import { API_BASE_URL } from '../../config/api';
 import {
@@ -30,7 +30,7 @@ import ClearIcon from '@mui/icons-material/Clear';
 import AutoAwesomeIcon from '@mui/icons-material/AutoAwesome';
 import ExpandMore from '@mui/icons-material/ExpandMore';
 import ExpandLess from '@mui/icons-material/ExpandLess';
-import type { App } from '../../types/types';
+import type { App, AppsPage } from '../../types/types';
 import { BuyerAppCard } from './BuyerAppCard';
 
 export default function Apps() {
@@ -44,20 +44,28 @@ export default function Apps() {
   const [useAiSearch, setUseAiSearch] = useState(false);
   const [aiResults, setAiResults] = useState<App[]>([]);
 
+  // Catálogo paginado por cursor: se carga una página y el resto bajo demanda
   const {
-    data: apps = [],
+    data,
     isLoading,
     error,
-  } = useQuery<App[]>({
+    hasNextPage,
+    fetchNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
     queryKey: ['buyerApps'],
-    queryFn: async () => {
+    queryFn: async ({ pageParam }): Promise<AppsPage> => {
       console.log('🔍 Obteniendo apps del comprador...');
-      const result = await api.getBuyerApps();
-      console.log('📦 Apps recibidas:', result);
+      const result = await api.getBuyerApps(pageParam);
+      console.log('📦 Apps recibidas:', result.aplicaciones.length);
       return result;
     },
+    initialPageParam: null as number | null,
+    getNextPageParam: (lastPage) => lastPage.siguiente_cursor ?? undefined,
   });
 
+  const apps = useMemo(() => data?.pages.flatMap((page) => page.aplicaciones) ?? [], [data]);
+
   // Mutación para búsqueda con IA
   const aiSearchMutation = useMutation({
     mutationFn: async (query: string) => {
@@ -404,6 +412,7 @@ export default function Apps() {
       <Box mb={2}>
         <Typography variant="body2" color="text.secondary">
           Mostrando {displayApps.length} de {apps.length} aplicaciones
+          {hasNextPage && !useAiSearch && ' cargadas'}
         </Typography>
       </Box>
 
@@ -431,6 +440,20 @@ export default function Apps() {
           ))}
         </Grid>
       )}
+
+      {/* Cargar la siguiente página del catálogo */}
+      {hasNextPage && !useAiSearch && (
+        <Box display="flex" justifyContent="center" mt={3}>
+          <Button
+            variant="outlined"
+            onClick={() => fetchNextPage()}
+            disabled={isFetchingNextPage}
+            startIcon={isFetchingNextPage ? <CircularProgress size={20} /> : undefined}
+          >
+            {isFetchingNextPage ? 'Cargando...' : 'Cargar más'}
+          </Button>
+        </Box>
+      )}
     </Box>
   );
 }
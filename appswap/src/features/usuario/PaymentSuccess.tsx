@@ -5,6 +5,9 @@ import CheckCircleIcon from '@mui/icons-material/CheckCircle';
 import ErrorIcon from '@mui/icons-material/Error';
 import { API_BASE_URL } from '../../config/api';
 
+const VERIFY_POLL_MS = 1500;
+const VERIFY_TIMEOUT_MS = 30000;
+
 export default function PaymentSuccess() {
   const [searchParams] = useSearchParams();
   const navigate = useNavigate();
@@ -13,20 +16,42 @@ export default function PaymentSuccess() {
 
   useEffect(() => {
     const sessionId = searchParams.get('session_id');
+    if (!sessionId) {
+      setVerifying(false);
+      return;
+    }
+
+    // El pago lo registra el webhook de Stripe: mientras llega, la sesión está
+    // "pending"/"processing" y se vuelve a consultar
+    let cancelled = false;
+    let timer: ReturnType<typeof setTimeout>;
+    const startedAt = Date.now();
 
-    if (sessionId) {
+    const check = () => {
       fetch(`${API_BASE_URL}/payments/verify-session/${sessionId}`)
         .then(res => res.json())
         .then(data => {
-          if (data.status === 'paid') {
-            setSuccess(true);
+          if (cancelled) return;
+          const waiting = data.status === 'pending' || data.status === 'processing';
+          if (waiting && Date.now() - startedAt < VERIFY_TIMEOUT_MS) {
+            timer = setTimeout(check, VERIFY_POLL_MS);
+            return;
           }
+          setSuccess(data.status === 'paid');
+          setVerifying(false);
         })
-        .catch(() => setSuccess(false))
-        .finally(() => setVerifying(false));
-    } else {
-      setVerifying(false);
-    }
+        .catch(() => {
+          if (cancelled) return;
+          setSuccess(false);
+          setVerifying(false);
+        });
+    };
+    check();
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
   }, [searchParams]);
 
   if (verifying) {
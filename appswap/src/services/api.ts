@@ -1,5 +1,5 @@
 import { toast } from 'react-toastify';
-import type { App, Payment, Review, Stats } from '../types/types';
+import type { App, AppsPage, Payment, Review, Stats } from '../types/types';
 import { API_BASE_URL } from '../config/api';
 
 // Función para obtener headers con autenticación
@@ -11,8 +11,46 @@ const getAuthHeaders = () => {
   };
 };
 
+// Guardar la sesión devuelta por login/register/refresh
+const saveSession = (data: { token: string; refresh_token?: string }, role?: string) => {
+  localStorage.setItem('token', data.token);
+  if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
+  if (role) localStorage.setItem('role', role);
+};
+
+// Renovar el access token con el refresh token (sin volver a pedir la contraseña).
+// Si varias peticiones reciben 401 a la vez, comparten una única renovación.
+let refreshPromise: Promise<boolean> | null = null;
+
+const refreshSession = (): Promise<boolean> => {
+  const refreshToken = localStorage.getItem('refresh_token');
+  const role = localStorage.getItem('role');
+  if (!refreshToken || !role) return Promise.resolve(false);
+
+  if (!refreshPromise) {
+    refreshPromise = fetch(`${API_BASE_URL}/${role}/auth/refresh`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    })
+      .then(async (response) => {
+        if (!response.ok) {
+          localStorage.removeItem('refresh_token');
+          return false;
+        }
+        saveSession(await response.json());
+        return true;
+      })
+      .catch(() => false)
+      .finally(() => {
+        refreshPromise = null;
+      });
+  }
+  return refreshPromise;
+};
+
 // Función helper para hacer peticiones con manejo de errores
-const apiRequest = async (endpoint: string, options: RequestInit = {}) => {
+const apiRequest = async (endpoint: string, options: RequestInit = {}, retry = true): Promise<any> => {
   try {
     const response = await fetch(`${API_BASE_URL}${endpoint}`, {
       ...options,
@@ -22,6 +60,11 @@ const apiRequest = async (endpoint: string, options: RequestInit = {}) => {
       },
     });
 
+    // Access token caducado: renovar la sesión y repetir la petición una vez
+    if (response.status === 401 && retry && !endpoint.includes('/auth/') && (await refreshSession())) {
+      return apiRequest(endpoint, options, false);
+    }
+
     if (!response.ok) {
       const error = await response.json().catch(() => ({ detail: 'Error desconocido' }));
       const errorMessage = error.detail || `Error ${response.status}: ${response.statusText}`;
@@ -61,7 +104,7 @@ export const api = {
       });
 
       console.log('📥 Respuesta del backend:', data);
-      localStorage.setItem('token', data.token);
+      saveSession(data, role);
       localStorage.setItem('user', JSON.stringify(data));
       return { success: true, token: data.token, role };
     } catch (error) {
@@ -80,7 +123,7 @@ export const api = {
         body: JSON.stringify(userData),
       });
 
-      localStorage.setItem('token', data.token);
+      saveSession(data, role);
       localStorage.setItem('user', JSON.stringify(data));
       return { success: true, user: data };
     } catch (error) {
@@ -89,7 +132,19 @@ export const api = {
   },
 
   logout: async () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    const role = localStorage.getItem('role');
+    if (refreshToken && role) {
+      // Revocar la sesión en el backend; si falla, el refresh token caduca igualmente
+      fetch(`${API_BASE_URL}/${role}/auth/logout`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ refresh_token: refreshToken }),
+      }).catch(() => {});
+    }
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
+    localStorage.removeItem('role');
     localStorage.removeItem('user');
     return { success: true };
   },
@@ -131,9 +186,14 @@ export const api = {
   // --------------------------
   // Apps (Comprador)
   // --------------------------
-  getBuyerApps: async (): Promise<App[]> => {
-    const data = await apiRequest('/usuario/apps');
-    return data.aplicaciones; // Backend devuelve 'aplicaciones' en español
+  // Una página del catálogo; la siguiente se pide con el siguiente_cursor recibido
+  getBuyerApps: async (cursor: number | null = null): Promise<AppsPage> => {
+    const query = cursor !== null ? `?cursor=${cursor}` : '';
+    const data = await apiRequest(`/usuario/apps${query}`);
+    return {
+      aplicaciones: data.aplicaciones, // Backend devuelve 'aplicaciones' en español
+      siguiente_cursor: data.siguiente_cursor ?? null,
+    };
   },
 
   executeApp: async (appId: number) => {
@@ -151,9 +211,15 @@ export const api = {
     return await apiRequest('/usuario/payments');
   },
 
-  createPayment: async (paymentData: { app_id: number; qr_code: string }): Promise<Payment> => {
+  // `idempotencyKey` la crea quien llama una vez por intento de compra (crypto.randomUUID())
+  // y la reenvía en cada reintento: con la misma clave el backend devuelve el pago ya creado
+  createPayment: async (
+    paymentData: { app_id: number; qr_code: string },
+    idempotencyKey: string
+  ): Promise<Payment> => {
     return await apiRequest('/usuario/payments', {
       method: 'POST',
+      headers: { 'Idempotency-Key': idempotencyKey },
       body: JSON.stringify(paymentData),
     });
   },
@@ -194,6 +260,17 @@ export const api = {
     return await apiRequest(`/desarrollador/apps/${appId}/stats`);
   },
 
+  // Stats de todas las apps del desarrollador en una sola petición
+  getAllAppStats: async (): Promise<Map<number, Stats>> => {
+    const data = await apiRequest('/desarrollador/apps/stats');
+    return new Map(
+      data.map((item: Stats & { aplicacion_id: number }) => [
+        item.aplicacion_id,
+        { ...item, appId: item.aplicacion_id },
+      ])
+    );
+  },
+
   // --------------------------
   // Recomendaciones
   // --------------------------
@@ -223,6 +300,14 @@ export const api = {
     });
   },
 
+  // Sugerencias para varias apps en una sola petición
+  getPriceSuggestions: async (appIds: number[]) => {
+    return await apiRequest('/ml/price-suggestions', {
+      method: 'POST',
+      body: JSON.stringify({ app_ids: appIds }),
+    });
+  },
+
   getMLRecommendations: async (userId: number, topK: number = 6) => {
     const mlApps = await apiRequest(`/ml/recommendations/${userId}?top_k=${topK}`);
     // El endpoint ML devuelve campos en inglés, mapear a español
@@ -10,6 +10,12 @@ export interface App {
   video_url?: string;
 }
 
+// Página del catálogo del comprador (paginación por cursor)
+export interface AppsPage {
+  aplicaciones: App[];
+  siguiente_cursor: number | null;
+}
+
 export interface Payment {
   id: number;
   aplicacion_id: number;
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from database import get_db, User, App, Payment, Review, Rol, Categoria, Base, engine
-from auth import get_password_hash
+from database import get_db, User, App, Payment, Review, Rol, Categoria, AppStats, AppVentasDiarias, RefreshToken, StripeEvent, InteractionEvent, Base, engine, migrate_payments
+from auth import get_password_hash, invalidate_user
 from datetime import datetime, timedelta
 import random
 import json
+import app_stats
+from search_index import search_index
+from lookup_registry import invalidate_lookups
 from ml_models.price_optimizer import PriceOptimizer
 from ml_models.recommender import AppRecommender
 
@@ -221,13 +224,16 @@ def seed_database(db: Session = Depends(get_db)):
         
         db.commit()
         
-        # COMPRAS (1000+ compras distribuidas temporalmente en últimos 6 meses)
+        # COMPRAS (distribuidas temporalmente en últimos 6 meses)
         base_date = datetime.now() - timedelta(days=180)
         test_buyer = buyers[0]  # comprador@test.com
         
-        print("📦 Generando 1000+ compras coherentes...")
+        print("📦 Generando compras coherentes...")
         
-        for i in range(1050):  # 1050 compras para superar el requisito
+        # Una sola compra confirmada por comprador y app (índice único en pagos):
+        # los sorteos repetidos se descartan
+        purchased = set()
+        for i in range(1050):
             # Distribución temporal: más compras recientes (exponencial)
             days_ago = int(180 * (1 - random.random() ** 2))
             purchase_date = base_date + timedelta(days=days_ago)
@@ -238,6 +244,9 @@ def seed_database(db: Session = Depends(get_db)):
             # RESTRICCIÓN: comprador@test.com NO debe comprar CalculadoraPro
             if buyer.id == test_buyer.id and app.nombre == "CalculadoraPro":
                 continue  # Saltar esta compra
+            if (buyer.id, app.id) in purchased:
+                continue
+            purchased.add((buyer.id, app.id))
             
             # Generar credenciales únicas
             credentials = json.dumps({
@@ -251,7 +260,7 @@ def seed_database(db: Session = Depends(get_db)):
                 aplicacion_id=app.id,
                 comprador_id=buyer.id,
                 estado="confirmado",
-                codigo_qr=f"QR-{random.randint(100000, 999999)}",
+                codigo_qr=f"QR-{buyer.id}-{app.id}",
                 credenciales=credentials,
                 fecha_creacion=purchase_date
             )
@@ -330,6 +339,8 @@ def seed_database(db: Session = Depends(get_db)):
             # Dar al comprador demo algunas compras variadas (15 compras)
             demo_apps = db.query(App).filter(App.nombre != "CalculadoraPro").limit(15).all()
             for app in demo_apps:
+                if (buyer_user.id, app.id) in purchased:
+                    continue
                 days_ago = random.randint(5, 90)
                 purchase_date = datetime.now() - timedelta(days=days_ago)
                 
@@ -343,7 +354,7 @@ def seed_database(db: Session = Depends(get_db)):
                     aplicacion_id=app.id,
                     comprador_id=buyer_user.id,
                     estado="confirmado",
-                    codigo_qr=f"QR-DEMO-{random.randint(100000, 999999)}",
+                    codigo_qr=f"QR-DEMO-{buyer_user.id}-{app.id}",
                     credenciales=credentials,
                     fecha_creacion=purchase_date
                 )
@@ -366,6 +377,12 @@ def seed_database(db: Session = Depends(get_db)):
             print(f"   - dev@test.com: Dueño de CalculadoraPro + {db.query(App).filter(App.propietario_id == dev_user.id).count()} apps")
             print(f"   - comprador@test.com: {db.query(Payment).filter(Payment.comprador_id == buyer_user.id).count()} compras (NO incluye CalculadoraPro)")
         
+        # Los pagos y resenas se insertaron directamente: reconstruir contadores
+        app_stats.rebuild(db)
+        search_index.invalidate()
+        invalidate_user()
+        invalidate_lookups()
+        
         total_purchases = db.query(Payment).count()
         total_reviews = db.query(Review).count()
         
@@ -396,11 +413,20 @@ def clear_database(db: Session = Depends(get_db)):
     """
     try:
         # Eliminar en orden inverso por dependencias
+        db.query(AppVentasDiarias).delete()
+        db.query(AppStats).delete()
         db.query(Review).delete()
         db.query(Payment).delete()
         db.query(App).delete()
+        db.query(RefreshToken).delete()
+        db.query(StripeEvent).delete()
+        db.query(InteractionEvent).delete()
         db.query(User).delete()
         db.commit()
+        migrate_payments()  # Índices únicos que no se pudieron crear por datos duplicados
+        search_index.invalidate()
+        invalidate_user()
+        invalidate_lookups()
         
         return {
             "message": "✅ Base de datos limpiada exitosamente",
@@ -430,13 +456,22 @@ def reset_all(db: Session = Depends(get_db)):
         print("=" * 60)
         print("🧹 PASO 1/4: LIMPIANDO BASE DE DATOS")
         print("=" * 60)
+        db.query(AppVentasDiarias).delete()
+        db.query(AppStats).delete()
         db.query(Review).delete()
         db.query(Payment).delete()
         db.query(App).delete()
+        db.query(RefreshToken).delete()
+        db.query(StripeEvent).delete()
+        db.query(InteractionEvent).delete()
         db.query(User).delete()
         db.query(Categoria).delete()
         db.query(Rol).delete()
         db.commit()
+        migrate_payments()  # Índices únicos que no se pudieron crear por datos duplicados
+        search_index.invalidate()
+        invalidate_user()
+        invalidate_lookups()
         print("✅ Base de datos limpiada")
         
         # PASO 2: Poblar base de datos
@@ -446,6 +481,9 @@ def reset_all(db: Session = Depends(get_db)):
         
         # Llamar a la función de seed directamente
         seed_result = seed_database(db)
+        search_index.invalidate()
+        invalidate_user()
+        invalidate_lookups()
         print(f"✅ {seed_result['users']} usuarios creados")
         print(f"✅ {seed_result['apps']} apps creadas")
         print(f"✅ {seed_result['purchases']} compras creadas")
@@ -473,10 +511,10 @@ def reset_all(db: Session = Depends(get_db)):
         print("🔄 PASO 4/4: RECARGANDO MODELOS EN MEMORIA")
         print("=" * 60)
         
-        # Importar las instancias globales y recargarlas
+        # Recargar las instancias globales de este worker; el resto de workers
+        # detecta la nueva versión del registro en su siguiente petición a /ml
         import ml_endpoints
-        ml_endpoints.recommender.load()
-        ml_endpoints.price_optimizer.load()
+        ml_endpoints.refresh_models(force=True)
         print("✅ Modelos recargados en memoria")
         
         print("\n" + "=" * 60)
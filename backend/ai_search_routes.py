@@ -1,98 +1,272 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db, App
+from database import get_db, SessionLocal, AppStats
+from app_catalog import fetch_apps_by_ids, category_name
+from search_index import search_index, normalize_query
+from search_cache import search_cache
+from circuit_breaker import CircuitBreaker
+from typing import Optional
+import asyncio
 import os
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-router = APIRouter(prefix="/search", tags=["search"])
+# Número máximo de resultados que devuelve la búsqueda
+AI_SEARCH_LIMIT = int(os.getenv("AI_SEARCH_LIMIT", "20"))
+# Reordenar con el LLM: "auto" (solo si hay OPENAI_API_KEY), "true" o "false"
+AI_SEARCH_RERANK = os.getenv("AI_SEARCH_RERANK", "auto").lower()
+# Candidatos del índice local que se envían al LLM (el prompt crece con este número)
+AI_SEARCH_CANDIDATES = int(os.getenv("AI_SEARCH_CANDIDATES", "30"))
+MAX_SEARCH_CANDIDATES = 100
+# Segundos que se espera al LLM antes de devolver el ranking local
+AI_SEARCH_LLM_TIMEOUT = float(os.getenv("AI_SEARCH_LLM_TIMEOUT", "8"))
+# Caracteres de descripción por candidato en el prompt
+PROMPT_DESCRIPTION_CHARS = 200
+# Llamadas simultáneas al LLM por worker (también el tamaño del pool de conexiones)
+AI_SEARCH_LLM_CONCURRENCY = int(os.getenv("AI_SEARCH_LLM_CONCURRENCY", "8"))
+# Fallos seguidos que abren el circuito y segundos hasta volver a probar
+AI_SEARCH_BREAKER_FAILURES = int(os.getenv("AI_SEARCH_BREAKER_FAILURES", "5"))
+AI_SEARCH_BREAKER_RESET = float(os.getenv("AI_SEARCH_BREAKER_RESET", "30"))
+
+llm_breaker = CircuitBreaker(AI_SEARCH_BREAKER_FAILURES, AI_SEARCH_BREAKER_RESET)
+# Cliente y semáforo compartidos; van ligados al event loop (uno por worker de uvicorn)
+_llm_state = {"loop": None, "client": None, "semaphore": None}
+# Reordenaciones en curso por clave de cache: las consultas iguales simultáneas esperan a la primera
+_inflight = {}
+
+def _build_search_index():
+    db = SessionLocal()
+    try:
+        search_index.build_from_db(db)
+    except Exception as e:
+        print(f"⚠️  Índice de búsqueda no construido al arrancar: {e}")
+    finally:
+        db.close()
+
+async def _close_openai_client():
+    client = _llm_state["client"]
+    _llm_state.update(loop=None, client=None, semaphore=None)
+    if client is not None:
+        await client.close()
+
+router = APIRouter(
+    prefix="/search", tags=["search"],
+    on_startup=[_build_search_index], on_shutdown=[_close_openai_client]
+)
 
 def get_openai_client():
-    """Lazy load OpenAI client to avoid import issues"""
-    from openai import OpenAI
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    """
+    Cliente AsyncOpenAI compartido (import perezoso) con keep-alive, y el
+    semáforo que limita las llamadas concurrentes. Se crean una vez por event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if _llm_state["loop"] is not loop:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        import httpx
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=AI_SEARCH_LLM_CONCURRENCY,
+                max_keepalive_connections=AI_SEARCH_LLM_CONCURRENCY,
+                keepalive_expiry=60
+            ),
+            timeout=AI_SEARCH_LLM_TIMEOUT
+        )
+        _llm_state.update(
+            loop=loop,
+            client=AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0),
+            semaphore=asyncio.Semaphore(AI_SEARCH_LLM_CONCURRENCY)
+        )
+    return _llm_state["client"], _llm_state["semaphore"]
 
 class SearchRequest(BaseModel):
     query: str
+    rerank: Optional[bool] = None  # Sin valor se usa AI_SEARCH_RERANK
+    candidates: Optional[int] = Field(None, ge=1, le=MAX_SEARCH_CANDIDATES)  # Sin valor: AI_SEARCH_CANDIDATES
 
-@router.post("/ai-search")
-def ai_search_apps(request: SearchRequest, db: Session = Depends(get_db)):
+def _rerank_enabled(request: SearchRequest) -> bool:
+    if request.rerank is not None:
+        return request.rerank and bool(os.getenv("OPENAI_API_KEY"))
+    if AI_SEARCH_RERANK == "auto":
+        return bool(os.getenv("OPENAI_API_KEY"))
+    return AI_SEARCH_RERANK == "true"
+
+async def _llm_rerank(query: str, apps):
     """
-    Búsqueda inteligente de apps usando OpenAI.
-    El usuario escribe en lenguaje natural qué tipo de app busca.
+    Pedir al LLM que filtre y ordene los candidatos locales.
+    Retorna los IDs en el orden del modelo (lista vacía si responde NONE).
+    La espera por el semáforo cuenta dentro del plazo AI_SEARCH_LLM_TIMEOUT.
     """
-    if not request.query.strip():
-        raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
-    # Obtener todas las apps disponibles
-    apps = db.query(App).all()
-    
-    if not apps:
-        return {"results": []}
-    
-    # Crear descripción de las apps para el prompt
-    apps_catalog = []
-    for app in apps:
-        apps_catalog.append({
-            "id": app.id,
-            "name": app.nombre,
-            "category": app.categoria_obj.nombre if app.categoria_obj else "Sin categoría",
-            "description": app.descripcion,
-            "price": float(app.precio)
-        })
-    
-    # Prompt para OpenAI
-    prompt = f"""Eres un asistente de búsqueda de aplicaciones. El usuario busca: "{request.query}"
-
-Aquí está el catálogo de aplicaciones disponibles:
+    # Una línea compacta por candidato en lugar del repr de una lista de dicts
+    apps_catalog = "\n".join(
+        f"{app.id} | {app.nombre} | {category_name(app)} | ${float(app.precio):.2f} | "
+        f"{(app.descripcion or '')[:PROMPT_DESCRIPTION_CHARS]}"
+        for app in apps
+    )
+
+    prompt = f"""Eres un asistente de búsqueda de aplicaciones. El usuario busca: "{query}"
+
+Aquí están las aplicaciones candidatas (id | nombre | categoría | precio | descripción):
 {apps_catalog}
 
-Analiza la consulta del usuario y devuelve ÚNICAMENTE los IDs de las aplicaciones más relevantes, separados por comas.
+Analiza la consulta del usuario y devuelve ÚNICAMENTE los IDs de las aplicaciones más relevantes, separados por comas y ordenados de más a menos relevante.
 Si no hay coincidencias, devuelve "NONE".
 Responde SOLO con los IDs o "NONE", sin explicaciones adicionales.
 """
 
+    client, semaphore = get_openai_client()
+
+    async def call():
+        async with semaphore:
+            return await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Eres un asistente que filtra aplicaciones basándose en las necesidades del usuario."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=100,
+                temperature=0.3
+            )
+
+    response = await asyncio.wait_for(call(), timeout=AI_SEARCH_LLM_TIMEOUT)
+
+    ai_response = response.choices[0].message.content.strip()
+    if ai_response == "NONE":
+        return []
+    return [int(id.strip()) for id in ai_response.split(",") if id.strip().isdigit()]
+
+def _pad_with_best_sellers(db: Session, app_ids, budget: int):
+    """
+    Completar los candidatos con las apps más vendidas: si la consulta no
+    comparte palabras con el catálogo, el LLM aún puede encontrar
+    coincidencias por significado entre ellas.
+    """
+    missing = budget - len(app_ids)
+    if missing <= 0:
+        return app_ids
+    query = db.query(AppStats.aplicacion_id)
+    if app_ids:
+        query = query.filter(AppStats.aplicacion_id.notin_(app_ids))
+    best_sellers = query.order_by(AppStats.total_ventas.desc()).limit(missing).all()
+    return app_ids + [app_id for (app_id,) in best_sellers]
+
+def _app_result(app, score: float):
+    # Mismos nombres de campos que usa el frontend
+    return {
+        "id": app.id,
+        "nombre": app.nombre,
+        "categoria": category_name(app),
+        "descripcion": app.descripcion,
+        "precio": float(app.precio),
+        "imagen_portada": app.imagen_portada,
+        "url_video": app.url_video,
+        "url_aplicacion": app.url_aplicacion,
+        "video_url": app.url_video,  # Alias para compatibilidad
+        "score": round(score, 3),
+    }
+
+def _local_stage(db: Session, query: str, rerank: bool, budget: int):
+    """
+    Parte síncrona de la búsqueda (índice, cache y BD); se ejecuta en el
+    threadpool. Retorna (cache_key, respuesta cacheada) o, si no está en cache,
+    (cache_key, None, scores, IDs locales, IDs candidatos para el LLM, apps por ID).
+    """
+    search_index.ensure_built(db)
+    cache_key = search_cache.make_key(normalize_query(query), search_index.catalog_version, rerank, budget)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cache_key, cached, None, None, None, None
+
+    hits = search_index.search(query, limit=max(budget, AI_SEARCH_LIMIT) if rerank else AI_SEARCH_LIMIT)
+    scores = dict(hits)
+    local_ids = [app_id for app_id, _ in hits][:AI_SEARCH_LIMIT]
+    candidate_ids = _pad_with_best_sellers(db, [app_id for app_id, _ in hits][:budget], budget) if rerank else []
+    # Una sola consulta para los resultados locales y los candidatos
+    apps_by_id = {app.id: app for app in fetch_apps_by_ids(db, local_ids + candidate_ids)}
+    return cache_key, None, scores, local_ids, candidate_ids, apps_by_id
+
+async def _reranked_response(query: str, candidates, scores):
+    """Respuesta ordenada por el LLM, o None si falla, no responde a tiempo o el circuito está abierto"""
+    if not llm_breaker.allow():
+        return None
     try:
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente que filtra aplicaciones basándose en las necesidades del usuario."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=100,
-            temperature=0.3
-        )
-        
-        ai_response = response.choices[0].message.content.strip()
-        
-        if ai_response == "NONE":
-            return {"results": []}
-        
-        # Parsear los IDs devueltos
-        try:
-            app_ids = [int(id.strip()) for id in ai_response.split(",") if id.strip().isdigit()]
-        except:
-            app_ids = []
-        
-        # Filtrar apps por los IDs devueltos
-        filtered_apps = [app for app in apps if app.id in app_ids]
-        
-        # Convertir a diccionarios con los mismos nombres de campos que usa el frontend
-        results = []
-        for app in filtered_apps:
-            results.append({
-                "id": app.id,
-                "nombre": app.nombre,
-                "categoria": app.categoria_obj.nombre if app.categoria_obj else "Sin categoría",
-                "descripcion": app.descripcion,
-                "precio": float(app.precio),
-                "imagen_portada": app.imagen_portada,
-                "url_video": app.url_video,
-                "url_aplicacion": app.url_aplicacion,
-                "video_url": app.url_video,  # Alias para compatibilidad
-            })
-        
-        return {"results": results}
-        
+        app_ids = await _llm_rerank(query, candidates)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI error: {str(e)}")
+        llm_breaker.record_failure()
+        print(f"⚠️  OpenAI no disponible o sin respuesta a tiempo, se usa el ranking local: {e!r}")
+        return None
+    except BaseException:
+        # Petición cancelada (cliente desconectado, apagado): no cuenta como fallo
+        # del LLM, pero si era la llamada de prueba del half_open hay que liberarla
+        llm_breaker.release_probe()
+        raise
+    llm_breaker.record_success()
+    apps_by_id = {app.id: app for app in candidates}
+    apps = [apps_by_id[app_id] for app_id in dict.fromkeys(app_ids) if app_id in apps_by_id]
+    return {
+        "results": [_app_result(app, scores.get(app.id, 0.0)) for app in apps[:AI_SEARCH_LIMIT]],
+        "source": "llm"
+    }
+
+@router.post("/ai-search")
+async def ai_search_apps(request: SearchRequest, db: Session = Depends(get_db)):
+    """
+    Búsqueda inteligente de apps en dos etapas.
+    El usuario escribe en lenguaje natural qué tipo de app busca:
+    1. El índice local (BM25) selecciona los mejores candidatos del catálogo.
+    2. Si está configurado, OpenAI reordena y filtra solo esos candidatos.
+    Si el LLM falla, supera AI_SEARCH_LLM_TIMEOUT o tiene el circuito abierto
+    se devuelve el ranking local. Las respuestas se cachean por consulta
+    normalizada y versión del catálogo.
+    """
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    rerank = _rerank_enabled(request)
+    budget = request.candidates or AI_SEARCH_CANDIDATES
+    cache_key, cached, scores, local_ids, candidate_ids, apps_by_id = await run_in_threadpool(
+        _local_stage, db, request.query, rerank, budget
+    )
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    if rerank:
+        pending = _inflight.get(cache_key)
+        if pending is not None:
+            response = await asyncio.shield(pending)
+        else:
+            pending = asyncio.get_running_loop().create_future()
+            _inflight[cache_key] = pending
+            response = None
+            try:
+                candidates = [apps_by_id[app_id] for app_id in candidate_ids if app_id in apps_by_id]
+                response = await _reranked_response(request.query, candidates, scores)
+                if response is not None:
+                    search_cache.set(cache_key, response)
+            finally:
+                _inflight.pop(cache_key, None)
+                pending.set_result(response)
+        if response is not None:
+            return {**response, "cached": False}
+        # Sin LLM la búsqueda sigue funcionando con el orden local
+        # (sin cachear, para volver a intentarlo con el LLM en la próxima consulta)
+
+    apps = [apps_by_id[app_id] for app_id in local_ids if app_id in apps_by_id]
+    response = {"results": [_app_result(app, scores[app.id]) for app in apps], "source": "local"}
+    if not rerank:
+        search_cache.set(cache_key, response)
+    return {**response, "cached": False}
+
+@router.get("/status")
+def get_search_status():
+    """
+    Estado del índice local y de la cache de resultados
+    """
+    return {
+        "index": {
+            "apps": len(search_index.doc_len),
+            "terms": len(search_index.postings),
+            "catalog_version": search_index.catalog_version
+        },
+        "cache": search_cache.stats(),
+        "llm_circuit": llm_breaker.stats()
+    }
@@ -0,0 +1,37 @@
+"""
+Lectura del catalogo de apps con su categoria en lote
+
+Todas las rutas que devuelven apps necesitan el nombre de la categoria. Cargarlo
+con la relacion perezosa `app.categoria_obj` lanza una consulta por app (N+1);
+estas funciones lo resuelven con un JOIN en la misma consulta.
+"""
+
+from typing import Iterable, List
+from sqlalchemy.orm import Session, joinedload
+from database import App
+
+SIN_CATEGORIA = "Sin categoría"
+
+def with_category(query):
+    """Añadir a una consulta sobre App la carga de su categoria en el mismo SELECT"""
+    return query.options(joinedload(App.categoria_obj))
+
+def category_name(app: App) -> str:
+    """Nombre de la categoria de una app (ya cargada con with_category)"""
+    return app.categoria_obj.nombre if app.categoria_obj else SIN_CATEGORIA
+
+def fetch_apps_by_ids(db: Session, app_ids: Iterable[int]) -> List[App]:
+    """
+    Apps con su categoria en una sola consulta IN (...), en el mismo orden que
+    app_ids. Los IDs que ya no existen se omiten.
+    """
+    app_ids = list(dict.fromkeys(int(app_id) for app_id in app_ids))
+    if not app_ids:
+        return []
+    apps = with_category(db.query(App)).filter(App.id.in_(app_ids)).all()
+    apps_by_id = {app.id: app for app in apps}
+    return [apps_by_id[app_id] for app_id in app_ids if app_id in apps_by_id]
+
+def load_catalog(db: Session) -> List[App]:
+    """Catalogo completo con categorias, ordenado por ID"""
+    return with_category(db.query(App)).order_by(App.id).all()
@@ -0,0 +1,113 @@
+"""
+Contadores materializados por app (ventas, ingresos, ratings)
+
+Se actualizan dentro de la misma transaccion que el pago o la resena que los
+modifica, de modo que las lecturas (/stats, /sales, modelos ML) son una
+busqueda por clave primaria en lugar de un COUNT/AVG sobre todo el historial.
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import App, Payment, Review, AppStats, AppVentasDiarias, dialect_insert
+
+RECENT_SALES_DAYS = 30
+
+def _update_or_insert(db: Session, model, keys: dict, increments: dict):
+    """
+    Upsert atomico: INSERT ... ON CONFLICT (clave) DO UPDATE SET col = col + delta.
+    Una sola sentencia, sin carrera entre dos primeras ventas simultaneas de una app.
+    """
+    stmt = dialect_insert(db)(model).values(**keys, **increments)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: getattr(model, name) + getattr(stmt.excluded, name) for name in increments}
+    )
+    db.execute(stmt)
+
+def record_sale(db: Session, app_id: int, precio: float, fecha: datetime | None = None, delta: int = 1):
+    """
+    Registrar una venta confirmada (delta=-1 para revertirla). `precio` es el
+    cobrado en esa venta (Payment.precio_pagado). No hace commit.
+    """
+    fecha = fecha or datetime.utcnow()
+    _update_or_insert(db, AppStats, {"aplicacion_id": app_id}, {
+        "total_ventas": delta,
+        "ingresos": delta * (precio or 0.0)
+    })
+    _update_or_insert(db, AppVentasDiarias, {"aplicacion_id": app_id, "dia": fecha.date()}, {
+        "ventas": delta
+    })
+
+def record_review(db: Session, app_id: int, calificacion: int):
+    """Registrar una nueva resena. No hace commit."""
+    _update_or_insert(db, AppStats, {"aplicacion_id": app_id}, {
+        "suma_calificaciones": calificacion,
+        "num_resenas": 1
+    })
+
+def delete_app_stats(db: Session, app_id: int):
+    """Eliminar los contadores de una app (al borrarla). No hace commit."""
+    db.query(AppVentasDiarias).filter(AppVentasDiarias.aplicacion_id == app_id).delete(synchronize_session=False)
+    db.query(AppStats).filter(AppStats.aplicacion_id == app_id).delete(synchronize_session=False)
+
+def recent_sales_query(db: Session, days: int = RECENT_SALES_DAYS):
+    """Subconsulta (aplicacion_id, ventas_recientes) con las ventas de los ultimos `days` dias"""
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    return db.query(
+        AppVentasDiarias.aplicacion_id.label("aplicacion_id"),
+        func.sum(AppVentasDiarias.ventas).label("ventas_recientes")
+    ).filter(AppVentasDiarias.dia >= since)\
+        .group_by(AppVentasDiarias.aplicacion_id)\
+        .subquery()
+
+def average_rating(stats: AppStats | None, default: float = 0.0) -> float:
+    if stats is None or not stats.num_resenas:
+        return default
+    return stats.suma_calificaciones / stats.num_resenas
+
+def rebuild(db: Session):
+    """Recalcular todos los contadores desde pagos y resenas (backfill). Hace commit."""
+    db.query(AppVentasDiarias).delete(synchronize_session=False)
+    db.query(AppStats).delete(synchronize_session=False)
+    
+    stats = {app_id: AppStats(aplicacion_id=app_id, total_ventas=0, ingresos=0.0,
+                              suma_calificaciones=0, num_resenas=0)
+             for (app_id,) in db.query(App.id).all()}
+    
+    # Precio cobrado en cada venta; los pagos anteriores a precio_pagado usan el precio actual
+    sales = db.query(
+        Payment.aplicacion_id,
+        func.count(Payment.id),
+        func.sum(func.coalesce(Payment.precio_pagado, App.precio))
+    ).join(App, Payment.aplicacion_id == App.id)\
+        .filter(Payment.estado == "confirmado")\
+        .group_by(Payment.aplicacion_id).all()
+    for app_id, total, ingresos in sales:
+        stats[app_id].total_ventas = total
+        stats[app_id].ingresos = float(ingresos or 0.0)
+    
+    ratings = db.query(
+        Review.aplicacion_id,
+        func.count(Review.id),
+        func.sum(Review.calificacion)
+    ).filter(Review.aplicacion_id.in_(stats.keys()))\
+        .group_by(Review.aplicacion_id).all()
+    for app_id, total, suma in ratings:
+        stats[app_id].num_resenas = total
+        stats[app_id].suma_calificaciones = int(suma or 0)
+    
+    db.add_all(stats.values())
+    
+    # Ventas por dia: se agregan en Python para no depender de funciones de fecha del motor
+    daily = {}
+    for app_id, fecha in db.query(Payment.aplicacion_id, Payment.fecha_creacion)\
+            .filter(Payment.estado == "confirmado", Payment.aplicacion_id.in_(stats.keys()))\
+            .yield_per(10000):
+        key = (app_id, (fecha or datetime.utcnow()).date())
+        daily[key] = daily.get(key, 0) + 1
+    db.add_all(AppVentasDiarias(aplicacion_id=app_id, dia=dia, ventas=ventas)
+               for (app_id, dia), ventas in daily.items())
+    
+    db.commit()
+    return len(stats)
@@ -1,14 +1,34 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from fastapi import HTTPException, status
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy.orm import Session
+from database import get_db, User, Rol, RefreshToken
+from schemas import CurrentUser
+from ttl_cache import TTLCache
+from password_hashing import pwd_context, hash_password, verify_and_update_password
+import hashlib
+import hmac
+import os
+import secrets
+import uuid
 
 SECRET_KEY = "your-secret-key-here-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Los refresh tokens renuevan la sesión con un HMAC en lugar de volver a pasar por bcrypt
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Usuarios autenticados recientemente: evita consultar `usuarios` en cada petición.
+# Un cambio o borrado de usuario se ve en este proceso al invalidar y en el resto al caducar.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
+security = HTTPBearer()
+
+# Versiones síncronas (scripts de seed y rutas legacy); los handlers usan
+# hash_password / verify_and_update_password, que van al pool de procesos
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -25,20 +45,143 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def create_user_token(user: User, rol: str):
+    """Token de sesión con id, rol y nombre del usuario como claims"""
+    return create_access_token(
+        data={"sub": str(user.id), "rol": rol, "nombre": user.nombre},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+def _credentials_exception():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def decode_token(token: str) -> dict:
+    """Claims de un token válido (401 si no se puede validar)"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user_id
     except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def verify_token(token: str):
+    return decode_token(token)["sub"]
+
+def _load_user(db: Session, user_id: int):
+    row = db.query(User.id, User.nombre, Rol.nombre)\
+        .outerjoin(Rol, Rol.id == User.rol_id)\
+        .filter(User.id == user_id).first()
+    if row is None:
+        return None
+    return CurrentUser(id=row[0], nombre=row[1], rol=row[2])
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)) -> CurrentUser:
+    """
+    Dependencia compartida de autenticación. El token lleva id, rol y nombre;
+    la cache confirma que el usuario sigue existiendo sin ir a la BD en cada
+    petición (como mucho una consulta por usuario cada USER_CACHE_TTL segundos).
+    """
+    claims = decode_token(credentials.credentials)
+    try:
+        user_id = int(claims["sub"])
+    except (TypeError, ValueError):
+        raise _credentials_exception()
+
+    user = user_cache.get(user_id)
+    if user is None:
+        user = _load_user(db, user_id)
+        if user is None:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        user_cache.set(user_id, user)
+
+    # Tokens emitidos antes de un cambio de rol dejan de ser válidos
+    if claims.get("rol") is not None and claims["rol"] != user.rol:
+        raise _credentials_exception()
+    return user
+
+def invalidate_user(user_id: int = None):
+    """Olvidar un usuario de la cache tras modificarlo (sin argumento, todos)"""
+    if user_id is None:
+        user_cache.clear()
+    else:
+        user_cache.delete(user_id)
+
+# ==================== REFRESH TOKENS ====================
+def _refresh_token_hash(token: str) -> str:
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+def issue_refresh_token(db: Session, user_id: int, familia: str = None) -> str:
+    """
+    Emitir un refresh token (sin `familia`, una sesión nueva) y hacer commit.
+    Retorna el token; en la BD solo queda su HMAC.
+    """
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    if familia is None:
+        familia = uuid.uuid4().hex
+        # Al abrir sesión se borran los tokens caducados del usuario: la tabla no crece sin límite
+        db.query(RefreshToken).filter(
+            RefreshToken.usuario_id == user_id,
+            RefreshToken.expira_en < now
+        ).delete(synchronize_session=False)
+    db.add(RefreshToken(
+        token_hash=_refresh_token_hash(token),
+        usuario_id=user_id,
+        familia=familia,
+        expira_en=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    db.commit()
+    return token
+
+def _revoke_family(db: Session, familia: str):
+    db.query(RefreshToken).filter(
+        RefreshToken.familia == familia,
+        RefreshToken.revocado_en.is_(None)
+    ).update({RefreshToken.revocado_en: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+def _invalid_refresh_token():
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token inválido o caducado")
+
+def rotate_refresh_token(db: Session, token: str, rol: str):
+    """
+    Canjear un refresh token de un usuario con rol `rol`: se revoca y se emite
+    el siguiente de la misma sesión. Retorna (usuario, refresh token nuevo).
+    Reutilizar un token ya canjeado revoca la sesión entera (posible robo).
+    """
+    now = datetime.utcnow()
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == _refresh_token_hash(token)).first()
+    if stored is None or stored.expira_en <= now:
+        raise _invalid_refresh_token()
+    if stored.revocado_en is not None:
+        _revoke_family(db, stored.familia)
+        print(f"⚠️  Refresh token reutilizado (usuario {stored.usuario_id}): sesión revocada")
+        raise _invalid_refresh_token()
+
+    row = db.query(User, Rol.nombre).outerjoin(Rol, Rol.id == User.rol_id)\
+        .filter(User.id == stored.usuario_id).first()
+    if row is None or row[1] != rol:
+        raise _invalid_refresh_token()
+
+    # Revocar con una condición: si dos peticiones canjean el mismo token a la vez solo una gana
+    revoked = db.query(RefreshToken).filter(
+        RefreshToken.id == stored.id,
+        RefreshToken.revocado_en.is_(None)
+    ).update({RefreshToken.revocado_en: now}, synchronize_session=False)
+    if revoked != 1:
+        db.rollback()
+        _revoke_family(db, stored.familia)
+        raise _invalid_refresh_token()
+
+    return row[0], issue_refresh_token(db, stored.usuario_id, familia=stored.familia)
+
+def revoke_refresh_token(db: Session, token: str):
+    """Cerrar la sesión de un refresh token (no falla si ya no existe)"""
+    stored = db.query(RefreshToken.familia).filter(RefreshToken.token_hash == _refresh_token_hash(token)).first()
+    if stored is not None:
+        _revoke_family(db, stored[0])
@@ -0,0 +1,71 @@
+"""
+Prueba de carga de /search/ai-search: N peticiones con C en paralelo contra un
+backend en marcha, con latencias p50/p95/p99, throughput y origen de los
+resultados (llm, local o cache).
+
+Uso (desde backend/, con fake_llm_server.py como LLM):
+    python benchmark_ai_search.py --url http://localhost:8000 --requests 500 --concurrency 50
+    python benchmark_ai_search.py --unique   # consultas distintas, sin aciertos de cache
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+import httpx
+import numpy as np
+
+QUERIES = [
+    "app para gestionar proyectos",
+    "editar fotos",
+    "aprender idiomas",
+    "control de finanzas personales",
+    "juegos de estrategia",
+    "musica para entrenar",
+    "tareas y productividad",
+    "seguridad y contraseñas",
+]
+
+async def run(url, n_requests, concurrency, unique):
+    latencies = []
+    sources = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        async def one(i):
+            query = QUERIES[i % len(QUERIES)]
+            if unique:
+                query = f"{query} v{i}"
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/search/ai-search", json={"query": query})
+                    data = response.json()
+                    source = "cache" if data.get("cached") else data.get("source", f"http_{response.status_code}")
+                except httpx.HTTPError as e:
+                    source = type(e).__name__
+                latencies.append((time.perf_counter() - start) * 1000)
+                sources[source] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - start
+
+        status = (await client.get("/search/status")).json()
+
+    latencies = np.array(latencies)
+    print(f"\n📊 {n_requests} peticiones, concurrencia {concurrency}: {elapsed:.2f}s ({n_requests / elapsed:.1f} req/s)")
+    print(f"   Latencia p50 {np.percentile(latencies, 50):.0f} ms | p95 {np.percentile(latencies, 95):.0f} ms | "
+          f"p99 {np.percentile(latencies, 99):.0f} ms | máx {latencies.max():.0f} ms")
+    print(f"   Origen: {dict(sources)}")
+    print(f"   Circuito LLM: {status.get('llm_circuit')}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prueba de carga de la búsqueda IA")
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--unique', action='store_true', help='Consultas distintas para no acertar en la cache')
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.requests, args.concurrency, args.unique))
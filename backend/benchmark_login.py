@@ -0,0 +1,92 @@
+"""
+Benchmark de login: coste de bcrypt y throughput de /auth/login.
+
+1. bcrypt en un solo proceso con varios costes: verificaciones/s por núcleo
+   (el techo de logins/s por núcleo para cada BCRYPT_ROUNDS).
+2. Opcional (--url): N logins con C en paralelo contra un backend en marcha,
+   con latencias p50/p95, logins/s y logins/s por núcleo del pool de hashing.
+   Mientras tanto se mide la latencia de un endpoint ligero (/) para ver si
+   los logins frenan al resto de la API.
+
+Uso (desde backend/):
+    python benchmark_login.py --rounds 10 11 12
+    python benchmark_login.py --url http://localhost:8000 --logins 200 --concurrency 50 --cores 4
+"""
+
+import argparse
+import asyncio
+import time
+import httpx
+import numpy as np
+from password_hashing import make_context, PASSWORD_HASH_WORKERS
+
+VERIFY_SAMPLES = 10
+
+def bench_rounds(rounds_list):
+    print("\n🔐 bcrypt (1 proceso)")
+    for rounds in rounds_list:
+        context = make_context(rounds)
+        hashed = context.hash("password")
+        start = time.perf_counter()
+        for _ in range(VERIFY_SAMPLES):
+            context.verify("password", hashed)
+        per_verify = (time.perf_counter() - start) / VERIFY_SAMPLES
+        print(f"   coste {rounds:2d}: {per_verify * 1000:7.1f} ms por verificación -> {1 / per_verify:6.1f} logins/s por núcleo")
+
+async def bench_http(url, path, correo, password, n_logins, concurrency, cores):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    probe_latencies = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=url, timeout=120,
+                                 limits=httpx.Limits(max_connections=concurrency + 1)) as client:
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(path, json={"correo": correo, "contrasena": password})
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/")
+                probe_latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.05)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n_logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    latencies = np.array(latencies)
+    throughput = n_logins / elapsed
+    print(f"\n🌐 {n_logins} logins, concurrencia {concurrency}: {elapsed:.2f}s")
+    print(f"   {throughput:.1f} logins/s | {throughput / cores:.1f} logins/s por núcleo ({cores} núcleos)")
+    print(f"   Latencia p50 {np.percentile(latencies, 50):.0f} ms | p95 {np.percentile(latencies, 95):.0f} ms")
+    print(f"   Códigos: {statuses}")
+    if probe_latencies:
+        print(f"   GET / durante la prueba: p50 {np.percentile(probe_latencies, 50):.0f} ms | "
+              f"máx {max(probe_latencies):.0f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de login y bcrypt")
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12])
+    parser.add_argument('--url', help='Backend en marcha para medir /auth/login')
+    parser.add_argument('--path', default='/usuario/auth/login')
+    parser.add_argument('--correo', default='pedro@buyer.com')
+    parser.add_argument('--password', default='123456')
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--cores', type=int, default=PASSWORD_HASH_WORKERS,
+                        help='Núcleos dedicados al hashing (por defecto PASSWORD_HASH_WORKERS)')
+    args = parser.parse_args()
+
+    bench_rounds(args.rounds)
+    if args.url:
+        asyncio.run(bench_http(args.url, args.path, args.correo, args.password,
+                               args.logins, args.concurrency, args.cores))
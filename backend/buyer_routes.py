@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List
 from database import get_db, User, App, Payment, Review
 from schemas import (
+    CurrentUser,
     UserRegisterDTO, UserLoginDTO, UserResponse,
     AppResponse, AppsListResponse,
     PaymentCreateDTO, PaymentResponse,
@@ -10,19 +11,10 @@ from schemas import (
     RecommendationRequest, RecommendationsResponse, AppRecommendation,
     PurchaseResponse, PurchasesListResponse
 )
-from auth import get_password_hash, verify_password, create_access_token, verify_token
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from auth import get_password_hash, verify_password, create_access_token, get_current_user
 from datetime import timedelta
 
 router = APIRouter(prefix="/buyer", tags=["buyer"])
-security = HTTPBearer()
-
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    user_id = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
 
 @router.post("/auth/register", response_model=UserResponse)
 def register_buyer(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
@@ -102,7 +94,7 @@ def get_all_apps(db: Session = Depends(get_db)):
     )
 
 @router.get("/apps/{app_id}/execute")
-def execute_app(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def execute_app(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App no encontrada")
@@ -116,7 +108,7 @@ def execute_app(app_id: int, current_user: User = Depends(get_current_user), db:
     }
 
 @router.post("/payments", response_model=PaymentResponse)
-def create_payment(payment_data: PaymentCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_payment(payment_data: PaymentCreateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar que la app existe
     app = db.query(App).filter(App.id == payment_data.app_id).first()
     if not app:
@@ -165,7 +157,7 @@ def create_payment(payment_data: PaymentCreateDTO, current_user: User = Depends(
     )
 
 @router.get("/payments", response_model=List[PurchaseResponse])
-def get_buyer_payments(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_buyer_payments(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Hacer JOIN con la tabla apps para obtener toda la información
     payments = db.query(Payment, App).join(App, Payment.app_id == App.id).filter(
         Payment.buyer_id == current_user.id,
@@ -189,7 +181,7 @@ def get_buyer_payments(current_user: User = Depends(get_current_user), db: Sessi
     ]
 
 @router.post("/recommendations", response_model=List[AppResponse])
-def get_buyer_recommendations(request: RecommendationRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_buyer_recommendations(request: RecommendationRequest, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Obtener apps aleatorias como recomendaciones (simulación de ML)
     apps = db.query(App).limit(6).all()
     
@@ -209,7 +201,7 @@ def get_buyer_recommendations(request: RecommendationRequest, current_user: User
     ]
 
 @router.post("/reviews", response_model=ReviewResponse)
-def create_review(review_data: ReviewCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_review(review_data: ReviewCreateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar que la app existe
     app = db.query(App).filter(App.id == review_data.app_id).first()
     if not app:
@@ -245,7 +237,7 @@ def create_review(review_data: ReviewCreateDTO, current_user: User = Depends(get
     )
 
 @router.get("/reviews", response_model=List[ReviewResponse])
-def get_my_reviews(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_my_reviews(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     reviews = db.query(Review).filter(Review.user_id == current_user.id).all()
     return [
         ReviewResponse(
@@ -259,7 +251,7 @@ def get_my_reviews(current_user: User = Depends(get_current_user), db: Session =
     ]
 
 @router.get("/purchases", response_model=PurchasesListResponse)
-def get_buyer_purchases(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_buyer_purchases(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Hacer JOIN con la tabla apps para obtener toda la información
     payments = db.query(Payment, App).join(App, Payment.app_id == App.id).filter(
         Payment.buyer_id == current_user.id,
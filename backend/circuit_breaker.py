@@ -0,0 +1,70 @@
+"""
+Circuit breaker para llamadas a servicios externos.
+
+Tras `failure_threshold` fallos seguidos el circuito se abre y las llamadas se
+rechazan al instante (el llamador usa su alternativa local) durante
+`reset_timeout` segundos. Después se deja pasar una única llamada de prueba
+(half_open): si va bien el circuito se cierra, si falla vuelve a abrirse.
+"""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """¿Se puede intentar la llamada ahora?"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"⚠️  Circuito abierto tras {self.failures} fallos, reintento en {self.reset_timeout:.0f}s")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self):
+        """Liberar la llamada de prueba sin resultado (p. ej. cancelada) para que pase otra"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "rejected": self.rejected
+        }
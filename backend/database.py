@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, ForeignKey, DateTime, Date, Index, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -52,11 +54,11 @@ class App(Base):
     id = Column(Integer, primary_key=True, index=True)
     nombre = Column(String, index=True)
     descripcion = Column(String)
-    categoria_id = Column(Integer, ForeignKey("categorias.id"))
+    categoria_id = Column(Integer, ForeignKey("categorias.id"), index=True)
     url_aplicacion = Column(String)
     propietario_id = Column(Integer, ForeignKey("usuarios.id"))
     imagen_portada = Column(String, nullable=True)
-    precio = Column(Float, default=0.0)
+    precio = Column(Float, default=0.0, index=True)
     url_video = Column(String, nullable=True)
     plantilla_credenciales = Column(String, nullable=True)
     
@@ -69,12 +71,22 @@ class Payment(Base):
     __tablename__ = "pagos"
     
     id = Column(Integer, primary_key=True, index=True)
-    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"))
-    comprador_id = Column(Integer, ForeignKey("usuarios.id"))
+    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"), index=True)
+    comprador_id = Column(Integer, ForeignKey("usuarios.id"), index=True)
     estado = Column(String, default="confirmado")  # Ahora por defecto "confirmado"
-    codigo_qr = Column(String)
+    codigo_qr = Column(String, unique=True, index=True)
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
     credenciales = Column(String, nullable=True)  # Credenciales entregadas al comprador (JSON string)
+    clave_idempotencia = Column(String(64), nullable=True)  # Header Idempotency-Key del alta
+    precio_pagado = Column(Float, nullable=True)  # Precio de la app al venderla (ingresos de app_stats)
+    
+    __table_args__ = (
+        # Una sola compra confirmada por app y comprador (los pagos en otro estado pueden repetirse)
+        Index("uq_pagos_app_comprador_confirmado", aplicacion_id, comprador_id, unique=True,
+              postgresql_where=(estado == "confirmado"), sqlite_where=(estado == "confirmado")),
+        # Los reintentos de un cliente se resuelven con una búsqueda por este índice
+        Index("uq_pagos_comprador_idempotencia", comprador_id, clave_idempotencia, unique=True),
+    )
     
     # Relaciones
     aplicacion = relationship("App", back_populates="pagos")
@@ -84,8 +96,8 @@ class Review(Base):
     __tablename__ = "resenas"
     
     id = Column(Integer, primary_key=True, index=True)
-    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"))
-    autor_id = Column(Integer, ForeignKey("usuarios.id"))
+    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"), index=True)
+    autor_id = Column(Integer, ForeignKey("usuarios.id"), index=True)
     calificacion = Column(Integer)
     comentario = Column(String)
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
@@ -94,9 +106,139 @@ class Review(Base):
     aplicacion = relationship("App", back_populates="resenas")
     autor = relationship("User", back_populates="resenas")
 
+class AppStats(Base):
+    """Contadores desnormalizados por app, mantenidos en cada escritura (ver app_stats.py)"""
+    __tablename__ = "app_stats"
+    
+    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"), primary_key=True)
+    total_ventas = Column(Integer, default=0, nullable=False)
+    ingresos = Column(Float, default=0.0, nullable=False)
+    suma_calificaciones = Column(Integer, default=0, nullable=False)
+    num_resenas = Column(Integer, default=0, nullable=False)
+
+class AppVentasDiarias(Base):
+    """Ventas confirmadas por app y dia, para calcular ventanas recientes (30 dias) sin recorrer pagos"""
+    __tablename__ = "app_ventas_diarias"
+    
+    aplicacion_id = Column(Integer, ForeignKey("aplicaciones.id"), primary_key=True)
+    dia = Column(Date, primary_key=True)
+    ventas = Column(Integer, default=0, nullable=False)
+
+class RefreshToken(Base):
+    """
+    Refresh tokens de sesión. Solo se guarda el HMAC-SHA256 del token (nunca el
+    token), indexado para validarlo con una búsqueda. Cada renovación revoca el
+    token usado y emite otro de la misma `familia`; reutilizar uno revocado
+    revoca toda la familia (la sesión).
+    """
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), index=True, nullable=False)
+    familia = Column(String(32), index=True, nullable=False)
+    expira_en = Column(DateTime, nullable=False)
+    revocado_en = Column(DateTime, nullable=True)
+
+class StripeEvent(Base):
+    """
+    Bandeja de entrada de webhooks de Stripe. Cada evento se guarda tal cual
+    llega (firma ya verificada) con el id de Stripe como clave, así las
+    reentregas no se duplican. El worker de stripe_webhooks los aplica en lotes
+    y solo rellena procesado_en / intentos / error; los eventos no se borran.
+    """
+    __tablename__ = "stripe_eventos"
+    
+    id = Column(String(255), primary_key=True)  # evt_... de Stripe
+    tipo = Column(String(100), nullable=False)
+    sesion_id = Column(String(255), index=True, nullable=True)  # cs_... de Checkout
+    payload = Column(Text, nullable=False)
+    recibido_en = Column(DateTime, default=datetime.utcnow, nullable=False)
+    procesado_en = Column(DateTime, index=True, nullable=True)
+    intentos = Column(Integer, default=0, nullable=False)
+    reintentar_en = Column(DateTime, nullable=True)  # Tras un fallo, no antes de esta fecha
+    error = Column(String, nullable=True)
+
+class RetrainJob(Base):
+    """
+    Re-entrenamientos lanzados con POST /ml/retrain. El estado vive en la BD y
+    no en la memoria del worker que lo lanzó: cualquier worker de uvicorn puede
+    consultarlo, y el índice único parcial sobre estado "running" impide que dos
+    workers lancen un re-entrenamiento a la vez.
+    """
+    __tablename__ = "ml_reentrenamientos"
+    
+    id = Column(String(32), primary_key=True)
+    estado = Column(String(20), default="running", nullable=False)  # running, completed, failed
+    creado_en = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    terminado_en = Column(DateTime, nullable=True)
+    resultado = Column(Text, nullable=True)  # JSON con el resultado de cada modelo
+    error = Column(String, nullable=True)
+    
+    __table_args__ = (
+        Index("uq_ml_reentrenamiento_en_curso", estado, unique=True,
+              postgresql_where=(estado == "running"), sqlite_where=(estado == "running")),
+    )
+
+class InteractionEvent(Base):
+    """
+    Compras, reversiones y reseñas que el recomendador incorpora sin
+    re-entrenar. Cada worker de uvicorn tiene su propia copia del modelo en
+    memoria: el que atiende la petición escribe aquí el evento y todos lo
+    aplican a la suya desde /ml (ver ml_endpoints.sync_interactions). Los ids
+    nunca se reutilizan (AUTOINCREMENT en SQLite): son la marca de agua de
+    cada worker.
+    """
+    __tablename__ = "ml_interacciones"
+    
+    id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, nullable=False)
+    aplicacion_id = Column(Integer, nullable=False)
+    tipo = Column(String(20), nullable=False)  # compra, reversion, resena
+    calificacion = Column(Integer, nullable=True)
+    creado_en = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    
+    __table_args__ = {"sqlite_autoincrement": True}
+
 # Crear tablas
 Base.metadata.create_all(bind=engine)
 
+def dialect_insert(db):
+    """insert() de PostgreSQL o SQLite (>= 3.24): ambos admiten ON CONFLICT DO NOTHING"""
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def migrate_payments():
+    """
+    create_all no modifica tablas existentes: añadir a `pagos` las columnas y
+    los índices únicos que falten. Si la BD ya tiene pagos duplicados el índice no
+    se puede crear; se avisa y la API sigue funcionando sin esa garantía hasta
+    limpiar los datos: /admin/clear-db y /admin/reset-all lo vuelven a
+    intentar con la tabla vacía.
+    """
+    inspector = inspect(engine)
+    existing_columns = {column["name"] for column in inspector.get_columns("pagos")}
+    for name, ddl in (("clave_idempotencia", "VARCHAR(64)"), ("precio_pagado", "FLOAT")):
+        if name in existing_columns:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE pagos ADD COLUMN {name} {ddl}"))
+        except (OperationalError, ProgrammingError):
+            pass  # Otro worker la añadió a la vez
+    
+    existing = {index["name"] for index in inspector.get_indexes("pagos")}
+    for index in Payment.__table__.indexes:
+        if index.name in existing:
+            continue
+        try:
+            index.create(bind=engine)
+        except IntegrityError:
+            print(f"⚠️  No se pudo crear el índice {index.name}: hay pagos duplicados en la BD")
+        except (OperationalError, ProgrammingError):
+            pass  # Otro worker lo creó a la vez
+
+migrate_payments()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,84 @@
+"""
+Servidor LLM falso con la API de OpenAI (/v1/chat/completions) para pruebas
+de carga de /search/ai-search sin gastar tokens ni depender de la red.
+
+Responde con los IDs de los candidatos del prompt que comparten términos con
+la consulta, tras una latencia simulada. También puede fallar o colgarse una
+fracción de las peticiones para probar timeouts y el circuit breaker.
+
+Uso (desde backend/):
+    FAKE_LLM_LATENCY=0.8 uvicorn fake_llm_server:app --port 8100
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=sk-fake uvicorn main:app
+
+Variables:
+    FAKE_LLM_LATENCY     segundos de latencia media (por defecto 0.5)
+    FAKE_LLM_JITTER      variación aleatoria de la latencia, ± segundos (0.2)
+    FAKE_LLM_ERROR_RATE  fracción de peticiones que devuelven 500 (0)
+    FAKE_LLM_HANG_RATE   fracción de peticiones que no responden en 5 minutos (0)
+"""
+
+import asyncio
+import os
+import random
+import re
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from search_index import tokenize
+
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.2"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_HANG_RATE = float(os.getenv("FAKE_LLM_HANG_RATE", "0"))
+MAX_IDS = 10
+
+# Formato de los prompts de ai_search_routes._llm_rerank
+_QUERY_RE = re.compile(r'El usuario busca: "(.*)"')
+_CANDIDATE_RE = re.compile(r"^(\d+) \| (.*)$", re.MULTILINE)
+
+app = FastAPI(title="Fake LLM")
+stats = {"requests": 0, "errors": 0, "hangs": 0}
+
+def _answer(prompt: str) -> str:
+    match = _QUERY_RE.search(prompt)
+    query_terms = set(tokenize(match.group(1))) if match else set()
+    ranked = []
+    for app_id, text in _CANDIDATE_RE.findall(prompt):
+        overlap = len(query_terms & set(tokenize(text)))
+        if overlap:
+            ranked.append((-overlap, int(app_id)))
+    ranked.sort()
+    return ",".join(str(app_id) for _, app_id in ranked[:MAX_IDS]) or "NONE"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["requests"] += 1
+    body = await request.json()
+    roll = random.random()
+    if roll < FAKE_LLM_HANG_RATE:
+        stats["hangs"] += 1
+        await asyncio.sleep(300)
+    await asyncio.sleep(max(0.0, FAKE_LLM_LATENCY + random.uniform(-FAKE_LLM_JITTER, FAKE_LLM_JITTER)))
+    if roll < FAKE_LLM_HANG_RATE + FAKE_LLM_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Fake LLM error", "type": "server_error"}})
+
+    prompt = body["messages"][-1]["content"]
+    content = _answer(prompt)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 2, "total_tokens": 0}
+    }
+
+@app.get("/stats")
+def get_stats():
+    return stats
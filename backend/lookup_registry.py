@@ -0,0 +1,98 @@
+"""
+Registro en memoria de las tablas de referencia `roles` y `categorias`
+
+Login, registro y alta de apps necesitan el id de un rol o una categoría a
+partir de su nombre. Estas tablas tienen unas pocas filas y casi nunca
+cambian, así que cada proceso guarda el mapa nombre -> id y lo recarga:
+- al pedir un nombre que no conoce (otro worker pudo crearlo)
+- cada LOOKUP_REGISTRY_TTL segundos (p. ej. tras un reset hecho en otro worker)
+- al invalidarlo tras repoblar la BD en este proceso (admin_routes)
+
+Los nombres nuevos se crean en una sesión propia que hace commit en el acto:
+así el id guardado en memoria siempre existe en la BD aunque la petición que
+lo pidió haga rollback después.
+"""
+
+import os
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal, Rol, Categoria
+
+LOOKUP_REGISTRY_TTL = float(os.getenv("LOOKUP_REGISTRY_TTL", "60"))
+
+class NameRegistry:
+    def __init__(self, model, ttl: float = LOOKUP_REGISTRY_TTL):
+        self.model = model
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._ids = None  # nombre -> id
+        self._loaded_at = 0.0
+        self.loads = 0
+
+    def _load(self, db: Session):
+        rows = db.query(self.model.id, self.model.nombre).all()
+        ids = {nombre: row_id for row_id, nombre in rows}
+        with self._lock:
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+        return ids
+
+    def _snapshot(self):
+        """
+        Mapa vigente, o None si caducó o se invalidó. Se lee bajo el lock y se
+        usa esa referencia local: invalidate() puede poner _ids a None en
+        cualquier momento.
+        """
+        with self._lock:
+            if self._ids is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._ids
+            return None
+
+    def get_id(self, db: Session, nombre: str):
+        """Id de `nombre` (None si no existe en la BD)"""
+        ids = self._snapshot()
+        if ids is not None and nombre in ids:
+            return ids[nombre]
+        return self._load(db).get(nombre)
+
+    def get_or_create(self, db: Session, nombre: str) -> int:
+        """Id de `nombre`, creando la fila si no existe"""
+        row_id = self.get_id(db, nombre)
+        if row_id is not None:
+            return row_id
+
+        creator = SessionLocal()
+        try:
+            row = self.model(nombre=nombre)
+            creator.add(row)
+            creator.commit()
+            row_id = row.id
+        except IntegrityError:
+            # Otro proceso lo creó a la vez: leer el suyo
+            creator.rollback()
+            row_id = creator.query(self.model.id).filter(self.model.nombre == nombre).scalar()
+        finally:
+            creator.close()
+
+        with self._lock:
+            if self._ids is not None:
+                self._ids[nombre] = row_id
+        return row_id
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = None
+
+    def stats(self) -> dict:
+        return {"size": len(self._ids or {}), "loads": self.loads, "ttl": self.ttl}
+
+roles = NameRegistry(Rol)
+categorias = NameRegistry(Categoria)
+
+def invalidate_lookups():
+    """Olvidar roles y categorías tras modificar esas tablas fuera del registro"""
+    roles.invalidate()
+    categorias.invalidate()
@@ -3,14 +3,43 @@ Endpoints REST para funcionalidades de Machine Learning
 """
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, SessionLocal, App, AppStats, RetrainJob, InteractionEvent, dialect_insert
+from app_stats import average_rating
+from auth import verify_token
 from ml_models.price_optimizer import PriceOptimizer
 from ml_models.recommender import AppRecommender
-from typing import List
-from pydantic import BaseModel
+from ml_models.retrain_jobs import run_training
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import List, Optional
+from pydantic import BaseModel, Field
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
 
-router = APIRouter(prefix="/ml", tags=["Machine Learning"])
+MAX_BATCH_SUGGESTIONS = 500
+MAX_RETRAIN_JOBS_KEPT = 50
+# Un trabajo "running" más antiguo se da por perdido (el worker que lo lanzó se
+# reinició antes de terminar) y deja de bloquear nuevos re-entrenamientos
+RETRAIN_JOB_TIMEOUT = float(os.getenv("ML_RETRAIN_TIMEOUT", "3600"))
+# Cada cuántos segundos comprueba cada worker si hay una versión nueva de los modelos
+MODEL_RELOAD_INTERVAL = float(os.getenv("ML_MODEL_RELOAD_INTERVAL", "2"))
+# Las interacciones más recientes que esto se releen en cada sincronización: en
+# PostgreSQL un id menor puede confirmarse después que uno mayor
+INTERACTIONS_SETTLE = float(os.getenv("ML_INTERACTIONS_SETTLE", "5"))
+INTERACTIONS_BATCH = 1000
+
+def _check_model_versions(db: Session = Depends(get_db)):
+    refresh_models(db=db)
+
+router = APIRouter(prefix="/ml", tags=["Machine Learning"], dependencies=[Depends(_check_model_versions)])
+optional_security = HTTPBearer(auto_error=False)
 
 # Instancias globales de los modelos
 price_optimizer = PriceOptimizer()
@@ -27,6 +56,244 @@ try:
 except:
     print("⚠️  Recommender no cargado, necesita entrenamiento")
 
+def _log_interaction(db: Session, user_id: int, app_id: int, tipo: str, calificacion: int = None):
+    """Guardar la interacción en `ml_interacciones` para que la apliquen los demás workers"""
+    try:
+        db.add(InteractionEvent(usuario_id=user_id, aplicacion_id=app_id, tipo=tipo, calificacion=calificacion))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️  No se pudo registrar la interacción para los demás workers: {e}")
+
+def record_purchase_for_recommendations(db: Session, user_id: int, app_id: int, reverted: bool = False):
+    """
+    Llamar tras confirmar (o revertir) un pago ya guardado: el recomendador de
+    este proceso lo incorpora sin re-entrenar, se descarta el top-K cacheado
+    del comprador y queda registrado para el resto de workers
+    """
+    _log_interaction(db, user_id, app_id, "reversion" if reverted else "compra")
+    try:
+        stats = db.get(AppStats, app_id)
+        if recommender.record_purchase(user_id, app_id, popularity=stats.total_ventas if stats else None, reverted=reverted):
+            return
+    except Exception as e:
+        print(f"⚠️  No se pudo actualizar el Recommender con el pago: {e}")
+    recommender.invalidate_user(user_id)
+
+def record_review_for_recommendations(db: Session, user_id: int, app_id: int, rating: int):
+    """Llamar tras guardar una reseña: actualiza el rating de la compra y la valoración de la app"""
+    _log_interaction(db, user_id, app_id, "resena", rating)
+    try:
+        stats = db.get(AppStats, app_id)
+        recommender.record_review(user_id, app_id, rating, avg_rating=average_rating(stats) if stats else None)
+    except Exception as e:
+        print(f"⚠️  No se pudo actualizar el Recommender con la reseña: {e}")
+        recommender.invalidate_user(user_id)
+
+# ==================== RE-ENTRENAMIENTO EN SEGUNDO PLANO ====================
+# Un único proceso worker ("spawn") entrena fuera del proceso de la API, así el
+# GIL queda libre para atender peticiones. Al terminar se cargan los modelos en
+# instancias nuevas y se sustituyen las globales de una vez: las peticiones en
+# curso siguen usando la instancia anterior hasta que terminan. El estado de
+# cada trabajo se guarda en `ml_reentrenamientos` (database.RetrainJob), así
+# GET /ml/retrain/{job_id} responde igual en todos los workers de uvicorn.
+_retrain_executor = None
+_retrain_lock = threading.Lock()
+
+def _get_retrain_executor():
+    global _retrain_executor
+    if _retrain_executor is None:
+        _retrain_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _retrain_executor
+
+def _loaded_models():
+    return {"price_optimizer": price_optimizer, "recommender": recommender}
+
+def _reload_model(name: str) -> bool:
+    """Cargar la versión activa de un modelo en una instancia nueva y sustituir la global"""
+    global price_optimizer, recommender
+    if name == "price_optimizer":
+        new_price_optimizer = PriceOptimizer()
+        if new_price_optimizer.load():
+            price_optimizer = new_price_optimizer
+            return True
+    elif name == "recommender":
+        new_recommender = AppRecommender(cache_backend=recommender.cache)
+        if new_recommender.load():
+            recommender = new_recommender
+            # Las entradas cacheadas del modelo anterior llevan su versión y se
+            # recalculan al pedirlas; solo los usuarios más activos se precalculan
+            new_recommender.warm_cache_async()
+            return True
+    return False
+
+# ==================== RECARGA ENTRE WORKERS ====================
+# Con `uvicorn --workers N` cada proceso tiene sus propias instancias. El fichero
+# CURRENT del registro hace de número de generación: quien entrena o hace
+# rollback lo cambia y el resto de workers lo detecta en su siguiente petición.
+_reload_lock = threading.Lock()
+_last_reload_check = 0.0
+
+def refresh_models(force: bool = False, db: Session = None):
+    """
+    Recargar los modelos cuya versión activa en disco difiere de la cargada y,
+    con `db`, aplicar las interacciones registradas por otros workers.
+    Sin force, como mucho una comprobación cada MODEL_RELOAD_INTERVAL segundos
+    (leer un fichero de pocos bytes por modelo); si otro hilo ya está
+    recargando, la petición sigue con el modelo actual.
+    """
+    global _last_reload_check
+    now = time.monotonic()
+    if not force and now - _last_reload_check < MODEL_RELOAD_INTERVAL:
+        return
+    if not _reload_lock.acquire(blocking=force):
+        return
+    try:
+        _last_reload_check = now
+        for name, model in _loaded_models().items():
+            current = model.registry.current_version()
+            if current is not None and current != model.version:
+                print(f"🔄 {name}: versión {model.version} -> {current}, recargando")
+                _reload_model(name)
+        if db is not None:
+            sync_interactions(db)
+    finally:
+        _reload_lock.release()
+
+# ==================== INTERACCIONES ENTRE WORKERS ====================
+# record_purchase/record_review solo cambian el modelo del worker que atendió
+# la petición. Los demás leen `ml_interacciones` a partir de su marca de agua
+# (al cargar un modelo, el último evento que ya incluía su entrenamiento) y
+# las aplican a su copia. Aplicar una interacción es idempotente, así que
+# releer las recientes (INTERACTIONS_SETTLE) o las propias no cambia nada.
+
+def _apply_interaction(db: Session, model: AppRecommender, event: InteractionEvent):
+    stats = db.get(AppStats, event.aplicacion_id)
+    if event.tipo == "resena":
+        model.record_review(event.usuario_id, event.aplicacion_id, event.calificacion,
+                            avg_rating=average_rating(stats) if stats else None)
+    else:
+        model.record_purchase(event.usuario_id, event.aplicacion_id,
+                              popularity=stats.total_ventas if stats else None,
+                              reverted=event.tipo == "reversion")
+
+def sync_interactions(db: Session) -> int:
+    """Aplicar al recommender de este worker las interacciones nuevas. Retorna cuántas leyó."""
+    model = recommender
+    if not model.is_trained:
+        return 0
+    events = db.query(InteractionEvent).filter(
+        InteractionEvent.id > model.interactions_watermark
+    ).order_by(InteractionEvent.id).limit(INTERACTIONS_BATCH).all()
+    
+    settled_before = datetime.utcnow() - timedelta(seconds=INTERACTIONS_SETTLE)
+    watermark, settled = model.interactions_watermark, True
+    for event in events:
+        try:
+            _apply_interaction(db, model, event)
+        except Exception as e:
+            print(f"⚠️  No se pudo aplicar la interacción {event.id} al Recommender: {e}")
+        # La marca solo avanza sobre eventos asentados y sin huecos detrás
+        settled = settled and event.creado_en < settled_before
+        if settled:
+            watermark = event.id
+    model.interactions_watermark = watermark
+    return len(events)
+
+def _swap_models(result: dict):
+    """Tras un re-entrenamiento, activar los modelos que se entrenaron bien"""
+    for name, status in result.items():
+        if status == "OK":
+            _reload_model(name)
+
+def _job_response(job: RetrainJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.estado,
+        "created_at": job.creado_en.isoformat(),
+        "finished_at": job.terminado_en.isoformat() if job.terminado_en else None,
+        "result": json.loads(job.resultado) if job.resultado else None,
+        "error": job.error
+    }
+
+def _finish_retrain_job(job_id: str, status: str, result: dict = None, error: str = None):
+    db = SessionLocal()
+    try:
+        db.query(RetrainJob).filter(RetrainJob.id == job_id).update({
+            "estado": status,
+            "terminado_en": datetime.utcnow(),
+            "resultado": json.dumps(result) if result is not None else None,
+            "error": error
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _on_retrain_done(job_id: str, future):
+    global _retrain_executor
+    try:
+        result = future.result()
+        _swap_models(result)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _retrain_executor = None
+        _finish_retrain_job(job_id, "failed", error=str(e))
+        print(f"❌ Re-entrenamiento {job_id} falló: {e}")
+        return
+    _finish_retrain_job(job_id, "completed", result=result)
+    print(f"✅ Re-entrenamiento {job_id} completado: {result}")
+
+def _expire_stale_retrain_jobs(db: Session):
+    """Marcar como fallidos los trabajos "running" que superan RETRAIN_JOB_TIMEOUT"""
+    now = datetime.utcnow()
+    db.query(RetrainJob).filter(
+        RetrainJob.estado == "running",
+        RetrainJob.creado_en < now - timedelta(seconds=RETRAIN_JOB_TIMEOUT)
+    ).update({
+        "estado": "failed",
+        "terminado_en": now,
+        "error": "Sin respuesta del worker que lanzó el re-entrenamiento"
+    }, synchronize_session=False)
+
+def _prune_retrain_jobs(db: Session):
+    """Conservar solo los últimos trabajos terminados"""
+    old_ids = [job_id for (job_id,) in db.query(RetrainJob.id).filter(
+        RetrainJob.estado != "running"
+    ).order_by(RetrainJob.creado_en.desc()).offset(MAX_RETRAIN_JOBS_KEPT).all()]
+    if old_ids:
+        db.query(RetrainJob).filter(RetrainJob.id.in_(old_ids)).delete(synchronize_session=False)
+
+def start_retrain_job(db: Session) -> dict:
+    """
+    Encolar un re-entrenamiento; si ya hay uno en curso (lanzado por este u
+    otro worker) se devuelve ese mismo. El alta es un INSERT ... ON CONFLICT DO
+    NOTHING contra el índice único de trabajos "running": de dos peticiones
+    simultáneas solo una lo inserta.
+    """
+    _expire_stale_retrain_jobs(db)
+    _prune_retrain_jobs(db)
+    job_id = uuid.uuid4().hex
+    stmt = dialect_insert(db)(RetrainJob).values(
+        id=job_id, estado="running", creado_en=datetime.utcnow()
+    ).on_conflict_do_nothing()
+    inserted = db.execute(stmt).rowcount > 0
+    db.commit()
+    
+    if not inserted:
+        running = db.query(RetrainJob).filter(RetrainJob.estado == "running").first()
+        if running is not None:
+            return _job_response(running)
+        return start_retrain_job(db)  # El trabajo en curso terminó entre medias
+    
+    try:
+        with _retrain_lock:
+            future = _get_retrain_executor().submit(run_training)
+    except Exception as e:
+        _finish_retrain_job(job_id, "failed", error=str(e))
+        raise
+    future.add_done_callback(lambda f: _on_retrain_done(job_id, f))
+    return _job_response(db.get(RetrainJob, job_id))
+
 # ==================== SCHEMAS ====================
 class PriceSuggestion(BaseModel):
     current_price: float
@@ -36,6 +303,13 @@ class PriceSuggestion(BaseModel):
     reason: str
     stats: dict
 
+class AppPriceSuggestion(PriceSuggestion):
+    app_id: int
+
+class PriceSuggestionsRequest(BaseModel):
+    # Sin app_ids se usan todas las apps del desarrollador autenticado
+    app_ids: Optional[List[int]] = Field(None, max_length=MAX_BATCH_SUGGESTIONS)
+
 class RecommendedApp(BaseModel):
     id: int
     name: str
@@ -69,6 +343,39 @@ def get_price_suggestion(app_id: int, db: Session = Depends(get_db)):
     
     return suggestion
 
+@router.post("/price-suggestions", response_model=List[AppPriceSuggestion])
+def get_price_suggestions(
+    request: PriceSuggestionsRequest,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+):
+    """
+    Obtener sugerencias de precio para varias apps en una sola llamada
+    
+    - **app_ids**: IDs de las aplicaciones (opcional)
+    - Sin app_ids requiere token y usa todas las apps del desarrollador
+    - Retorna: Una sugerencia por app (features en una consulta, una sola predicción)
+    """
+    if not price_optimizer.is_trained:
+        raise HTTPException(
+            status_code=503,
+            detail="Modelo de optimización de precios no está entrenado. Ejecuta train_models.py"
+        )
+    
+    app_ids = request.app_ids
+    if app_ids is None:
+        if credentials is None:
+            raise HTTPException(status_code=401, detail="Se requiere autenticación o una lista de app_ids")
+        user_id = int(verify_token(credentials.credentials))
+        app_ids = [app_id for (app_id,) in db.query(App.id).filter(App.propietario_id == user_id).all()]
+    
+    suggestions = price_optimizer.suggest_prices(db, app_ids)
+    
+    return [
+        AppPriceSuggestion(app_id=app_id, **suggestions[app_id])
+        for app_id in dict.fromkeys(app_ids) if app_id in suggestions
+    ]
+
 @router.get("/recommendations/{user_id}", response_model=List[RecommendedApp])
 def get_recommendations(user_id: int, top_k: int = 6, db: Session = Depends(get_db)):
     """
@@ -88,27 +395,71 @@ def get_recommendations(user_id: int, top_k: int = 6, db: Session = Depends(get_
     
     return recommendations
 
-@router.post("/retrain")
+@router.post("/retrain", status_code=202)
 def retrain_models(db: Session = Depends(get_db)):
     """
     Re-entrenar ambos modelos ML con datos actualizados
     Solo para uso administrativo
+    
+    - El entrenamiento corre en un proceso aparte; la respuesta es inmediata
+    - Retorna: job_id para consultar el estado en GET /ml/retrain/{job_id}
     """
     try:
-        # Re-entrenar Price Optimizer
-        success_price = price_optimizer.train(db)
-        
-        # Re-entrenar Recommender
-        success_rec = recommender.train(db)
-        
-        return {
-            "message": "Modelos re-entrenados exitosamente",
-            "price_optimizer": "OK" if success_price else "ERROR",
-            "recommender": "OK" if success_rec else "ERROR"
-        }
+        return start_retrain_job(db)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al re-entrenar: {str(e)}")
 
+@router.get("/retrain/{job_id}")
+def get_retrain_status(job_id: str, db: Session = Depends(get_db)):
+    """
+    Estado de un re-entrenamiento: running, completed o failed
+    """
+    job = db.get(RetrainJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo de re-entrenamiento no encontrado")
+    return _job_response(job)
+
+@router.get("/models")
+def get_model_versions():
+    """
+    Versiones guardadas de cada modelo en el registro
+    
+    - **current**: versión activa en disco
+    - **loaded**: versión cargada en este proceso
+    """
+    result = {}
+    for name, model in _loaded_models().items():
+        manifest = model.registry.manifest()
+        result[name] = {
+            "current": model.registry.current_version(),
+            "loaded": model.version,
+            "versions": model.registry.versions(),
+            "created_at": manifest["created_at"] if manifest else None,
+            "metadata": manifest["metadata"] if manifest else None
+        }
+    return result
+
+@router.post("/models/{name}/rollback")
+def rollback_model(name: str, version: Optional[int] = None):
+    """
+    Volver a una versión anterior de un modelo
+    Solo para uso administrativo
+    
+    - **name**: price_optimizer o recommender
+    - **version**: versión a activar (por defecto, la anterior a la activa)
+    """
+    model = _loaded_models().get(name)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Modelo no encontrado")
+    try:
+        version = model.registry.rollback(version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not _reload_model(name):
+        raise HTTPException(status_code=500, detail=f"No se pudo cargar la versión {version} de {name}")
+    return {"model": name, "version": version}
+
 @router.get("/status")
 def get_ml_status():
     """
@@ -117,10 +468,15 @@ def get_ml_status():
     return {
         "price_optimizer": {
             "trained": price_optimizer.is_trained,
-            "status": "ready" if price_optimizer.is_trained else "not_trained"
+            "status": "ready" if price_optimizer.is_trained else "not_trained",
+            "version": price_optimizer.version
         },
         "recommender": {
             "trained": recommender.is_trained,
-            "status": "ready" if recommender.is_trained else "not_trained"
+            "status": "ready" if recommender.is_trained else "not_trained",
+            "version": recommender.version,
+            "incremental_updates": recommender.updates_applied,
+            "interactions_watermark": recommender.interactions_watermark,
+            "cache": recommender.cache.stats()
         }
     }
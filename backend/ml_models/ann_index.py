@@ -0,0 +1,80 @@
+"""
+Índice aproximado de vecinos (ANN) para similitud coseno entre usuarios.
+
+LSH por proyecciones aleatorias (SimHash) implementado en NumPy: cada tabla
+asigna a cada vector un código de `n_bits` bits (signo de su proyección sobre
+hiperplanos aleatorios). Vectores con coseno alto comparten código con alta
+probabilidad, así que una consulta solo compara contra los usuarios de sus
+cubetas (más las de Hamming 1 si hay pocos candidatos) en vez de contra todos.
+
+Las cubetas se guardan como arrays ordenados (códigos + permutación) para que
+el índice se persista como arrays planos en el registro de modelos.
+"""
+
+import numpy as np
+
+class RandomProjectionLSH:
+    def __init__(self, n_tables: int = 16, n_bits: int = 6, seed: int = 42):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+        self.planes = None        # (n_tables, dim, n_bits)
+        self.sorted_codes = None  # (n_tables, n_vectors) códigos ordenados por tabla
+        self.order = None         # (n_tables, n_vectors) fila original de cada código
+        self._powers = 1 << np.arange(n_bits, dtype=np.int64)
+    
+    def _codes(self, matrix, table: int):
+        projections = matrix @ self.planes[table]
+        return (np.asarray(projections) > 0).astype(np.int64) @ self._powers
+    
+    def build(self, matrix):
+        """Indexar las filas de `matrix` (dispersa o densa, n_vectors × dim)"""
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((self.n_tables, matrix.shape[1], self.n_bits)).astype(np.float32)
+        self.sorted_codes = np.empty((self.n_tables, matrix.shape[0]), dtype=np.int64)
+        self.order = np.empty((self.n_tables, matrix.shape[0]), dtype=np.int32)
+        for table in range(self.n_tables):
+            codes = self._codes(matrix, table)
+            order = np.argsort(codes, kind='stable')
+            self.order[table] = order
+            self.sorted_codes[table] = codes[order]
+        return self
+    
+    def _bucket(self, table: int, code: int):
+        codes = self.sorted_codes[table]
+        start = np.searchsorted(codes, code, side='left')
+        end = np.searchsorted(codes, code, side='right')
+        return self.order[table][start:end]
+    
+    def candidates(self, vector, min_candidates: int = 0):
+        """Filas que comparten cubeta con `vector` en alguna tabla (multi-probe si hay pocas)"""
+        query_codes = [int(self._codes(vector, table)[0]) for table in range(self.n_tables)]
+        found = np.unique(np.concatenate([
+            self._bucket(table, code) for table, code in enumerate(query_codes)
+        ]))
+        if len(found) >= min_candidates:
+            return found
+        
+        probes = [found]
+        for table, code in enumerate(query_codes):
+            for bit in range(self.n_bits):
+                probes.append(self._bucket(table, code ^ (1 << bit)))
+        return np.unique(np.concatenate(probes))
+    
+    def to_arrays(self):
+        """Arrays que definen el índice (para guardarlo en el registro de modelos)"""
+        return {
+            'planes': self.planes,
+            'sorted_codes': self.sorted_codes,
+            'order': self.order,
+            'params': np.array([self.n_tables, self.n_bits, self.seed])
+        }
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        n_tables, n_bits, seed = (int(v) for v in arrays['params'])
+        index = cls(n_tables=n_tables, n_bits=n_bits, seed=seed)
+        index.planes = arrays['planes']
+        index.sorted_codes = arrays['sorted_codes']
+        index.order = arrays['order']
+        return index
@@ -0,0 +1,68 @@
+"""
+Benchmark recall vs latencia del índice LSH de usuarios frente a la búsqueda exacta.
+
+Uso (desde backend/):
+    python -m ml_models.benchmark_ann --dataset large --scale 20
+
+Para cada configuración (tablas × bits) mide el recall@5 de los usuarios
+similares devueltos en modo "ann" respecto al modo "exact" y la latencia media
+de la búsqueda de vecinos. Con datos dispersos hay muchos empates de similitud,
+así que un vecino cuenta como acierto si su similitud alcanza la del 5º exacto.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from ml_models.benchmark_recommender import generate_data, DATASET_CONFIG
+from ml_models.recommender import AppRecommender, SIMILAR_USERS
+from ml_models.recommendation_cache import MemoryBackend
+from ml_models.ann_index import RandomProjectionLSH
+
+CONFIGS = [(8, 6), (16, 6), (32, 6), (16, 8), (32, 8), (8, 12)]
+
+def search(recommender, rows):
+    start = time.perf_counter()
+    results = [recommender._similar_users(row, SIMILAR_USERS)[1] for row in rows]
+    return results, (time.perf_counter() - start) / len(rows)
+
+def recall(approx, exact):
+    """Fracción de los k vecinos exactos igualados por el ANN (con empates)"""
+    hits = []
+    for approx_sims, exact_sims in zip(approx, exact):
+        if len(exact_sims) == 0:
+            continue
+        threshold = exact_sims[-1] - 1e-6
+        hits.append(min(np.sum(approx_sims >= threshold), len(exact_sims)) / len(exact_sims))
+    return float(np.mean(hits))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='large', choices=list(DATASET_CONFIG))
+    parser.add_argument('--scale', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+    
+    df_purchases, df_apps = generate_data(DATASET_CONFIG[args.dataset], args.scale)
+    recommender = AppRecommender(cache_backend=MemoryBackend())
+    recommender.fit(df_purchases, df_apps)
+    rows = np.random.default_rng(0).choice(len(recommender.user_ids), size=args.queries, replace=False)
+    
+    recommender.search_mode = 'exact'
+    exact, exact_latency = search(recommender, rows)
+    print(f"Usuarios: {len(recommender.user_ids)}  Apps: {len(recommender.app_ids)}  Consultas: {len(rows)}")
+    print(f"{'modo':>14} | {'recall@5':>8} | {'ms/consulta':>11} | {'speedup':>7}")
+    print(f"{'exact':>14} | {1.0:>8.3f} | {exact_latency * 1000:>11.3f} | {1.0:>6.1f}x")
+    
+    recommender.search_mode = 'ann'
+    for n_tables, n_bits in CONFIGS:
+        recommender.ann_index = RandomProjectionLSH(n_tables=n_tables, n_bits=n_bits).build(recommender.user_item_matrix)
+        approx, latency = search(recommender, rows)
+        print(f"{f'ann {n_tables}x{n_bits}':>14} | {recall(approx, exact):>8.3f} | {latency * 1000:>11.3f} | {exact_latency / latency:>6.1f}x")
+
+if __name__ == '__main__':
+    main()
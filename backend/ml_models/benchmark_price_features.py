@@ -0,0 +1,123 @@
+"""
+Benchmark de extracción de features del Price Optimizer:
+consulta por app (implementación anterior, ~5N consultas) vs consulta agrupada única.
+
+Uso (desde backend/):
+    python -m ml_models.benchmark_price_features --sizes 1000 10000 100000
+
+Genera una base SQLite temporal por tamaño; la versión por app se omite por
+encima de --legacy-max apps porque su coste crece cuadráticamente.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'appswap_benchmark.db')}")
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+from database import Base, Rol, User, Categoria, App, Payment, Review
+import app_stats
+from ml_models.price_optimizer import PriceOptimizer
+
+SALES_PER_APP = 5
+REVIEWS_PER_APP = 3
+CATEGORIES = 10
+
+def legacy_prepare_data(db):
+    """Implementación anterior: cuatro agregados + carga perezosa de categoría por app"""
+    import pandas as pd
+    data = []
+    for app in db.query(App).all():
+        total_sales = db.query(func.count(Payment.id))\
+            .filter(Payment.aplicacion_id == app.id, Payment.estado == 'confirmado')\
+            .scalar() or 0
+        avg_rating = db.query(func.avg(Review.calificacion))\
+            .filter(Review.aplicacion_id == app.id)\
+            .scalar() or 3.0
+        month_ago = datetime.now() - timedelta(days=30)
+        recent_sales = db.query(func.count(Payment.id))\
+            .filter(Payment.aplicacion_id == app.id,
+                    Payment.estado == 'confirmado',
+                    Payment.fecha_creacion >= month_ago)\
+            .scalar() or 0
+        competitor_avg_price = db.query(func.avg(App.precio))\
+            .filter(App.categoria_id == app.categoria_id, App.id != app.id)\
+            .scalar() or app.precio
+        data.append({
+            'app_id': app.id,
+            'category': app.categoria_obj.nombre,
+            'current_price': app.precio,
+            'total_sales': total_sales,
+            'recent_sales': recent_sales,
+            'avg_rating': float(avg_rating),
+            'competitor_avg_price': float(competitor_avg_price),
+        })
+    return pd.DataFrame(data)
+
+def build_database(path, n_apps):
+    """Crear una base SQLite con n_apps apps, sus ventas y reseñas"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    
+    with engine.begin() as conn:
+        conn.execute(insert(Rol), [{'id': 1, 'nombre': 'desarrollador'}, {'id': 2, 'nombre': 'usuario'}])
+        # Un comprador por venta de cada app: pagos tiene una compra confirmada por (app, comprador)
+        conn.execute(insert(User), [{'id': 1, 'correo': 'dev@bench', 'nombre': 'dev', 'contrasena': '-', 'rol_id': 1}] + [
+            {'id': b + 2, 'correo': f'buyer{b}@bench', 'nombre': f'buyer {b}', 'contrasena': '-', 'rol_id': 2}
+            for b in range(SALES_PER_APP)
+        ])
+        conn.execute(insert(Categoria), [{'id': i + 1, 'nombre': f'Categoria {i}'} for i in range(CATEGORIES)])
+        conn.execute(insert(App), [{
+            'id': i + 1, 'nombre': f'App {i}', 'descripcion': '', 'categoria_id': i % CATEGORIES + 1,
+            'url_aplicacion': '', 'propietario_id': 1, 'precio': round(rng.uniform(5, 60), 2)
+        } for i in range(n_apps)])
+        conn.execute(insert(Payment), [{
+            'aplicacion_id': i % n_apps + 1, 'comprador_id': i // n_apps + 2, 'estado': 'confirmado',
+            'codigo_qr': f'QR-{i}', 'fecha_creacion': now - timedelta(days=rng.randint(0, 180))
+        } for i in range(n_apps * SALES_PER_APP)])
+        conn.execute(insert(Review), [{
+            'aplicacion_id': i % n_apps + 1, 'autor_id': 2, 'calificacion': rng.randint(1, 5),
+            'comentario': '', 'fecha_creacion': now
+        } for i in range(n_apps * REVIEWS_PER_APP)])
+    
+    session = sessionmaker(bind=engine)()
+    app_stats.rebuild(session)
+    return session
+
+def timed(fn, db):
+    start = time.perf_counter()
+    df = fn(db)
+    return time.perf_counter() - start, len(df)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=10000)
+    args = parser.parse_args()
+    
+    print(f"{'apps':>8} | {'por app (s)':>12} | {'agrupada (s)':>12} | {'speedup':>8}")
+    print("-" * 50)
+    for n_apps in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = build_database(os.path.join(tmp, 'bench.db'), n_apps)
+            try:
+                grouped_time, _ = timed(PriceOptimizer().prepare_data, db)
+                if n_apps <= args.legacy_max:
+                    legacy_time, _ = timed(legacy_prepare_data, db)
+                    print(f"{n_apps:>8} | {legacy_time:>12.3f} | {grouped_time:>12.3f} | {legacy_time / grouped_time:>7.1f}x")
+                else:
+                    print(f"{n_apps:>8} | {'omitido':>12} | {grouped_time:>12.3f} | {'-':>8}")
+            finally:
+                db.close()
+
+if __name__ == '__main__':
+    main()
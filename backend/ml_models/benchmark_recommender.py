@@ -0,0 +1,128 @@
+"""
+Benchmark de memoria y latencia del recomendador: matriz densa (pivot_table +
+similitud N×N) vs matriz dispersa CSR + top-N vecinos por app.
+
+Uso (desde backend/):
+    python -m ml_models.benchmark_recommender --dataset large --scale 1 10 100
+
+Los datos se generan en memoria con la configuración de seed_database.DATASET_CONFIG;
+--scale multiplica usuarios y apps para proyectar el crecimiento.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'appswap_benchmark.db')}")
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
+from seed_database import DATASET_CONFIG
+from ml_models.recommender import AppRecommender
+from ml_models.recommendation_cache import MemoryBackend
+
+LATENCY_SAMPLES = 200
+
+def generate_data(config, scale, seed=42):
+    """Compras y features de apps sintéticas con la forma de DATASET_CONFIG"""
+    rng = np.random.default_rng(seed)
+    n_users = config['buyers'] * scale
+    n_apps = int(config['vendors'] * np.mean(config['apps_per_vendor'])) * scale
+    purchases_per_user = rng.integers(*config['purchases_per_buyer'], size=n_users, endpoint=True)
+    
+    user_ids = np.repeat(np.arange(1, n_users + 1), purchases_per_user)
+    # Popularidad sesgada: unas pocas apps concentran la mayoría de compras
+    app_ids = (rng.zipf(1.3, size=len(user_ids)) - 1) % n_apps + 1
+    df_purchases = pd.DataFrame({
+        'user_id': user_ids,
+        'app_id': app_ids,
+        'purchased': 1,
+        'rating': rng.integers(1, 6, size=len(user_ids)).astype(float)
+    })
+    
+    popularity = np.bincount(app_ids, minlength=n_apps + 1)[1:]
+    df_apps = pd.DataFrame({
+        'app_id': np.arange(1, n_apps + 1),
+        'category_id': rng.integers(1, 11, size=n_apps),
+        'price': rng.uniform(5, 60, size=n_apps).round(2),
+        'avg_rating': rng.uniform(1, 5, size=n_apps),
+        'popularity': popularity
+    })
+    return df_purchases, df_apps
+
+def mb(n_bytes):
+    return n_bytes / 1024 ** 2
+
+def dense_bytes(n_users, n_apps):
+    """Memoria del modelo anterior: pivot usuarios×apps y similitud apps×apps, float64"""
+    return n_users * n_apps * 8 + n_apps * n_apps * 8
+
+def dense_footprint(df_purchases, n_users, n_apps):
+    """
+    Memoria (calculada, sin reservar la similitud N×N) y tiempos del modelo
+    anterior; el pivot sí se construye para medir la latencia colaborativa
+    """
+    start = time.perf_counter()
+    pivot = df_purchases.pivot_table(index='user_id', columns='app_id', values='rating', fill_value=0)
+    fit_time = time.perf_counter() - start
+    
+    row = pivot.values[:1]
+    start = time.perf_counter()
+    for _ in range(20):
+        similarity = cosine_similarity(row, pivot.values)[0]
+        np.argsort(similarity)
+    latency = (time.perf_counter() - start) / 20
+    return mb(dense_bytes(n_users, n_apps)), fit_time, latency
+
+def sparse_footprint(df_purchases, df_apps):
+    recommender = AppRecommender(cache_backend=MemoryBackend())
+    start = time.perf_counter()
+    recommender.fit(df_purchases, df_apps.copy())
+    fit_time = time.perf_counter() - start
+    
+    matrix = recommender.user_item_matrix
+    size = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes \
+        + recommender.item_neighbors.nbytes + recommender.item_neighbor_scores.nbytes
+    
+    rng = np.random.default_rng(0)
+    sample = rng.choice(recommender.user_ids, size=min(LATENCY_SAMPLES, len(recommender.user_ids)), replace=False)
+    start = time.perf_counter()
+    for user_id in sample:
+        row = recommender._user_row(int(user_id))
+        recommender._rank(int(user_id), set(int(a) for a in recommender._user_app_ids(row)), 6)
+    latency = (time.perf_counter() - start) / len(sample)
+    return mb(size), fit_time, latency
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='large', choices=list(DATASET_CONFIG))
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--dense-max-cells', type=float, default=5e8,
+                        help='No construir la matriz densa por encima de usuarios×apps')
+    args = parser.parse_args()
+    
+    config = DATASET_CONFIG[args.dataset]
+    print(f"Dataset: {args.dataset} {config}")
+    print(f"{'usuarios':>9} {'apps':>7} {'compras':>9} | {'densa MB':>9} {'fit s':>7} {'colab ms':>9} "
+          f"| {'CSR MB':>7} {'fit s':>7} {'rank ms':>8}")
+    for scale in args.scale:
+        df_purchases, df_apps = generate_data(config, scale)
+        n_users, n_apps = df_purchases['user_id'].nunique(), len(df_apps)
+        
+        if n_users * n_apps <= args.dense_max_cells:
+            dense_mb, dense_fit, dense_latency = dense_footprint(df_purchases, n_users, n_apps)
+            dense_cols = f"{dense_mb:>9.1f} {dense_fit:>7.2f} {dense_latency * 1000:>9.2f}"
+        else:
+            dense_cols = f"{mb(dense_bytes(n_users, n_apps)):>8.0f}* {'-':>7} {'-':>9}"
+        
+        sparse_mb, sparse_fit, sparse_latency = sparse_footprint(df_purchases, df_apps)
+        print(f"{n_users:>9} {n_apps:>7} {len(df_purchases):>9} | {dense_cols} "
+              f"| {sparse_mb:>7.2f} {sparse_fit:>7.2f} {sparse_latency * 1000:>8.2f}")
+    print("* estimado (no construido)")
+
+if __name__ == '__main__':
+    main()
@@ -9,60 +9,82 @@ from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, r2_score
-import joblib
 import os
 from datetime import datetime, timedelta
+from .registry import ModelRegistry
+
+FEATURE_COLUMNS = ['app_id', 'category', 'current_price', 'total_sales',
+                   'recent_sales', 'avg_rating', 'competitor_avg_price']
 
 class PriceOptimizer:
     def __init__(self):
         self.model = LinearRegression()
         self.category_encoder = LabelEncoder()
         self.is_trained = False
-        self.model_path = "ml_models/models/price_optimizer.pkl"
-        self.encoder_path = "ml_models/models/category_encoder.pkl"
-        
-    def prepare_data(self, db):
-        """Preparar datos desde la base de datos"""
-        from database import App, Payment, Review
+        self.registry = ModelRegistry("price_optimizer")
+        self.version = None
+        
+    def prepare_data(self, db, app_ids=None):
+        """
+        Preparar datos desde la base de datos.
+        Una sola consulta agrupada para todas las apps (o solo `app_ids`):
+        contadores de app_stats, ventas de los últimos 30 días y precio medio
+        de la competencia por categoría.
+        """
+        from database import App, Categoria, AppStats
+        from app_stats import recent_sales_query
         from sqlalchemy import func
         
-        # Obtener todas las apps con sus estadísticas
-        apps = db.query(App).all()
-        
-        data = []
-        for app in apps:
-            # Calcular estadísticas
-            total_sales = db.query(func.count(Payment.id))\
-                .filter(Payment.aplicacion_id == app.id, Payment.estado == 'confirmado')\
-                .scalar() or 0
-            
-            avg_rating = db.query(func.avg(Review.calificacion))\
-                .filter(Review.aplicacion_id == app.id)\
-                .scalar() or 3.0
-            
-            # Ventas último mes
-            month_ago = datetime.now() - timedelta(days=30)
-            recent_sales = db.query(func.count(Payment.id))\
-                .filter(Payment.aplicacion_id == app.id, 
-                       Payment.estado == 'confirmado',
-                       Payment.fecha_creacion >= month_ago)\
-                .scalar() or 0
-            
-            competitor_avg_price = db.query(func.avg(App.precio))\
-                .filter(App.categoria_id == app.categoria_id, App.id != app.id)\
-                .scalar() or app.precio
-            
-            data.append({
-                'app_id': app.id,
-                'category': app.categoria_obj.nombre,
-                'current_price': app.precio,
-                'total_sales': total_sales,
-                'recent_sales': recent_sales,
-                'avg_rating': float(avg_rating),
-                'competitor_avg_price': float(competitor_avg_price),
-            })
-        
-        return pd.DataFrame(data)
+        recent = recent_sales_query(db)
+        category_prices = db.query(
+            App.categoria_id.label('categoria_id'),
+            func.sum(App.precio).label('price_sum'),
+            func.count(App.id).label('app_count')
+        ).group_by(App.categoria_id).subquery()
+        
+        query = db.query(
+            App.id.label('app_id'),
+            Categoria.nombre.label('category'),
+            App.precio.label('current_price'),
+            func.coalesce(AppStats.total_ventas, 0).label('total_sales'),
+            func.coalesce(recent.c.ventas_recientes, 0).label('recent_sales'),
+            AppStats.suma_calificaciones.label('rating_sum'),
+            AppStats.num_resenas.label('rating_count'),
+            category_prices.c.price_sum,
+            category_prices.c.app_count
+        ).join(Categoria, App.categoria_id == Categoria.id)\
+            .join(category_prices, category_prices.c.categoria_id == App.categoria_id)\
+            .outerjoin(AppStats, AppStats.aplicacion_id == App.id)\
+            .outerjoin(recent, recent.c.aplicacion_id == App.id)
+        
+        if app_ids is not None:
+            query = query.filter(App.id.in_(app_ids))
+        
+        df = pd.DataFrame(query.all(), columns=[
+            'app_id', 'category', 'current_price', 'total_sales', 'recent_sales',
+            'rating_sum', 'rating_count', 'price_sum', 'app_count'
+        ])
+        if df.empty:
+            return df.assign(avg_rating=[], competitor_avg_price=[])[FEATURE_COLUMNS]
+        
+        df['current_price'] = df['current_price'].fillna(0.0).astype(float)
+        df['total_sales'] = df['total_sales'].astype(int)
+        df['recent_sales'] = df['recent_sales'].astype(int)
+        
+        # Rating promedio (3.0 si la app no tiene reseñas)
+        rating_count = df['rating_count'].fillna(0)
+        df['avg_rating'] = np.where(
+            rating_count > 0,
+            df['rating_sum'].fillna(0) / rating_count.where(rating_count > 0, 1),
+            3.0
+        )
+        
+        # Precio medio del resto de apps de la categoría (propio precio si no hay competencia)
+        others = df['app_count'] - 1
+        competitor = (df['price_sum'].astype(float) - df['current_price']) / others.where(others > 0, 1)
+        df['competitor_avg_price'] = np.where((others > 0) & (competitor != 0), competitor, df['current_price'])
+        
+        return df[FEATURE_COLUMNS]
     
     def train(self, db):
         """Entrenar el modelo"""
@@ -102,59 +124,62 @@ class PriceOptimizer:
         print(f"   R²: {r2:.3f}")
         
         self.is_trained = True
-        self.save()
+        self.save({'mae': float(mae), 'r2': float(r2), 'n_apps': len(df)})
         return True
     
     def suggest_price(self, db, app_id: int):
         """Sugerir precio óptimo para una app"""
-        if not self.is_trained:
-            return None
-        
-        from database import App, Payment, Review
-        from sqlalchemy import func
+        return self.suggest_prices(db, [app_id]).get(app_id)
+    
+    def suggest_prices(self, db, app_ids):
+        """
+        Sugerir precios para varias apps a la vez: las features salen de una
+        sola consulta y el modelo predice la matriz completa en una llamada.
+        Retorna {app_id: sugerencia}; se omiten apps inexistentes o de
+        categorías que el modelo no conoce.
+        """
+        if not self.is_trained or not app_ids:
+            return {}
+        
+        df = self.prepare_data(db, app_ids=list(app_ids))
+        df = df[df['category'].isin(self.category_encoder.classes_)]
+        if df.empty:
+            return {}
+        
+        features = np.column_stack([
+            self.category_encoder.transform(df['category']),
+            df['total_sales'].values,
+            df['recent_sales'].values,
+            df['avg_rating'].values,
+            df['competitor_avg_price'].values
+        ])
+        suggested_prices = self.model.predict(features)
         
-        app = db.query(App).filter(App.id == app_id).first()
-        if not app:
-            return None
-        
-        # Calcular features actuales
-        total_sales = db.query(func.count(Payment.id))\
-            .filter(Payment.aplicacion_id == app.id, Payment.estado == 'confirmado')\
-            .scalar() or 0
-        
-        month_ago = datetime.now() - timedelta(days=30)
-        recent_sales = db.query(func.count(Payment.id))\
-            .filter(Payment.aplicacion_id == app.id, 
-                   Payment.estado == 'confirmado',
-                   Payment.fecha_creacion >= month_ago)\
-            .scalar() or 0
-        
-        avg_rating = db.query(func.avg(Review.calificacion))\
-            .filter(Review.aplicacion_id == app.id)\
-            .scalar() or 3.0
-        
-        competitor_avg_price = db.query(func.avg(App.precio))\
-            .filter(App.categoria_id == app.categoria_id, App.id != app.id)\
-            .scalar() or app.precio
-        
-        category_encoded = self.category_encoder.transform([app.categoria_obj.nombre])[0]
-        features = np.array([[
-            category_encoded,
-            total_sales,
-            recent_sales,
-            float(avg_rating),
-            float(competitor_avg_price)
-        ]])
-        
-        suggested_price = self.model.predict(features)[0]
-        
-        price_diff = abs(suggested_price - app.precio)
-        confidence = max(0.5, 1.0 - (price_diff / app.precio))
-        
-        if suggested_price > app.precio:
-            impact = f"+{((suggested_price / app.precio - 1) * 100):.0f}% ingresos potenciales"
-        elif suggested_price < app.precio:
-            impact = f"+{((app.precio / suggested_price - 1) * 30):.0f}% ventas estimadas"
+        return {
+            int(row.app_id): self._build_suggestion(row, suggested_price)
+            for row, suggested_price in zip(df.itertuples(index=False), suggested_prices)
+        }
+    
+    def _build_suggestion(self, row, suggested_price):
+        """Construir la respuesta (confianza, impacto, razón) para una predicción"""
+        current_price = row.current_price
+        avg_rating = row.avg_rating
+        recent_sales = int(row.recent_sales)
+        competitor_avg_price = row.competitor_avg_price
+        
+        if current_price > 0:
+            price_diff = abs(suggested_price - current_price)
+            confidence = max(0.5, 1.0 - (price_diff / current_price))
+        else:
+            confidence = 0.5
+        
+        if suggested_price > current_price:
+            if current_price > 0:
+                impact = f"+{((suggested_price / current_price - 1) * 100):.0f}% ingresos potenciales"
+            else:
+                impact = "Nuevos ingresos potenciales"
+        elif suggested_price < current_price:
+            impact = f"+{((current_price / max(suggested_price, 0.01) - 1) * 30):.0f}% ventas estimadas"
         else:
             impact = "Precio actual es óptimo"
         
@@ -168,32 +193,44 @@ class PriceOptimizer:
             reason = f"Basado en análisis de mercado y demanda"
         
         return {
-            'current_price': round(app.precio, 2),
-            'suggested_price': round(max(5.0, suggested_price), 2),  # Mínimo $5
-            'confidence': round(confidence, 2),
+            'current_price': round(float(current_price), 2),
+            'suggested_price': round(float(max(5.0, suggested_price)), 2),  # Mínimo $5
+            'confidence': round(float(confidence), 2),
             'impact': impact,
             'reason': reason,
             'stats': {
-                'total_sales': total_sales,
+                'total_sales': int(row.total_sales),
                 'recent_sales': recent_sales,
                 'avg_rating': round(float(avg_rating), 1),
                 'competitor_avg': round(float(competitor_avg_price), 2)
             }
         }
     
-    def save(self):
-        """Guardar modelo"""
-        os.makedirs("ml_models/models", exist_ok=True)
-        joblib.dump(self.model, self.model_path)
-        joblib.dump(self.category_encoder, self.encoder_path)
-        print(f"💾 Modelo guardado en {self.model_path}")
+    def save(self, metrics: dict = None):
+        """Guardar coeficientes y categorías como una versión nueva del registro"""
+        arrays = {
+            'coef': self.model.coef_,
+            'intercept': np.atleast_1d(self.model.intercept_),
+            'category_classes': np.asarray(self.category_encoder.classes_).astype(str)
+        }
+        self.version = self.registry.save(arrays, metrics)
+        print(f"💾 Modelo guardado en {self.registry.path} (versión {self.version})")
     
-    def load(self):
-        """Cargar modelo"""
-        if os.path.exists(self.model_path) and os.path.exists(self.encoder_path):
-            self.model = joblib.load(self.model_path)
-            self.category_encoder = joblib.load(self.encoder_path)
-            self.is_trained = True
-            print("✅ Modelo Price Optimizer cargado")
-            return True
-        return False
+    def load(self, version: int = None):
+        """Cargar la versión activa del registro (o `version`)"""
+        manifest, arrays = self.registry.load(version)
+        if manifest is None:
+            if os.path.exists("ml_models/models/price_optimizer.pkl"):
+                print("⚠️  Modelo Price Optimizer en formato pickle antiguo, necesita re-entrenamiento")
+            return False
+        
+        self.model = LinearRegression()
+        self.model.coef_ = np.asarray(arrays['coef'])
+        self.model.intercept_ = float(arrays['intercept'][0])
+        self.model.n_features_in_ = len(self.model.coef_)
+        self.category_encoder = LabelEncoder()
+        self.category_encoder.classes_ = np.asarray(arrays['category_classes'])
+        self.version = manifest['version']
+        self.is_trained = True
+        print(f"✅ Modelo Price Optimizer cargado (versión {self.version})")
+        return True
@@ -0,0 +1,118 @@
+"""
+Cache de recomendaciones top-K por usuario.
+
+Cada entrada se calcula en la primera petición del usuario (y, al cargar un
+modelo, en segundo plano para los más activos) y se invalida por usuario
+cuando cambian sus pagos, de modo que /ml/recommendations/{user_id} suele ser
+una búsqueda en diccionario (más la consulta de las compras del usuario, que
+se filtran también de las entradas cacheadas: con el backend "memory" cada
+worker tiene su propia caché y la invalidación solo llega al que atendió el pago). Las entradas llevan la versión del modelo que las
+calculó: tras cargar otra versión se recalculan sin vaciar la cache. El almacenamiento es intercambiable:
+
+- "memory" (por defecto): LRU con TTL dentro del proceso
+- "redis": cualquier cliente con la interfaz get/setex/delete de redis-py
+  (REDIS_URL), o LocalRedis, un sustituto local en memoria para desarrollo
+"""
+
+import json
+import os
+import threading
+import time
+from ttl_cache import TTLCache
+
+CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600"))
+CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "50000"))
+CACHE_BACKEND = os.getenv("RECOMMENDATION_CACHE_BACKEND", "memory")
+
+class MemoryBackend:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    def get(self, key):
+        return self._cache.get(key)
+    
+    def set(self, key, value):
+        self._cache.set(key, value)
+    
+    def delete(self, key):
+        self._cache.delete(key)
+    
+    def clear(self):
+        self._cache.clear()
+    
+    def stats(self):
+        return {"backend": "memory", **self._cache.stats()}
+
+class LocalRedis:
+    """Sustituto mínimo de un servidor Redis (get/setex/delete/scan_iter) para desarrollo y pruebas"""
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                del self._data[key]
+                return None
+            return item[1]
+    
+    def setex(self, key, ttl, value):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+    
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+    
+    def scan_iter(self, match=None):
+        prefix = match.rstrip('*') if match else ''
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+        return iter(keys)
+
+class RedisBackend:
+    """Guarda las recomendaciones serializadas en JSON en un cliente tipo Redis"""
+    def __init__(self, client, prefix="recs:", ttl=CACHE_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        raw = self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+    
+    def set(self, key, value):
+        self.client.setex(f"{self.prefix}{key}", self.ttl, json.dumps(value))
+    
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+    
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+    
+    def stats(self):
+        return {"backend": "redis", "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+def create_backend(kind: str = CACHE_BACKEND):
+    """Crear el backend configurado en RECOMMENDATION_CACHE_BACKEND"""
+    if kind == "redis":
+        redis_url = os.getenv("REDIS_URL")
+        if redis_url:
+            try:
+                import redis
+                return RedisBackend(redis.Redis.from_url(redis_url))
+            except ImportError:
+                print("⚠️  Paquete redis no instalado, usando sustituto local")
+        return RedisBackend(LocalRedis())
+    return MemoryBackend()
@@ -5,23 +5,117 @@ Combina filtrado colaborativo + basado en contenido
 
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
 from sklearn.preprocessing import LabelEncoder
-import joblib
 import os
+import threading
+from .recommendation_cache import create_backend
+from .ann_index import RandomProjectionLSH
+from .registry import ModelRegistry
+
+# Número de recomendaciones precalculadas por usuario (cubre los top_k habituales)
+CACHED_TOP_K = int(os.getenv("RECOMMENDATION_CACHE_K", "20"))
+# Usuarios más activos cuyo top-K se precalcula en segundo plano al cargar un modelo (0 = ninguno)
+WARM_USERS = int(os.getenv("RECOMMENDATION_WARM_USERS", "500"))
+# Vecinos más similares que se guardan por app (en lugar de la matriz N×N completa)
+ITEM_NEIGHBORS = int(os.getenv("RECOMMENDER_ITEM_NEIGHBORS", "20"))
+SIMILARITY_BLOCK_SIZE = 1024
+# Celdas nuevas que se acumulan antes de fusionarlas en la matriz CSR (cada fusión es O(nnz))
+MERGE_BATCH = int(os.getenv("RECOMMENDER_MERGE_BATCH", "256"))
+# Búsqueda de usuarios similares: "exact" (contra todos) o "ann" (índice LSH)
+SEARCH_MODE = os.getenv("RECOMMENDER_SEARCH_MODE", "exact")
+ANN_TABLES = int(os.getenv("RECOMMENDER_ANN_TABLES", "16"))
+ANN_BITS = int(os.getenv("RECOMMENDER_ANN_BITS", "6"))
+ANN_MIN_CANDIDATES = int(os.getenv("RECOMMENDER_ANN_MIN_CANDIDATES", "50"))
+SIMILAR_USERS = 5
+# Apps más populares que se suman como complemento a cada recomendación
+POPULAR_CANDIDATES = 10
+
+def top_k_indices(values, k):
+    """
+    Índices de los k valores más altos, de mayor a menor, con np.argpartition
+    (O(n) en lugar de ordenar todo el array). En caso de empate gana el índice
+    menor, igual que DataFrame.nlargest(keep='first').
+    """
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int32)
+    if k < len(values):
+        kth = values[np.argpartition(-values, k - 1)[:k]].min()
+        candidates = np.flatnonzero(values >= kth)
+    else:
+        candidates = np.arange(len(values))
+    order = np.argsort(-values[candidates], kind='stable')[:k]
+    return candidates[order].astype(np.int32)
+
+def top_item_neighbors(features, n_neighbors, block_size=SIMILARITY_BLOCK_SIZE):
+    """
+    Top-N vecinos por similitud coseno, calculados por bloques de filas para
+    no materializar nunca la matriz N×N. Excluye a la propia app.
+    Retorna (índices int32, similitudes float32), ambos de forma (N, n_neighbors).
+    """
+    n_items = len(features)
+    k = min(n_neighbors, n_items - 1)
+    neighbors = np.zeros((n_items, max(k, 0)), dtype=np.int32)
+    scores = np.zeros((n_items, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return neighbors, scores
+    
+    normalized = _normalize_rows(features)
+    for start in range(0, n_items, block_size):
+        end = min(start + block_size, n_items)
+        neighbors[start:end], scores[start:end] = _block_neighbors(normalized, start, end, k)
+    
+    return neighbors, scores
+
+def _normalize_rows(features):
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.where(norms == 0, 1, norms)
+
+def _block_neighbors(normalized, start, end, k):
+    """Top-k vecinos (coseno) de las filas start:end contra todas las demás"""
+    return _rows_neighbors(normalized, np.arange(start, end), k)
+
+def _rows_neighbors(normalized, rows, k):
+    """Top-k vecinos (coseno) de las filas `rows` contra todas las demás"""
+    sims = normalized[rows] @ normalized.T
+    sims[np.arange(len(rows)), rows] = -np.inf
+    
+    candidates = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(sims, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
 
 class AppRecommender:
-    def __init__(self):
-        self.user_item_matrix = None
-        self.item_similarity = None
+    def __init__(self, cache_backend=None):
+        self.user_item_matrix = None  # CSR (usuarios × apps) con ratings
+        self.user_ids = None
+        self.user_norms = None
+        self.item_neighbors = None
+        self.item_neighbor_scores = None
+        self.app_order = None  # permutación que ordena app_ids (búsqueda app_id -> columna)
+        self.item_features = None  # features de contenido por app (para recalcular vecinos)
         self.category_encoder = LabelEncoder()
+        self.ann_index = None
+        self.search_mode = SEARCH_MODE
         self.is_trained = False
-        self.model_path = "ml_models/models/recommender.pkl"
+        self.registry = ModelRegistry("recommender")
+        self.version = None
+        self.interactions_watermark = 0  # último id de ml_interacciones incluido en el modelo
+        self.cache = cache_backend if cache_backend is not None else create_backend()
+        self._update_lock = threading.Lock()
+        self._reset_updates()
         
     def prepare_data(self, db):
         """Preparar datos desde la base de datos"""
-        from database import App, Payment, Review
         from sqlalchemy import func
+        from database import App, Payment, Review, AppStats, InteractionEvent
+        from app_stats import average_rating
+        
+        # Antes que los datos: las interacciones posteriores se aplican al cargar el modelo
+        self.interactions_watermark = db.query(func.max(InteractionEvent.id)).scalar() or 0
         
         purchases = db.query(
             Payment.comprador_id,
@@ -53,31 +147,22 @@ class AppRecommender:
         
         df_purchases = pd.DataFrame(purchase_data)
         
-        # Información de apps para content-based
-        apps = db.query(App).all()
-        app_features = []
-        for app in apps:
-            avg_rating = db.query(func.avg(Review.calificacion))\
-                .filter(Review.aplicacion_id == app.id)\
-                .scalar() or 3.0
-            
-            total_sales = db.query(func.count(Payment.id))\
-                .filter(Payment.aplicacion_id == app.id, Payment.estado == 'confirmado')\
-                .scalar() or 0
-            
-            app_features.append({
-                'app_id': app.id,
-                'category_id': app.categoria_id,
-                'price': app.precio,
-                'avg_rating': float(avg_rating),
-                'popularity': total_sales
-            })
+        # Información de apps para content-based (contadores materializados en app_stats)
+        apps = db.query(App.id, App.categoria_id, App.precio, AppStats)\
+            .outerjoin(AppStats, AppStats.aplicacion_id == App.id).all()
+        app_features = [{
+            'app_id': app_id,
+            'category_id': categoria_id,
+            'price': precio,
+            'avg_rating': float(average_rating(stats, default=3.0)),
+            'popularity': stats.total_ventas if stats else 0
+        } for app_id, categoria_id, precio, stats in apps]
         
         df_apps = pd.DataFrame(app_features)
         
         return df_purchases, df_apps
     
-    def train(self, db):
+    def train(self, db, warm_cache=False):
         """Entrenar sistema de recomendaciones"""
         print("📊 Preparando datos para Recommender System...")
         df_purchases, df_apps = self.prepare_data(db)
@@ -86,116 +171,428 @@ class AppRecommender:
             print("❌ Insuficientes compras para entrenar (mínimo 10)")
             return False
         
-        # 1. Crear matriz usuario-item para colaborativo
+        self.fit(df_purchases, df_apps)
+        
+        print(f"✅ Sistema entrenado:")
+        print(f"   Usuarios: {len(self.user_ids)}")
+        print(f"   Apps: {len(self.app_ids)}")
+        print(f"   Interacciones: {len(df_purchases)}")
+        
+        self.save()
+        if warm_cache:
+            self.warm_cache_async()
+        return True
+    
+    def fit(self, df_purchases, df_apps):
+        """Construir las estructuras del modelo a partir de compras y features de apps"""
+        self.app_ids = df_apps['app_id'].values
+        
+        # 1. Crear matriz usuario-item dispersa (CSR) para colaborativo
         print("🤖 Construyendo matriz usuario-item...")
-        self.user_item_matrix = df_purchases.pivot_table(
-            index='user_id',
-            columns='app_id',
-            values='rating',
-            fill_value=0
+        interactions = df_purchases.groupby(['user_id', 'app_id'], as_index=False)['rating'].mean()
+        interactions['col'] = pd.Index(self.app_ids).get_indexer(interactions['app_id'])
+        interactions = interactions[interactions['col'] >= 0]
+        
+        self.user_ids = np.sort(interactions['user_id'].unique())
+        rows = np.searchsorted(self.user_ids, interactions['user_id'].values)
+        self.user_item_matrix = sparse.csr_matrix(
+            (interactions['rating'].values.astype(np.float32), (rows, interactions['col'].values)),
+            shape=(len(self.user_ids), len(self.app_ids)),
+            dtype=np.float32
         )
+        self._index_users()
         
-        print("🤖 Calculando similitud entre apps...")
-        self.category_encoder.fit(df_apps['category_id'])
-        df_apps['category_encoded'] = self.category_encoder.transform(df_apps['category_id'])
+        print("🤖 Construyendo índice aproximado de usuarios (LSH)...")
+        self.ann_index = RandomProjectionLSH(n_tables=ANN_TABLES, n_bits=ANN_BITS).build(self.user_item_matrix)
         
-        df_apps['price_norm'] = (df_apps['price'] - df_apps['price'].min()) / (df_apps['price'].max() - df_apps['price'].min() + 0.01)
-        df_apps['rating_norm'] = df_apps['avg_rating'] / 5.0
-        df_apps['popularity_norm'] = (df_apps['popularity'] - df_apps['popularity'].min()) / (df_apps['popularity'].max() - df_apps['popularity'].min() + 0.01)
+        print("🤖 Calculando vecinos más similares entre apps...")
+        self._index_apps(df_apps['popularity'].values, df_apps['avg_rating'].values)
+        self.category_encoder.fit(df_apps['category_id'])
+        category_encoded = self.category_encoder.transform(df_apps['category_id'])
+        price_norm = (df_apps['price'] - df_apps['price'].min()) / (df_apps['price'].max() - df_apps['price'].min() + 0.01)
         
-        feature_matrix = df_apps[['category_encoded', 'price_norm', 'rating_norm', 'popularity_norm']].values
-        self.item_similarity = cosine_similarity(feature_matrix)
-        self.app_ids = df_apps['app_id'].values
+        self.item_features = np.column_stack([category_encoded, price_norm, self.rating_norm, self.popularity_norm]).astype(np.float32)
+        self.item_neighbors, self.item_neighbor_scores = top_item_neighbors(self.item_features, ITEM_NEIGHBORS)
         
-        self.df_apps = df_apps
+        self._reset_updates()
         self.is_trained = True
+    
+    def _user_row(self, user_id: int):
+        """Fila de un usuario en la matriz (user_ids está ordenado) o None si no existe"""
+        if user_id in self.new_user_rows:
+            return self.new_user_rows[user_id]
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
+        return None
+    
+    def _index_users(self):
+        """Normas L2 de cada fila de la matriz (para similitud coseno)"""
+        self.user_norms = np.sqrt(np.asarray(self.user_item_matrix.multiply(self.user_item_matrix).sum(axis=1)).ravel())
+    
+    def _index_apps(self, popularity, avg_rating):
+        """
+        Índice app_id -> columna y rankings precalculados (popularidad y valoración)
+        para que _rank no tenga que ordenar ni recorrer DataFrames en cada petición.
+        Todo son arrays, así que se guardan en el registro y load() no recalcula nada.
+        """
+        self.app_order = np.argsort(self.app_ids, kind='stable').astype(np.int32)
+        self.app_popularity = np.asarray(popularity, dtype=np.float32)
+        self.app_ratings = np.asarray(avg_rating, dtype=np.float32)
         
-        print(f"✅ Sistema entrenado:")
-        print(f"   Usuarios: {len(self.user_item_matrix)}")
-        print(f"   Apps: {len(self.app_ids)}")
-        print(f"   Interacciones: {len(df_purchases)}")
+        min_popularity = self.app_popularity.min()
+        self.popularity_norm = (self.app_popularity - min_popularity) / (self.app_popularity.max() - min_popularity + 0.01)
+        self.rating_norm = self.app_ratings / 5.0
         
-        self.save()
+        self.popular_order = top_k_indices(self.app_popularity, POPULAR_CANDIDATES)
+        self.top_rated_order = np.argsort(-self.app_ratings, kind='stable').astype(np.int32)
+    
+    def _app_col(self, app_id: int):
+        """Columna de una app en la matriz o None si el modelo no la conoce"""
+        pos = int(np.searchsorted(self.app_ids, app_id, sorter=self.app_order))
+        if pos < len(self.app_order) and self.app_ids[self.app_order[pos]] == app_id:
+            return int(self.app_order[pos])
+        return None
+    
+    def _similar_users(self, user_row: int, n: int = SIMILAR_USERS, snapshot=None):
+        """
+        Usuarios más similares (coseno) a una fila de la matriz, excluyendo a sí mismo.
+        En modo "ann" solo se comparan los candidatos del índice LSH.
+        Retorna (filas, similitudes) ordenadas de mayor a menor.
+        """
+        pending_rows, matrix = snapshot or self._snapshot()
+        user_norms = self.user_norms
+        cols, ratings = self._row_items(user_row, (pending_rows, matrix))
+        query = np.zeros(matrix.shape[1], dtype=np.float32)
+        query[cols] = ratings
+        
+        if self.search_mode == 'ann' and self.ann_index is not None:
+            candidates = self.ann_index.candidates(query[None, :], min_candidates=ANN_MIN_CANDIDATES)
+            if self.updated_rows:
+                # Filas cambiadas desde que se construyó el índice: sus cubetas pueden estar desfasadas
+                candidates = np.union1d(candidates, np.fromiter(self.updated_rows, dtype=candidates.dtype))
+            candidates = candidates[candidates != user_row]
+        else:
+            candidates = np.arange(len(user_norms))
+        
+        # Similitud coseno con los candidatos: producto disperso contra la matriz
+        # y, para las filas con celdas pendientes, contra la fila ya combinada
+        dots = np.zeros(len(candidates), dtype=np.float32)
+        in_matrix = int(np.searchsorted(candidates, matrix.shape[0]))
+        dots[:in_matrix] = matrix[candidates[:in_matrix]] @ query
+        if pending_rows:
+            for i in np.flatnonzero(np.isin(candidates, np.fromiter(pending_rows, dtype=np.int64))):
+                row_cols, row_ratings = self._row_items(int(candidates[i]), (pending_rows, matrix))
+                dots[i] = query[row_cols] @ row_ratings
+        denominators = user_norms[candidates] * user_norms[user_row]
+        similarity = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+        similarity[candidates == user_row] = -np.inf
+        
+        order = top_k_indices(similarity, n)
+        order = order[np.isfinite(similarity[order])]
+        return candidates[order], similarity[order]
+    
+    # ==================== ACTUALIZACIONES INCREMENTALES ====================
+    # Las compras y reseñas nuevas se incorporan al modelo cargado sin re-entrenar:
+    # la celda se anota como pendiente (pending_rows), se recalcula la norma de
+    # esa fila, la popularidad o valoración de la app (con sus vecinos de
+    # contenido) y se invalida la caché del usuario. Las celdas pendientes se
+    # fusionan en la matriz CSR cada MERGE_BATCH celdas: reconstruirla en cada
+    # evento costaría O(nnz). El índice LSH no se reconstruye: las filas
+    # cambiadas se comparan siempre como candidatas. El siguiente
+    # re-entrenamiento lo consolida todo.
+    #
+    # Los lectores no toman el lock: leen pending_rows antes que la matriz
+    # (_snapshot) y la fusión publica la matriz nueva antes de vaciar
+    # pending_rows, así que nunca ven una celda perdida. pending_rows y sus
+    # diccionarios por fila se sustituyen, nunca se modifican en sitio.
+    
+    def _reset_updates(self):
+        self.new_user_rows = {}     # usuarios sin fila al entrenar -> fila añadida al final
+        self.pending_rows = {}      # fila -> {columna: rating} aún no fusionadas (0 = celda borrada)
+        self.pending_cells = 0
+        self.updated_rows = set()   # filas modificadas desde que se construyó el índice LSH
+        self.updates_applied = 0
+    
+    def _snapshot(self):
+        """(pending_rows, matrix) coherentes entre sí para una lectura sin lock"""
+        pending_rows = self.pending_rows
+        return pending_rows, self.user_item_matrix
+    
+    def _row_items(self, row: int, snapshot=None):
+        """(columnas, ratings) de una fila: la de la matriz combinada con sus celdas pendientes"""
+        pending_rows, matrix = snapshot or self._snapshot()
+        if row < matrix.shape[0]:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            cols, ratings = matrix.indices[start:end], matrix.data[start:end]
+        else:
+            cols, ratings = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        
+        pending = pending_rows.get(row)
+        if not pending:
+            return cols, ratings
+        pending_cols = np.fromiter(pending.keys(), dtype=np.int32, count=len(pending))
+        pending_ratings = np.fromiter(pending.values(), dtype=np.float32, count=len(pending))
+        keep = ~np.isin(cols, pending_cols)
+        nonzero = pending_ratings != 0
+        cols = np.concatenate([cols[keep], pending_cols[nonzero]])
+        ratings = np.concatenate([ratings[keep], pending_ratings[nonzero]])
+        order = np.argsort(cols, kind='stable')  # Mismo orden que la fila ya fusionada
+        return cols[order], ratings[order]
+    
+    def _writable(self, name: str):
+        """Los arrays cargados del registro están mapeados en solo lectura: copiar antes de escribir"""
+        array = getattr(self, name)
+        if not array.flags.writeable:
+            array = np.array(array)
+            setattr(self, name, array)
+        return array
+    
+    def _grow_rows(self, n_rows: int):
+        """Reservar filas nuevas (normas a 0) antes de que ningún usuario apunte a ellas"""
+        if n_rows > len(self.user_norms):
+            self.user_norms = np.concatenate([self.user_norms, np.zeros(n_rows - len(self.user_norms), dtype=np.float32)])
+    
+    def _set_interaction(self, row: int, col: int, rating: float):
+        """Anotar una celda como pendiente (rating 0 la elimina) y recalcular la norma de su fila"""
+        self._grow_rows(row + 1)
+        row_cells = dict(self.pending_rows.get(row, {}))
+        if col not in row_cells:
+            self.pending_cells += 1
+        row_cells[col] = rating
+        self.pending_rows = {**self.pending_rows, row: row_cells}
+        
+        _, ratings = self._row_items(row)
+        self._writable('user_norms')[row] = np.sqrt(np.sum(ratings * ratings))
+        self.updated_rows.add(row)
+        if self.pending_cells >= MERGE_BATCH:
+            self._merge_pending()
+    
+    def _merge_pending(self):
+        """Fusionar las celdas pendientes en una matriz CSR nueva (un O(nnz) por lote)"""
+        pending_rows = self.pending_rows
+        if not pending_rows:
+            return
+        matrix = self.user_item_matrix
+        n_rows = max(len(self.user_norms), matrix.shape[0])
+        if n_rows > matrix.shape[0]:
+            matrix = sparse.vstack([matrix, sparse.csr_matrix((n_rows - matrix.shape[0], matrix.shape[1]), dtype=np.float32)], format='csr')
+        
+        rows = [row for row, cells in pending_rows.items() for _ in cells]
+        cols = [col for cells in pending_rows.values() for col in cells]
+        ratings = [rating for cells in pending_rows.values() for rating in cells.values()]
+        mask = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=matrix.shape)
+        cells = sparse.csr_matrix((np.asarray(ratings, dtype=np.float32), (rows, cols)), shape=matrix.shape)
+        merged = (matrix - matrix.multiply(mask) + cells).tocsr()
+        merged.eliminate_zeros()
+        
+        # Primero la matriz y después vaciar pending_rows (ver _snapshot)
+        self.user_item_matrix = merged
+        self.pending_rows = {}
+        self.pending_cells = 0
+    
+    def _update_app(self, col: int, popularity=None, avg_rating=None):
+        """
+        Actualizar popularidad/valoración de una app, sus rankings y las listas de
+        vecinos afectadas: la suya, las de las apps que la tenían como vecina (su
+        similitud ya no es la guardada) y las de las apps en las que ahora entra
+        (supera a su último vecino)
+        """
+        if popularity is not None:
+            self._writable('app_popularity')[col] = popularity
+            min_popularity = self.app_popularity.min()
+            self.popularity_norm = (self.app_popularity - min_popularity) / (self.app_popularity.max() - min_popularity + 0.01)
+            self.popular_order = top_k_indices(self.app_popularity, POPULAR_CANDIDATES)
+        if avg_rating is not None:
+            self._writable('app_ratings')[col] = avg_rating
+            self.rating_norm = self.app_ratings / 5.0
+            self.top_rated_order = np.argsort(-self.app_ratings, kind='stable').astype(np.int32)
+        
+        if self.item_features is not None and self.item_neighbors.shape[1] > 0:
+            features = self._writable('item_features')
+            features[col, 2] = self.rating_norm[col]
+            features[col, 3] = self.popularity_norm[col]
+            normalized = _normalize_rows(features)
+            neighbors = self._writable('item_neighbors')
+            scores = self._writable('item_neighbor_scores')
+            
+            similarity = normalized @ normalized[col]
+            affected = np.flatnonzero(np.any(neighbors == col, axis=1) | (similarity > scores[:, -1]))
+            affected = np.union1d(affected, [col])
+            for start in range(0, len(affected), SIMILARITY_BLOCK_SIZE):
+                rows = affected[start:start + SIMILARITY_BLOCK_SIZE]
+                neighbors[rows], scores[rows] = _rows_neighbors(normalized, rows, neighbors.shape[1])
+    
+    def _has_interaction(self, row: int, col: int):
+        cols, _ = self._row_items(row)
+        return bool(np.any(cols == col))
+    
+    def record_purchase(self, user_id: int, app_id: int, popularity=None, reverted: bool = False):
+        """
+        Incorporar una compra confirmada (o revertida) sin re-entrenar.
+        `popularity` es el total de ventas actual de la app (app_stats), si se conoce.
+        """
+        if not self.is_trained:
+            return False
+        with self._update_lock:
+            col = self._app_col(app_id)
+            if col is None:
+                return False  # App creada después del entrenamiento
+            row = self._user_row(user_id)
+            if row is None:
+                if reverted:
+                    return False
+                # Reservar la fila antes de publicarla: _rank puede leerla enseguida
+                row = max(len(self.user_norms), self.user_item_matrix.shape[0])
+                self._grow_rows(row + 1)
+                self.new_user_rows[user_id] = row
+            
+            if reverted:
+                self._set_interaction(row, col, 0.0)
+            elif not self._has_interaction(row, col):
+                self._set_interaction(row, col, 3.0)  # Sin reseña: mismo valor por defecto que en train
+            self._update_app(col, popularity=popularity)
+            self.updates_applied += 1
+        self.invalidate_user(user_id)
+        return True
+    
+    def record_review(self, user_id: int, app_id: int, rating: float, avg_rating=None):
+        """
+        Incorporar una reseña sin re-entrenar: pasa a ser el rating de la compra
+        del usuario (si la hay). `avg_rating` es la valoración media actual de la app.
+        """
+        if not self.is_trained:
+            return False
+        with self._update_lock:
+            col = self._app_col(app_id)
+            if col is None:
+                return False
+            row = self._user_row(user_id)
+            if row is not None and self._has_interaction(row, col):
+                self._set_interaction(row, col, float(rating))
+            self._update_app(col, avg_rating=avg_rating)
+            self.updates_applied += 1
+        self.invalidate_user(user_id)
         return True
     
+    def _user_app_ids(self, row):
+        """App IDs con interacción en una fila de la matriz dispersa (incluidas las pendientes)"""
+        cols, _ = self._row_items(row)
+        return self.app_ids[cols]
+    
     def recommend(self, db, user_id: int, top_k: int = 6):
         """Generar recomendaciones para un usuario"""
         if not self.is_trained:
             return []
         
-        from database import App, Payment
+        # Lista top-K cacheada. Las entradas de otra versión del modelo se ignoran
+        # y se recalculan aquí. invalidate_user solo llega a la caché de este
+        # proceso: con varios workers otra entrada puede incluir una app recién
+        # comprada, así que las compras actuales se filtran también en los aciertos
+        # (la entrada guarda CACHED_TOP_K apps, más de las que se piden).
+        purchased_app_ids = self._purchased_app_ids(db, user_id)
+        entry = self.cache.get(user_id)
+        if entry is not None and top_k <= entry['k'] and entry.get('version') == self.version:
+            items = [rec for rec in entry['items'] if rec['app_id'] not in purchased_app_ids]
+            # Si el filtro deja menos de top_k y la lista no estaba agotada, recalcular
+            if len(items) >= top_k or len(entry['items']) < entry['k']:
+                return self._enrich(db, items[:top_k])
         
-        # Apps ya compradas por el usuario
-        purchased_app_ids = set(
+        k = max(top_k, CACHED_TOP_K)
+        entry = self._cache_entry(user_id, purchased_app_ids, k)
+        self.cache.set(user_id, entry)
+        return self._enrich(db, entry['items'][:top_k])
+    
+    def invalidate_user(self, user_id: int):
+        """Descartar las recomendaciones cacheadas de un usuario (p. ej. tras una compra)"""
+        self.cache.delete(user_id)
+    
+    def _cache_entry(self, user_id: int, purchased_app_ids, k: int):
+        return {'k': k, 'version': self.version, 'items': self._rank(user_id, purchased_app_ids, k)}
+    
+    def warm_cache(self, limit: int = WARM_USERS):
+        """
+        Precalcular el top-K de los `limit` usuarios con más compras. El resto se
+        calcula en su primera petición: precalcular a todos crece con usuarios²
+        y la LRU no los conservaría.
+        """
+        interactions = np.diff(self.user_item_matrix.indptr[:len(self.user_ids) + 1])
+        for row in top_k_indices(interactions, limit):
+            user_id = int(self.user_ids[row])
+            purchased_app_ids = {int(app_id) for app_id in self._user_app_ids(row)}
+            self.cache.set(user_id, self._cache_entry(user_id, purchased_app_ids, CACHED_TOP_K))
+    
+    def warm_cache_async(self, limit: int = WARM_USERS):
+        """warm_cache en un hilo en segundo plano (nunca en el camino de una petición)"""
+        if limit > 0:
+            threading.Thread(target=self.warm_cache, args=(limit,), daemon=True, name="recommender-warm").start()
+    
+    def _purchased_app_ids(self, db, user_id: int):
+        """Apps ya compradas por el usuario"""
+        from database import Payment
+        
+        purchased_app_ids = (
             db.query(Payment.aplicacion_id)
             .filter(Payment.comprador_id == user_id, Payment.estado == 'confirmado')
             .all()
         )
-        purchased_app_ids = {app_id for (app_id,) in purchased_app_ids}
-        
+        return {app_id for (app_id,) in purchased_app_ids}
+    
+    def _rank(self, user_id: int, purchased_app_ids, top_k: int):
+        """Puntuar candidatos (colaborativo + contenido + popularidad) y devolver los top_k"""
         recommendations = []
         
         # Estrategia 1: Colaborativo (si el usuario existe en la matriz)
-        if user_id in self.user_item_matrix.index:
-            user_ratings = self.user_item_matrix.loc[user_id]
-            
-            # Calcular similitud con otros usuarios
-            user_similarity = cosine_similarity(
-                [user_ratings.values],
-                self.user_item_matrix.values
-            )[0]
+        user_row = self._user_row(user_id)
+        if user_row is not None:
+            snapshot = self._snapshot()
             
-            # Encontrar usuarios similares
-            similar_users_idx = np.argsort(user_similarity)[::-1][1:6]  # Top 5 excluyendo a sí mismo
+            # Encontrar usuarios similares (top 5 excluyendo a sí mismo)
+            similar_users_idx, similarities = self._similar_users(user_row, snapshot=snapshot)
             
             # Apps que compraron usuarios similares
-            for idx in similar_users_idx:
-                similar_user_id = self.user_item_matrix.index[idx]
-                similar_user_apps = self.user_item_matrix.loc[similar_user_id]
-                
-                for app_id, rating in similar_user_apps.items():
+            for idx, similarity in zip(similar_users_idx, similarities):
+                for col, rating in zip(*self._row_items(int(idx), snapshot)):
+                    app_id = int(self.app_ids[col])
                     if rating > 0 and app_id not in purchased_app_ids:
                         recommendations.append({
-                            'app_id': int(app_id),
-                            'score': float(rating * user_similarity[idx]),
+                            'app_id': app_id,
+                            'score': float(rating * similarity),
                             'reason': 'collaborative'
                         })
         
         # Estrategia 2: Content-based (apps similares a las que le gustaron)
         if purchased_app_ids:
             for purchased_app_id in list(purchased_app_ids)[:3]:  # Top 3 compras
-                if purchased_app_id in self.app_ids:
-                    app_idx = np.where(self.app_ids == purchased_app_id)[0][0]
-                    similar_apps_idx = np.argsort(self.item_similarity[app_idx])[::-1][1:6]
-                    
-                    for idx in similar_apps_idx:
+                app_idx = self._app_col(purchased_app_id)
+                if app_idx is not None:
+                    for idx, similarity in zip(self.item_neighbors[app_idx][:5], self.item_neighbor_scores[app_idx][:5]):
                         similar_app_id = self.app_ids[idx]
                         if similar_app_id not in purchased_app_ids:
                             recommendations.append({
                                 'app_id': int(similar_app_id),
-                                'score': float(self.item_similarity[app_idx][idx]),
+                                'score': float(similarity),
                                 'reason': 'content'
                             })
         
         # Estrategia 3: Popularidad (fallback o complemento)
-        popular_apps = self.df_apps.nlargest(10, 'popularity')
-        for _, app_row in popular_apps.iterrows():
-            if app_row['app_id'] not in purchased_app_ids:
+        for idx in self.popular_order:
+            app_id = int(self.app_ids[idx])
+            if app_id not in purchased_app_ids:
                 recommendations.append({
-                    'app_id': int(app_row['app_id']),
-                    'score': float(app_row['popularity_norm'] * 0.5),  # Menor peso
+                    'app_id': app_id,
+                    'score': float(self.popularity_norm[idx] * 0.5),  # Menor peso
                     'reason': 'popular'
                 })
         
         # Consolidar y ordenar
         if not recommendations:
             # Si no hay recomendaciones, devolver apps mejor valoradas
-            best_rated = self.df_apps.nlargest(top_k, 'avg_rating')
             recommendations = [{
-                'app_id': int(row['app_id']),
-                'score': float(row['rating_norm']),
+                'app_id': int(self.app_ids[idx]),
+                'score': float(self.rating_norm[idx]),
                 'reason': 'top_rated'
-            } for _, row in best_rated.iterrows() if row['app_id'] not in purchased_app_ids]
+            } for idx in self.top_rated_order[:top_k] if int(self.app_ids[idx]) not in purchased_app_ids]
         
         # Agrupar por app_id y sumar scores
         rec_dict = {}
@@ -207,12 +604,17 @@ class AppRecommender:
             rec_dict[app_id]['reasons'].append(rec['reason'])
         
         # Ordenar por score y tomar top_k
-        final_recs = sorted(rec_dict.values(), key=lambda x: x['score'], reverse=True)[:top_k]
+        return sorted(rec_dict.values(), key=lambda x: x['score'], reverse=True)[:top_k]
+    
+    def _enrich(self, db, ranked):
+        """Enriquecer con información de las apps (una sola consulta para todo el top-K)"""
+        from app_catalog import fetch_apps_by_ids, category_name
+        
+        apps_by_id = {app.id: app for app in fetch_apps_by_ids(db, [rec['app_id'] for rec in ranked])}
         
-        # Enriquecer con información de las apps
         result = []
-        for rec in final_recs:
-            app = db.query(App).filter(App.id == rec['app_id']).first()
+        for rec in ranked:
+            app = apps_by_id.get(rec['app_id'])
             if app:
                 # Determinar razón principal
                 reason_text = self._get_reason_text(rec['reasons'])
@@ -221,7 +623,7 @@ class AppRecommender:
                     'id': app.id,
                     'name': app.nombre,
                     'description': app.descripcion,
-                    'category': app.categoria_obj.nombre,
+                    'category': category_name(app),
                     'price': app.precio,
                     'cover_image': app.imagen_portada,
                     'score': round(rec['score'], 2),
@@ -242,28 +644,69 @@ class AppRecommender:
             return "Altamente valorada por la comunidad"
     
     def save(self):
-        """Guardar modelo"""
-        os.makedirs("ml_models/models", exist_ok=True)
-        data = {
-            'user_item_matrix': self.user_item_matrix,
-            'item_similarity': self.item_similarity,
+        """Guardar el modelo como una versión nueva del registro (arrays .npy + manifest)"""
+        with self._update_lock:
+            self._merge_pending()
+        matrix = self.user_item_matrix
+        arrays = {
+            'matrix_data': matrix.data,
+            'matrix_indices': matrix.indices,
+            'matrix_indptr': matrix.indptr,
+            'user_ids': self.user_ids,
+            'user_norms': self.user_norms,
+            'item_neighbors': self.item_neighbors,
+            'item_neighbor_scores': self.item_neighbor_scores,
             'app_ids': self.app_ids,
-            'category_encoder': self.category_encoder,
-            'df_apps': self.df_apps
+            'app_order': self.app_order,
+            'item_features': self.item_features,
+            'app_popularity': self.app_popularity,
+            'app_ratings': self.app_ratings,
+            'popularity_norm': self.popularity_norm,
+            'rating_norm': self.rating_norm,
+            'popular_order': self.popular_order,
+            'top_rated_order': self.top_rated_order,
+            'category_classes': self.category_encoder.classes_,
+            **{f'ann_{name}': array for name, array in self.ann_index.to_arrays().items()}
         }
-        joblib.dump(data, self.model_path)
-        print(f"💾 Modelo guardado en {self.model_path}")
-    
-    def load(self):
-        """Cargar modelo"""
-        if os.path.exists(self.model_path):
-            data = joblib.load(self.model_path)
-            self.user_item_matrix = data['user_item_matrix']
-            self.item_similarity = data['item_similarity']
-            self.app_ids = data['app_ids']
-            self.category_encoder = data['category_encoder']
-            self.df_apps = data['df_apps']
-            self.is_trained = True
-            print("✅ Modelo Recommender cargado")
-            return True
-        return False
+        self.version = self.registry.save(arrays, {
+            'matrix_shape': list(matrix.shape),
+            'interactions_watermark': int(self.interactions_watermark)
+        })
+        print(f"💾 Modelo guardado en {self.registry.path} (versión {self.version})")
+    
+    def load(self, version: int = None):
+        """Cargar la versión activa del registro (o `version`), con los arrays mapeados en memoria"""
+        manifest, arrays = self.registry.load(version)
+        if manifest is None:
+            if os.path.exists("ml_models/models/recommender.pkl"):
+                print("⚠️  Modelo Recommender en formato pickle antiguo, necesita re-entrenamiento")
+            return False
+        
+        self.user_item_matrix = sparse.csr_matrix(
+            (arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+            shape=tuple(manifest['metadata']['matrix_shape']), copy=False
+        )
+        self.user_ids = arrays['user_ids']
+        self.user_norms = arrays['user_norms']
+        self.item_neighbors = arrays['item_neighbors']
+        self.item_neighbor_scores = arrays['item_neighbor_scores']
+        self.app_ids = arrays['app_ids']
+        self.category_encoder = LabelEncoder()
+        self.category_encoder.classes_ = arrays['category_classes']
+        self.app_order = arrays['app_order']
+        self.item_features = arrays.get('item_features')
+        self.app_popularity = arrays['app_popularity']
+        self.app_ratings = arrays['app_ratings']
+        self.popularity_norm = arrays['popularity_norm']
+        self.rating_norm = arrays['rating_norm']
+        self.popular_order = arrays['popular_order']
+        self.top_rated_order = arrays['top_rated_order']
+        self.ann_index = RandomProjectionLSH.from_arrays({
+            name[len('ann_'):]: array for name, array in arrays.items() if name.startswith('ann_')
+        })
+        self.version = manifest['version']
+        self.interactions_watermark = manifest['metadata'].get('interactions_watermark', 0)
+        self._reset_updates()
+        self.is_trained = True
+        print(f"✅ Modelo Recommender cargado (versión {self.version})")
+        return True
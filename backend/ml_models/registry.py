@@ -0,0 +1,150 @@
+"""
+Registro versionado de modelos en disco
+
+Cada modelo se guarda como un directorio por versión con un fichero .npy por
+array y un manifest.json pequeño (versión, fecha, forma/dtype de cada array y
+metadatos del modelo):
+
+    ml_models/models/<modelo>/
+        CURRENT              <- número de la versión activa
+        000001/manifest.json
+        000001/<array>.npy
+        000002/...
+
+Los arrays se cargan con mmap_mode='r': todos los workers de uvicorn comparten
+la misma copia en la caché de páginas del sistema y arrancar solo cuesta abrir
+los ficheros. Las versiones se escriben en un directorio temporal que se
+renombra al terminar, y CURRENT se sustituye con os.replace, así un lector
+nunca ve una versión a medio escribir. Volver a una versión anterior es
+reescribir CURRENT (rollback).
+"""
+
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+import numpy as np
+
+MODELS_DIR = os.getenv("ML_MODELS_DIR", "ml_models/models")
+# Versiones que se conservan en disco (la activa nunca se borra)
+MODEL_VERSIONS_KEPT = int(os.getenv("ML_MODEL_VERSIONS_KEPT", "5"))
+
+class ModelRegistry:
+    def __init__(self, name: str, base_dir: str = MODELS_DIR):
+        self.name = name
+        self.path = os.path.join(base_dir, name)
+        self.current_path = os.path.join(self.path, "CURRENT")
+
+    def _version_path(self, version: int):
+        return os.path.join(self.path, f"{version:06d}")
+
+    def versions(self):
+        """Versiones guardadas, de la más antigua a la más reciente"""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(entry) for entry in os.listdir(self.path) if entry.isdigit())
+
+    def current_version(self):
+        """Versión activa según CURRENT (None si nunca se ha guardado el modelo)"""
+        try:
+            with open(self.current_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _set_current(self, version: int):
+        tmp_path = f"{self.current_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(version))
+        os.replace(tmp_path, self.current_path)
+
+    def save(self, arrays: dict, metadata: dict = None) -> int:
+        """
+        Guardar una versión nueva y activarla. `arrays` es {nombre: np.ndarray}
+        (sin dtype object, que no se puede mapear en memoria). Retorna la versión.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+
+        manifest = {"arrays": {}, "metadata": metadata or {}}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype == object:
+                raise ValueError(f"El array '{name}' tiene dtype object y no se puede guardar como .npy")
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+            manifest["arrays"][name] = {"dtype": str(array.dtype), "shape": list(array.shape)}
+
+        # Reservar el siguiente número: rename falla si otro proceso ya lo tomó
+        version = (self.versions() or [0])[-1] + 1
+        while True:
+            manifest["version"] = version
+            manifest["created_at"] = datetime.utcnow().isoformat()
+            with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            try:
+                os.rename(tmp_path, self._version_path(version))
+                break
+            except OSError:
+                if not os.path.exists(self._version_path(version)):
+                    raise
+                version += 1
+
+        self._set_current(version)
+        self.prune()
+        return version
+
+    def load(self, version: int = None, mmap_mode: str = "r"):
+        """
+        Cargar una versión (por defecto la activa). Retorna (manifest, arrays)
+        o (None, None) si no existe.
+        """
+        version = self.current_version() if version is None else version
+        if version is None or not os.path.isdir(self._version_path(version)):
+            return None, None
+
+        version_path = self._version_path(version)
+        with open(os.path.join(version_path, "manifest.json")) as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(version_path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in manifest["arrays"]
+        }
+        return manifest, arrays
+
+    def manifest(self, version: int = None):
+        """Solo el manifest de una versión (por defecto la activa)"""
+        version = self.current_version() if version is None else version
+        if version is None:
+            return None
+        try:
+            with open(os.path.join(self._version_path(version), "manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def rollback(self, version: int = None) -> int:
+        """Activar `version` o, sin argumento, la versión anterior a la activa"""
+        versions = self.versions()
+        if version is None:
+            current = self.current_version()
+            previous = [v for v in versions if current is None or v < current]
+            if not previous:
+                raise ValueError(f"No hay una versión anterior de '{self.name}'")
+            version = previous[-1]
+        elif version not in versions:
+            raise ValueError(f"La versión {version} de '{self.name}' no existe")
+        self._set_current(version)
+        return version
+
+    def prune(self, keep: int = MODEL_VERSIONS_KEPT):
+        """
+        Conservar `keep` versiones (la activa y las más recientes). En Linux los
+        workers que aún tengan mapeada una versión borrada siguen leyéndola
+        hasta recargar.
+        """
+        current = self.current_version()
+        others = [v for v in self.versions() if v != current]
+        for version in others[:max(0, len(others) - (keep - 1))]:
+            shutil.rmtree(self._version_path(version), ignore_errors=True)
@@ -0,0 +1,43 @@
+"""
+Re-entrenamiento de modelos fuera del proceso de la API
+
+run_training() se ejecuta en un proceso worker (ProcessPoolExecutor con
+contexto "spawn"): abre su propia sesión de base de datos, entrena ambos
+modelos y los guarda en disco. El proceso de la API solo carga los ficheros
+resultantes y sustituye las instancias globales cuando el trabajo termina.
+También poda `ml_interacciones`: los modelos nuevos ya incluyen esos eventos.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+# Días que se conservan las interacciones ya incluidas en un entrenamiento
+INTERACTIONS_RETENTION_DAYS = float(os.getenv("ML_INTERACTIONS_RETENTION_DAYS", "7"))
+
+def run_training():
+    """Entrenar y guardar ambos modelos. Retorna el resultado de cada uno."""
+    from database import SessionLocal, InteractionEvent
+    from .price_optimizer import PriceOptimizer
+    from .recommender import AppRecommender
+    from .recommendation_cache import MemoryBackend
+
+    db = SessionLocal()
+    try:
+        success_price = PriceOptimizer().train(db)
+        # La caché la calienta el proceso de la API al cargar el modelo nuevo
+        recommender = AppRecommender(cache_backend=MemoryBackend())
+        success_rec = recommender.train(db, warm_cache=False)
+        if success_rec:
+            cutoff = datetime.utcnow() - timedelta(days=INTERACTIONS_RETENTION_DAYS)
+            db.query(InteractionEvent).filter(
+                InteractionEvent.id <= recommender.interactions_watermark,
+                InteractionEvent.creado_en < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+    return {
+        "price_optimizer": "OK" if success_price else "ERROR",
+        "recommender": "OK" if success_rec else "ERROR"
+    }
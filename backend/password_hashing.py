@@ -0,0 +1,112 @@
+"""
+Hashing de contraseñas (bcrypt) fuera del proceso de la API
+
+bcrypt es lento a propósito (~250 ms por hash con coste 12) y mantiene ocupado
+un núcleo entero. Hecho dentro de los handlers, una avalancha de logins llena el
+threadpool y frena al resto de endpoints. Aquí los hashes y verificaciones se
+envían a un pool de procesos acotado (PASSWORD_HASH_WORKERS), con un máximo de
+operaciones en espera (PASSWORD_HASH_MAX_PENDING). Por encima de ese máximo se
+responde 503 en lugar de acumular latencia.
+
+El coste es configurable (BCRYPT_ROUNDS). Los hashes con un coste distinto se
+marcan como desactualizados, y verify_and_update_password devuelve el hash nuevo
+para guardarlo en el mismo login (rehash transparente).
+
+Este módulo solo importa passlib para que los procesos worker arranquen rápido.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+def available_cores() -> int:
+    """Núcleos que puede usar este proceso (respeta los límites de CPU del contenedor en Linux)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, available_cores()))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 16)))
+
+def make_context(rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    # min = max = coste actual: cualquier hash con otro coste necesita actualizarse
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds
+    )
+
+pwd_context = make_context()
+
+# ==================== WORKERS (se ejecutan en el pool) ====================
+def _hash_worker(password: str, rounds: int) -> str:
+    return make_context(rounds).hash(password)
+
+def _verify_worker(password: str, hashed_password: str, rounds: int):
+    return make_context(rounds).verify_and_update(password, hashed_password)
+
+# ==================== POOL ====================
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+def shutdown_pool():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+async def _run(fn, *args):
+    global _pending, _executor
+    with _executor_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            raise HTTPException(
+                status_code=503,
+                detail="Demasiadas solicitudes de autenticación, intenta de nuevo en unos segundos",
+                headers={"Retry-After": "1"}
+            )
+        _pending += 1
+    try:
+        return await asyncio.wrap_future(_get_executor().submit(fn, *args))
+    except BrokenProcessPool:
+        # Un worker murió: se crea un pool nuevo en la próxima llamada
+        with _executor_lock:
+            _executor = None
+        raise
+    finally:
+        with _executor_lock:
+            _pending -= 1
+
+async def hash_password(password: str) -> str:
+    """Hash bcrypt con el coste actual, calculado en el pool"""
+    return await _run(_hash_worker, password, BCRYPT_ROUNDS)
+
+async def verify_and_update_password(password: str, hashed_password: str):
+    """
+    Verificar una contraseña en el pool. Retorna (válida, hash_nuevo). hash_nuevo
+    no es None cuando el hash guardado usa otro coste y hay que reemplazarlo.
+    """
+    return await _run(_verify_worker, password, hashed_password, BCRYPT_ROUNDS)
+
+def stats() -> dict:
+    return {
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": _pending
+    }
@@ -0,0 +1,54 @@
+"""
+Alta de pagos sin check-then-insert
+
+Las reglas "una compra confirmada por app y comprador", "codigo_qr único" y
+"una clave de idempotencia por comprador" son índices únicos de `pagos` (ver
+database.Payment). El alta es un INSERT ... ON CONFLICT DO NOTHING: si choca
+con alguno no inserta nada, sin SELECT previo y sin carreras entre peticiones
+simultáneas. Solo cuando hay conflicto (reintento o compra repetida) se busca
+el pago existente.
+"""
+
+from sqlalchemy.orm import Session
+from database import App, Payment, dialect_insert
+import app_stats
+
+def insert_confirmed_payment(db: Session, app: App, comprador_id: int, codigo_qr: str,
+                             credenciales: str, clave_idempotencia: str | None = None,
+                             precio: float | None = None) -> int | None:
+    """
+    Insertar un pago confirmado y sumar la venta a los contadores. `precio` es el
+    importe cobrado (por defecto el precio actual de la app). Retorna el id del
+    pago, o None si choca con un pago existente (no inserta nada). No hace commit.
+    """
+    precio = app.precio if precio is None else precio
+    stmt = dialect_insert(db)(Payment).values(
+        aplicacion_id=app.id,
+        comprador_id=comprador_id,
+        estado="confirmado",
+        codigo_qr=codigo_qr,
+        credenciales=credenciales,
+        clave_idempotencia=clave_idempotencia,
+        precio_pagado=precio
+    ).on_conflict_do_nothing().returning(Payment.id)
+
+    payment_id = db.execute(stmt).scalar()
+    if payment_id is not None:
+        app_stats.record_sale(db, app.id, precio)
+    return payment_id
+
+def get_by_idempotency_key(db: Session, comprador_id: int, clave_idempotencia: str) -> Payment | None:
+    return db.query(Payment).filter(
+        Payment.comprador_id == comprador_id,
+        Payment.clave_idempotencia == clave_idempotencia
+    ).first()
+
+def get_confirmed(db: Session, aplicacion_id: int, comprador_id: int) -> Payment | None:
+    return db.query(Payment).filter(
+        Payment.aplicacion_id == aplicacion_id,
+        Payment.comprador_id == comprador_id,
+        Payment.estado == "confirmado"
+    ).first()
+
+def get_by_codigo_qr(db: Session, codigo_qr: str) -> Payment | None:
+    return db.query(Payment).filter(Payment.codigo_qr == codigo_qr).first()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir los contadores materializados por app (tabla app_stats)
+a partir de los pagos y resenas existentes. Ejecutar con: python rebuild_app_stats.py
+"""
+from database import SessionLocal
+import app_stats
+
+def rebuild_stats():
+    db = SessionLocal()
+    
+    print("=" * 60)
+    print("🔄 RECONSTRUYENDO ESTADÍSTICAS POR APP")
+    print("=" * 60)
+    
+    try:
+        total_apps = app_stats.rebuild(db)
+        print(f"✅ Estadísticas reconstruidas para {total_apps} apps")
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ ERROR: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_stats()
@@ -0,0 +1,111 @@
+"""
+Reenvío local de eventos de Stripe a /payments/webhook, firmados con
+STRIPE_WEBHOOK_SECRET igual que los firma Stripe (cabecera Stripe-Signature),
+para probar la ingesta sin red ni Stripe CLI.
+
+- Sin --file genera un checkout.session.completed pagado para --app-id y
+  --user-id (con --type se puede enviar otro, p. ej. checkout.session.expired).
+- Con --file reenvía eventos capturados: un JSON (objeto, lista o respuesta de
+  `stripe events list` con "data") o JSONL, un evento por línea.
+- --redeliver N envía cada evento N veces, como hace Stripe al reintentar.
+- --bad-signature firma con otra clave (el backend debe responder 400).
+
+Al terminar consulta /payments/verify-session de cada sesión enviada.
+
+Uso (desde backend/, con el backend en marcha y el mismo STRIPE_WEBHOOK_SECRET):
+    python replay_stripe_events.py --app-id 3 --user-id 14 --redeliver 3
+    python replay_stripe_events.py --file eventos.jsonl
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+import httpx
+
+def sign(payload: str, secret: str, timestamp: int | None = None) -> str:
+    """Cabecera Stripe-Signature: t=<unix>,v1=HMAC-SHA256(secret, "<t>.<payload>")"""
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def make_checkout_event(event_type: str, session_id: str, app_id: int, user_id: int) -> dict:
+    paid = event_type in ("checkout.session.completed", "checkout.session.async_payment_succeeded")
+    return {
+        "id": f"evt_local_{uuid.uuid4().hex[:24]}",
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "livemode": False,
+        "data": {
+            "object": {
+                "id": session_id,
+                "object": "checkout.session",
+                "mode": "payment",
+                "payment_status": "paid" if paid else "unpaid",
+                "payment_intent": f"pi_local_{uuid.uuid4().hex[:24]}" if paid else None,
+                "metadata": {"app_id": str(app_id), "user_id": str(user_id)}
+            }
+        }
+    }
+
+def load_events(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # JSONL: un evento por línea
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return data
+    return data["data"] if data.get("object") == "list" else [data]
+
+def replay(url: str, secret: str, events: list, redeliver: int):
+    sessions = set()
+    with httpx.Client(base_url=url, timeout=30) as client:
+        for event in events:
+            payload = json.dumps(event)
+            obj = event.get("data", {}).get("object", {})
+            if obj.get("object") == "checkout.session":
+                sessions.add(obj["id"])
+            for attempt in range(redeliver):
+                response = client.post("/payments/webhook", content=payload, headers={
+                    "Content-Type": "application/json",
+                    "Stripe-Signature": sign(payload, secret)
+                })
+                print(f"📨 {event['type']} {event['id']} (envío {attempt + 1}): {response.status_code} {response.text}")
+
+        if sessions:
+            time.sleep(1)  # Margen para que el worker procese el lote
+            for session_id in sorted(sessions):
+                status = client.get(f"/payments/verify-session/{session_id}").json()
+                print(f"🔎 verify-session {session_id}: {status}")
+        print(f"📊 Bandeja: {client.get('/payments/webhook/status').json()}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reenvío local de eventos de Stripe al webhook")
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--secret', default=os.getenv("STRIPE_WEBHOOK_SECRET", ""),
+                        help='Secreto de firma (por defecto STRIPE_WEBHOOK_SECRET)')
+    parser.add_argument('--file', help='Eventos capturados (JSON o JSONL)')
+    parser.add_argument('--type', default='checkout.session.completed')
+    parser.add_argument('--session-id', help='Id de la sesión de Checkout (por defecto uno nuevo)')
+    parser.add_argument('--app-id', type=int, default=1)
+    parser.add_argument('--user-id', type=int, default=1)
+    parser.add_argument('--redeliver', type=int, default=1, help='Veces que se envía cada evento')
+    parser.add_argument('--bad-signature', action='store_true', help='Firmar con una clave incorrecta')
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("Falta el secreto: define STRIPE_WEBHOOK_SECRET o usa --secret")
+    if args.file:
+        events = load_events(args.file)
+    else:
+        session_id = args.session_id or f"cs_local_{uuid.uuid4().hex[:24]}"
+        events = [make_checkout_event(args.type, session_id, args.app_id, args.user_id)]
+    secret = "whsec_incorrecto" if args.bad_signature else args.secret
+    replay(args.url, secret, events, args.redeliver)
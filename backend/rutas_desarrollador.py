@@ -1,107 +1,137 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List
-from database import get_db, User, App, Payment, Review, Rol, Categoria
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
+from database import get_db, User, App, Payment, Review, AppStats
 from schemas import (
-    UserRegisterDTO, UserLoginDTO, UserResponse,
+    CurrentUser,
+    UserRegisterDTO, UserLoginDTO, UserResponse, RefreshTokenDTO,
     AppCreateDTO, AppUpdateDTO, AppResponse,
     PaymentResponse, PaymentUpdateDTO,
-    ReviewResponse, StatsResponse,
+    ReviewResponse, StatsResponse, AppStatsResponse,
     RecommendationRequest, RecommendationsResponse, AppRecommendation
 )
-from auth import get_password_hash, verify_password, create_access_token, verify_token
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from datetime import timedelta
+from auth import (
+    create_user_token, get_current_user, hash_password, verify_and_update_password,
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_token
+)
+from datetime import datetime, timedelta
+import csv
+import io
+import json
+import app_stats
+from password_hashing import shutdown_pool
+from app_catalog import with_category
+from lookup_registry import roles, categorias
+from search_index import search_index, result_fields
+from ml_endpoints import record_purchase_for_recommendations
 
-router = APIRouter(prefix="/desarrollador", tags=["desarrollador"])
-security = HTTPBearer()
+router = APIRouter(prefix="/desarrollador", tags=["desarrollador"], on_shutdown=[shutdown_pool])
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    user_id = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
+def _email_registered(db: Session, correo: str) -> bool:
+    return db.query(User.id).filter(User.correo == correo).first() is not None
 
-@router.post("/auth/register", response_model=UserResponse)
-def register_desarrollador(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.correo == user_data.correo).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Correo ya registrado")
-    
-    rol_desarrollador = db.query(Rol).filter(Rol.nombre == "desarrollador").first()
-    if not rol_desarrollador:
-        rol_desarrollador = Rol(nombre="desarrollador")
-        db.add(rol_desarrollador)
-        db.flush()
-    
-    hashed_password = get_password_hash(user_data.contrasena)
+def _create_desarrollador(db: Session, user_data: UserRegisterDTO, hashed_password: str) -> User:
     new_user = User(
         correo=user_data.correo,
         nombre=user_data.nombre,
         contrasena=hashed_password,
-        rol_id=rol_desarrollador.id
+        rol_id=roles.get_or_create(db, "desarrollador")
     )
     
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    return new_user
+
+def _find_desarrollador(db: Session, correo: str):
+    rol_id = roles.get_id(db, "desarrollador")
+    if rol_id is None:
+        return None
+    return db.query(User).filter(
+        User.correo == correo,
+        User.rol_id == rol_id
+    ).first()
+
+# Register y login son async: bcrypt corre en el pool de procesos (password_hashing)
+# y las consultas en el threadpool, así un pico de logins no bloquea otros endpoints
+@router.post("/auth/register", response_model=UserResponse)
+async def register_desarrollador(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
+    if await run_in_threadpool(_email_registered, db, user_data.correo):
+        raise HTTPException(status_code=400, detail="Correo ya registrado")
     
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": str(new_user.id)}, expires_delta=access_token_expires
-    )
+    hashed_password = await hash_password(user_data.contrasena)
+    new_user = await run_in_threadpool(_create_desarrollador, db, user_data, hashed_password)
     
-    return UserResponse(
+    access_token = create_user_token(new_user, "desarrollador")
+    response = UserResponse(
         id=new_user.id,
         correo=new_user.correo,
         nombre=new_user.nombre,
         token=access_token
     )
+    response.refresh_token = await run_in_threadpool(issue_refresh_token, db, new_user.id)
+    
+    return response
 
 @router.post("/auth/login", response_model=UserResponse)
-def login_desarrollador(login_data: UserLoginDTO, db: Session = Depends(get_db)):
-    rol_desarrollador = db.query(Rol).filter(Rol.nombre == "desarrollador").first()
-    if not rol_desarrollador:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Correo o contrasena incorrectos")
-    
-    user = db.query(User).filter(
-        User.correo == login_data.correo,
-        User.rol_id == rol_desarrollador.id
-    ).first()
+async def login_desarrollador(login_data: UserLoginDTO, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_desarrollador, db, login_data.correo)
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await verify_and_update_password(login_data.contrasena, user.contrasena)
     
-    if not user or not verify_password(login_data.contrasena, user.contrasena):
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Correo o contrasena incorrectos"
         )
     
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": str(user.id)}, expires_delta=access_token_expires
+    access_token = create_user_token(user, "desarrollador")
+    response = UserResponse(
+        id=user.id,
+        correo=user.correo,
+        nombre=user.nombre,
+        token=access_token
     )
     
+    # El hash usa otro coste de bcrypt (BCRYPT_ROUNDS cambió): se guarda el nuevo con la sesión
+    if new_hash:
+        user.contrasena = new_hash
+    response.refresh_token = await run_in_threadpool(issue_refresh_token, db, user.id)
+    
+    return response
+
+@router.post("/auth/refresh", response_model=UserResponse)
+def refresh_desarrollador(data: RefreshTokenDTO, db: Session = Depends(get_db)):
+    """
+    Renovar la sesión sin contraseña: nuevo access token y nuevo refresh token
+    (el enviado queda revocado)
+    """
+    user, refresh_token = rotate_refresh_token(db, data.refresh_token, "desarrollador")
     return UserResponse(
         id=user.id,
         correo=user.correo,
         nombre=user.nombre,
-        token=access_token
+        token=create_user_token(user, "desarrollador"),
+        refresh_token=refresh_token
     )
 
+@router.post("/auth/logout")
+def logout_desarrollador(data: RefreshTokenDTO, db: Session = Depends(get_db)):
+    revoke_refresh_token(db, data.refresh_token)
+    return {"message": "Sesión cerrada"}
+
 # CRUD Apps
 @router.post("/apps", response_model=AppResponse)
-def create_app(app_data: AppCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    categoria_obj = db.query(Categoria).filter(Categoria.nombre == app_data.categoria).first()
-    if not categoria_obj:
-        categoria_obj = Categoria(nombre=app_data.categoria)
-        db.add(categoria_obj)
-        db.flush()
-    
+def create_app(app_data: AppCreateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     new_app = App(
         nombre=app_data.nombre,
         descripcion=app_data.descripcion,
-        categoria_id=categoria_obj.id,
+        categoria_id=categorias.get_or_create(db, app_data.categoria),
         url_aplicacion=app_data.url_aplicacion,
         propietario_id=current_user.id,
         imagen_portada=app_data.imagen_portada,
@@ -113,12 +143,14 @@ def create_app(app_data: AppCreateDTO, current_user: User = Depends(get_current_
     db.add(new_app)
     db.commit()
     db.refresh(new_app)
+    # El nombre de la categoría ya se conoce: no hace falta cargar la relación
+    search_index.upsert(new_app.id, new_app.nombre, new_app.descripcion, app_data.categoria, result_fields(new_app))
     
     return AppResponse(
         id=new_app.id,
         nombre=new_app.nombre,
         descripcion=new_app.descripcion,
-        categoria=new_app.categoria_obj.nombre,
+        categoria=app_data.categoria,
         url_aplicacion=new_app.url_aplicacion,
         propietario_id=new_app.propietario_id,
         imagen_portada=new_app.imagen_portada,
@@ -127,8 +159,8 @@ def create_app(app_data: AppCreateDTO, current_user: User = Depends(get_current_
     )
 
 @router.get("/apps", response_model=List[AppResponse])
-def get_desarrollador_apps(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    apps = db.query(App).filter(App.propietario_id == current_user.id).all()
+def get_desarrollador_apps(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    apps = with_category(db.query(App)).filter(App.propietario_id == current_user.id).all()
     return [
         AppResponse(
             id=app.id,
@@ -145,7 +177,7 @@ def get_desarrollador_apps(current_user: User = Depends(get_current_user), db: S
     ]
 
 @router.put("/apps/{app_id}", response_model=AppResponse)
-def update_app(app_id: int, app_data: AppUpdateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_app(app_id: int, app_data: AppUpdateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.propietario_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
@@ -163,6 +195,7 @@ def update_app(app_id: int, app_data: AppUpdateDTO, current_user: User = Depends
     
     db.commit()
     db.refresh(app)
+    search_index.upsert_app(app)
     
     return AppResponse(
         id=app.id,
@@ -177,39 +210,57 @@ def update_app(app_id: int, app_data: AppUpdateDTO, current_user: User = Depends
     )
 
 @router.delete("/apps/{app_id}")
-def delete_app(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_app(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.propietario_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
     
+    app_stats.delete_app_stats(db, app.id)
     db.delete(app)
     db.commit()
+    search_index.remove(app_id)
     
     return {"message": "Aplicacion eliminada correctamente"}
 
+def _app_stats_query(db: Session, propietario_id: int):
+    """Apps del desarrollador con sus contadores materializados (busqueda por clave primaria)"""
+    return db.query(App.id, AppStats)\
+        .outerjoin(AppStats, AppStats.aplicacion_id == App.id)\
+        .filter(App.propietario_id == propietario_id)
+
+def _stats_from_row(row) -> AppStatsResponse:
+    stats = row.AppStats
+    return AppStatsResponse(
+        aplicacion_id=row.id,
+        descargas=stats.total_ventas if stats else 0,  # Asumimos descargas = pagos confirmados
+        resenas=stats.num_resenas if stats else 0,
+        calificacion_promedio=app_stats.average_rating(stats),
+        pagos_recibidos=float(stats.ingresos) if stats else 0.0
+    )
+
+@router.get("/apps/stats", response_model=List[AppStatsResponse])
+def get_all_apps_stats(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Estadisticas de todas las apps del desarrollador en una sola consulta"""
+    rows = _app_stats_query(db, current_user.id).order_by(App.id).all()
+    return [_stats_from_row(row) for row in rows]
+
 @router.get("/apps/{app_id}/stats", response_model=StatsResponse)
-def get_app_stats(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    app = db.query(App).filter(App.id == app_id, App.propietario_id == current_user.id).first()
-    if not app:
+def get_app_stats(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    # La verificacion de propietario va en la misma consulta que los agregados
+    row = _app_stats_query(db, current_user.id).filter(App.id == app_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
     
-    # Calcular estadisticas
-    reviews_count = db.query(Review).filter(Review.aplicacion_id == app_id).count()
-    avg_rating = db.query(func.avg(Review.calificacion)).filter(Review.aplicacion_id == app_id).scalar() or 0
-    confirmed_payments = db.query(Payment).filter(
-        Payment.aplicacion_id == app_id, 
-        Payment.estado == "confirmado"
-    ).count()
-    
+    stats = _stats_from_row(row)
     return StatsResponse(
-        descargas=confirmed_payments,  # Asumimos descargas = pagos confirmados
-        resenas=reviews_count,
-        calificacion_promedio=float(avg_rating),
-        pagos_recibidos=float(confirmed_payments * app.precio)
+        descargas=stats.descargas,
+        resenas=stats.resenas,
+        calificacion_promedio=stats.calificacion_promedio,
+        pagos_recibidos=stats.pagos_recibidos
     )
 
 @router.get("/apps/{app_id}/reviews", response_model=List[ReviewResponse])
-def get_app_reviews(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_app_reviews(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.propietario_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
@@ -228,7 +279,7 @@ def get_app_reviews(app_id: int, current_user: User = Depends(get_current_user),
 
 # Pagos
 @router.get("/payments", response_model=List[PaymentResponse])
-def get_desarrollador_payments(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_desarrollador_payments(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Obtener pagos de todas las apps del desarrollador
     desarrollador_apps = db.query(App).filter(App.propietario_id == current_user.id).all()
     app_ids = [app.id for app in desarrollador_apps]
@@ -246,7 +297,7 @@ def get_desarrollador_payments(current_user: User = Depends(get_current_user), d
     ]
 
 @router.patch("/payments/{payment_id}", response_model=PaymentResponse)
-def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar que el pago pertenece a una app del desarrollador
     payment = db.query(Payment).join(App).filter(
         Payment.id == payment_id,
@@ -256,9 +307,23 @@ def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, curre
     if not payment:
         raise HTTPException(status_code=404, detail="Pago no encontrado")
     
+    # Mantener los contadores cuando el pago entra o sale del estado confirmado
+    delta = 0
+    if payment.estado != payment_data.estado and "confirmado" in (payment.estado, payment_data.estado):
+        delta = 1 if payment_data.estado == "confirmado" else -1
+        precio = payment.precio_pagado if payment.precio_pagado is not None else payment.aplicacion.precio
+        app_stats.record_sale(db, payment.aplicacion_id, precio, payment.fecha_creacion, delta)
+    
     payment.estado = payment_data.estado
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Índice único: el comprador ya tiene otra compra confirmada de esta app
+        db.rollback()
+        raise HTTPException(status_code=409, detail="El comprador ya tiene una compra confirmada de esta aplicacion")
     db.refresh(payment)
+    if delta:
+        record_purchase_for_recommendations(db, payment.comprador_id, payment.aplicacion_id, reverted=delta < 0)
     
     return PaymentResponse(
         id=payment.id,
@@ -270,7 +335,7 @@ def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, curre
 
 # Recomendaciones ML (simuladas)
 @router.post("/recommendations", response_model=RecommendationsResponse)
-def get_desarrollador_recommendations(request: RecommendationRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_desarrollador_recommendations(request: RecommendationRequest, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Simulacion de recomendaciones ML
     mock_ideas = [
         "Sugerencia de app de productividad",
@@ -291,42 +356,114 @@ def get_desarrollador_recommendations(request: RecommendationRequest, current_us
     )
 
 # Mis Ventas - Lista completa de apps vendidas
+SALES_STREAM_BATCH = 1000
+SALES_CSV_COLUMNS = ["app_id", "app_name", "buyer_id", "buyer_name", "buyer_email", "purchase_date", "price"]
+
+def _sales_query(db: Session, propietario_id: int, desde: Optional[datetime], hasta: Optional[datetime]):
+    """Pagos confirmados del desarrollador unidos con su app y su comprador (Payment ⋈ App ⋈ User)"""
+    query = db.query(
+        Payment.id.label("payment_id"),
+        App.id.label("app_id"),
+        App.nombre.label("app_name"),
+        User.id.label("buyer_id"),
+        User.nombre.label("buyer_name"),
+        User.correo.label("buyer_email"),
+        Payment.fecha_creacion.label("purchase_date"),
+        App.precio.label("price")
+    ).select_from(Payment)\
+        .join(App, Payment.aplicacion_id == App.id)\
+        .join(User, Payment.comprador_id == User.id)\
+        .filter(App.propietario_id == propietario_id, Payment.estado == "confirmado")
+    
+    if desde is not None:
+        query = query.filter(Payment.fecha_creacion >= desde)
+    if hasta is not None:
+        query = query.filter(Payment.fecha_creacion < hasta)
+    return query
+
+def _sale_to_dict(row) -> dict:
+    return {
+        "app_id": row.app_id,
+        "app_name": row.app_name,
+        "buyer_id": row.buyer_id,
+        "buyer_name": row.buyer_name,
+        "buyer_email": row.buyer_email,
+        "purchase_date": row.purchase_date.isoformat(),
+        "price": row.price
+    }
+
+def _stream_sales_ndjson(rows):
+    for row in rows:
+        yield json.dumps(_sale_to_dict(row)) + "\n"
+
+def _stream_sales_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=SALES_CSV_COLUMNS)
+    writer.writeheader()
+    for i, row in enumerate(rows, 1):
+        writer.writerow(_sale_to_dict(row))
+        if i % SALES_STREAM_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 @router.get("/sales")
-def get_desarrollador_sales(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_desarrollador_sales(
+    desde: Optional[datetime] = Query(None, description="Fecha inicial (inclusive)"),
+    hasta: Optional[datetime] = Query(None, description="Fecha final (exclusiva)"),
+    cursor: Optional[int] = Query(None, description="ID del ultimo pago recibido (paginacion por cursor)"),
+    limite: Optional[int] = Query(None, ge=1, le=10000),
+    formato: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """Obtener todas las ventas del desarrollador (apps compradas por usuarios)"""
-    # Obtener todas las apps del desarrollador
-    desarrollador_apps = db.query(App).filter(App.propietario_id == current_user.id).all()
+    sales_query = _sales_query(db, current_user.id, desde, hasta)
+    
+    page_query = sales_query.order_by(Payment.id)
+    if cursor is not None:
+        page_query = page_query.filter(Payment.id > cursor)
+    
+    # Formatos de streaming: las filas se leen de la BD por lotes mientras se envian
+    if formato in ("ndjson", "csv"):
+        if limite is not None:
+            page_query = page_query.limit(limite)
+        rows = page_query.yield_per(SALES_STREAM_BATCH)
+        if formato == "ndjson":
+            return StreamingResponse(_stream_sales_ndjson(rows), media_type="application/x-ndjson")
+        return StreamingResponse(
+            _stream_sales_csv(rows),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=ventas.csv"}
+        )
     
-    sales_list = []
-    total_revenue = 0
-    total_sales_count = 0
+    if desde is None and hasta is None:
+        # Sin rango de fechas los totales salen de los contadores materializados
+        totals = db.query(
+            func.coalesce(func.sum(AppStats.total_ventas), 0),
+            func.coalesce(func.sum(AppStats.ingresos), 0)
+        ).join(App, AppStats.aplicacion_id == App.id)\
+            .filter(App.propietario_id == current_user.id).one()
+    else:
+        # Totales calculados en SQL sobre el mismo rango de fechas (sin cursor)
+        totals = sales_query.order_by(None).with_entities(
+            func.count(Payment.id),
+            func.coalesce(func.sum(App.precio), 0)
+        ).one()
+    total_apps = db.query(func.count(App.id)).filter(App.propietario_id == current_user.id).scalar()
     
-    for app in desarrollador_apps:
-        # Obtener pagos confirmados para esta app
-        confirmed_payments = db.query(Payment).filter(
-            Payment.aplicacion_id == app.id,
-            Payment.estado == "confirmado"
-        ).all()
-        
-        # Crear una entrada por cada venta (pago confirmado)
-        for payment in confirmed_payments:
-            comprador = db.query(User).filter(User.id == payment.comprador_id).first()
-            if comprador:
-                sales_list.append({
-                    "app_id": app.id,
-                    "app_name": app.nombre,
-                    "buyer_id": comprador.id,
-                    "buyer_name": comprador.nombre,
-                    "buyer_email": comprador.correo,
-                    "purchase_date": payment.fecha_creacion.isoformat(),
-                    "price": app.precio
-                })
-                total_revenue += app.precio
-                total_sales_count += 1
+    # Pedimos una fila extra para saber si existe una pagina siguiente
+    rows = page_query.limit(limite + 1).all() if limite is not None else page_query.all()
+    siguiente_cursor = None
+    if limite is not None and len(rows) > limite:
+        rows = rows[:limite]
+        siguiente_cursor = rows[-1].payment_id
     
     return {
-        "total_apps": len(desarrollador_apps),
-        "total_sales": total_sales_count,
-        "total_revenue": total_revenue,
-        "sales": sales_list
+        "total_apps": total_apps,
+        "total_sales": totals[0],
+        "total_revenue": float(totals[1]),
+        "sales": [_sale_to_dict(row) for row in rows],
+        "siguiente_cursor": siguiente_cursor
     }
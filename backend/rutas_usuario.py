@@ -1,97 +1,158 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
-from database import get_db, User, App, Payment, Review, Rol, Categoria
+from typing import List, Optional
+from database import get_db, User, App, Payment, Review, Categoria
 from schemas import (
-    UserRegisterDTO, UserLoginDTO, UserResponse,
+    CurrentUser,
+    UserRegisterDTO, UserLoginDTO, UserResponse, RefreshTokenDTO,
     AppResponse, AppsListResponse,
     PaymentCreateDTO, PaymentResponse,
     ReviewCreateDTO, ReviewResponse,
     RecommendationRequest, RecommendationsResponse, AppRecommendation,
     PurchaseResponse, PurchasesListResponse
 )
-from auth import get_password_hash, verify_password, create_access_token, verify_token
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from datetime import timedelta
+from auth import (
+    create_access_token, create_user_token, get_current_user, hash_password, verify_and_update_password,
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_token
+)
+import os
+import app_stats
+import payment_store
+from password_hashing import shutdown_pool
+from app_catalog import with_category
+from lookup_registry import roles
+from ml_endpoints import record_purchase_for_recommendations, record_review_for_recommendations
 
-router = APIRouter(prefix="/usuario", tags=["usuario"])
-security = HTTPBearer()
+router = APIRouter(prefix="/usuario", tags=["usuario"], on_shutdown=[shutdown_pool])
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    user_id = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return user
+# Tamano de pagina del catalogo (configurable por entorno)
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "50"))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", "200"))
 
-@router.post("/auth/register", response_model=UserResponse)
-def register_usuario(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.correo == user_data.correo).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Correo ya registrado")
-    
-    rol_usuario = db.query(Rol).filter(Rol.nombre == "usuario").first()
-    if not rol_usuario:
-        rol_usuario = Rol(nombre="usuario")
-        db.add(rol_usuario)
-        db.flush()
-    
-    hashed_password = get_password_hash(user_data.contrasena)
+def _email_registered(db: Session, correo: str) -> bool:
+    return db.query(User.id).filter(User.correo == correo).first() is not None
+
+def _create_usuario(db: Session, user_data: UserRegisterDTO, hashed_password: str) -> User:
     new_user = User(
         correo=user_data.correo,
         nombre=user_data.nombre,
         contrasena=hashed_password,
-        rol_id=rol_usuario.id
+        rol_id=roles.get_or_create(db, "usuario")
     )
     
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    return new_user
+
+def _find_usuario(db: Session, correo: str):
+    rol_id = roles.get_id(db, "usuario")
+    if rol_id is None:
+        return None
+    return db.query(User).filter(
+        User.correo == correo,
+        User.rol_id == rol_id
+    ).first()
+
+# Register y login son async: bcrypt corre en el pool de procesos (password_hashing)
+# y las consultas en el threadpool, así un pico de logins no bloquea otros endpoints
+@router.post("/auth/register", response_model=UserResponse)
+async def register_usuario(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
+    if await run_in_threadpool(_email_registered, db, user_data.correo):
+        raise HTTPException(status_code=400, detail="Correo ya registrado")
     
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": str(new_user.id)}, expires_delta=access_token_expires
-    )
+    hashed_password = await hash_password(user_data.contrasena)
+    new_user = await run_in_threadpool(_create_usuario, db, user_data, hashed_password)
     
-    return UserResponse(
+    access_token = create_user_token(new_user, "usuario")
+    response = UserResponse(
         id=new_user.id,
         correo=new_user.correo,
         nombre=new_user.nombre,
         token=access_token
     )
+    response.refresh_token = await run_in_threadpool(issue_refresh_token, db, new_user.id)
+    
+    return response
 
 @router.post("/auth/login", response_model=UserResponse)
-def login_usuario(login_data: UserLoginDTO, db: Session = Depends(get_db)):
-    rol_usuario = db.query(Rol).filter(Rol.nombre == "usuario").first()
-    if not rol_usuario:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Correo o contrasena incorrectos")
+async def login_usuario(login_data: UserLoginDTO, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_find_usuario, db, login_data.correo)
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await verify_and_update_password(login_data.contrasena, user.contrasena)
     
-    user = db.query(User).filter(
-        User.correo == login_data.correo,
-        User.rol_id == rol_usuario.id
-    ).first()
-    
-    if not user or not verify_password(login_data.contrasena, user.contrasena):
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Correo o contrasena incorrectos"
         )
     
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": str(user.id)}, expires_delta=access_token_expires
+    access_token = create_user_token(user, "usuario")
+    response = UserResponse(
+        id=user.id,
+        correo=user.correo,
+        nombre=user.nombre,
+        token=access_token
     )
     
+    # El hash usa otro coste de bcrypt (BCRYPT_ROUNDS cambió): se guarda el nuevo con la sesión
+    if new_hash:
+        user.contrasena = new_hash
+    response.refresh_token = await run_in_threadpool(issue_refresh_token, db, user.id)
+    
+    return response
+
+@router.post("/auth/refresh", response_model=UserResponse)
+def refresh_usuario(data: RefreshTokenDTO, db: Session = Depends(get_db)):
+    """
+    Renovar la sesión sin contraseña: nuevo access token y nuevo refresh token
+    (el enviado queda revocado)
+    """
+    user, refresh_token = rotate_refresh_token(db, data.refresh_token, "usuario")
     return UserResponse(
         id=user.id,
         correo=user.correo,
         nombre=user.nombre,
-        token=access_token
+        token=create_user_token(user, "usuario"),
+        refresh_token=refresh_token
     )
 
+@router.post("/auth/logout")
+def logout_usuario(data: RefreshTokenDTO, db: Session = Depends(get_db)):
+    revoke_refresh_token(db, data.refresh_token)
+    return {"message": "Sesión cerrada"}
+
 @router.get("/apps", response_model=AppsListResponse)
-def get_all_apps(db: Session = Depends(get_db)):
-    apps = db.query(App).all()
+def get_all_apps(
+    cursor: Optional[int] = Query(None, description="ID de la ultima app recibida (paginacion por cursor)"),
+    limite: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    categoria: Optional[str] = None,
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    db: Session = Depends(get_db)
+):
+    # Paginacion keyset sobre App.id: el coste no depende de la profundidad de la pagina
+    query = with_category(db.query(App))
+    
+    if cursor is not None:
+        query = query.filter(App.id > cursor)
+    if categoria:
+        categoria_id = db.query(Categoria.id).filter(Categoria.nombre == categoria).scalar_subquery()
+        query = query.filter(App.categoria_id == categoria_id)
+    if precio_min is not None:
+        query = query.filter(App.precio >= precio_min)
+    if precio_max is not None:
+        query = query.filter(App.precio <= precio_max)
+    
+    # Pedimos una fila extra para saber si existe una pagina siguiente
+    apps = query.order_by(App.id).limit(limite + 1).all()
+    siguiente_cursor = None
+    if len(apps) > limite:
+        apps = apps[:limite]
+        siguiente_cursor = apps[-1].id
+    
     return AppsListResponse(
         aplicaciones=[
             AppResponse(
@@ -105,11 +166,12 @@ def get_all_apps(db: Session = Depends(get_db)):
                 url_video=app.url_video
             )
             for app in apps
-        ]
+        ],
+        siguiente_cursor=siguiente_cursor
     )
 
 @router.get("/apps/{app_id}/execute")
-def execute_app(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def execute_app(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id).first()
     if not app:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
@@ -122,23 +184,42 @@ def execute_app(app_id: int, current_user: User = Depends(get_current_user), db:
         "token": access_token
     }
 
+def _payment_response(payment: Payment) -> PaymentResponse:
+    return PaymentResponse(
+        id=payment.id,
+        aplicacion_id=payment.aplicacion_id,
+        comprador_id=payment.comprador_id,
+        estado=payment.estado,
+        codigo_qr=payment.codigo_qr,
+        credenciales=payment.credenciales
+    )
+
+def _replay_payment(payment: Payment, payment_data: PaymentCreateDTO, response: Response) -> PaymentResponse:
+    """Respuesta a un reintento con la misma Idempotency-Key: el pago ya creado"""
+    if payment.aplicacion_id != payment_data.aplicacion_id:
+        raise HTTPException(status_code=422, detail="La Idempotency-Key ya se usó para comprar otra aplicacion")
+    response.headers["Idempotent-Replayed"] = "true"
+    return _payment_response(payment)
+
 @router.post("/payments", response_model=PaymentResponse)
-def create_payment(payment_data: PaymentCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_payment(
+    payment_data: PaymentCreateDTO,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=64),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Reintento del cliente: una búsqueda por índice devuelve el pago ya creado
+    if idempotency_key:
+        existing_payment = payment_store.get_by_idempotency_key(db, current_user.id, idempotency_key)
+        if existing_payment:
+            return _replay_payment(existing_payment, payment_data, response)
+    
     # Verificar que la app existe
     app = db.query(App).filter(App.id == payment_data.aplicacion_id).first()
     if not app:
         raise HTTPException(status_code=404, detail="Aplicacion no encontrada")
     
-    # Verificar si ya compro esta app
-    existing_payment = db.query(Payment).filter(
-        Payment.aplicacion_id == payment_data.aplicacion_id,
-        Payment.comprador_id == current_user.id,
-        Payment.estado == "confirmado"
-    ).first()
-    
-    if existing_payment:
-        raise HTTPException(status_code=400, detail="Ya has comprado esta aplicacion")
-    
     # Generar credenciales automaticamente
     import json
     credentials_dict = {
@@ -149,32 +230,36 @@ def create_payment(payment_data: PaymentCreateDTO, current_user: User = Depends(
     }
     credentials_json = json.dumps(credentials_dict)
     
-    # Crear nuevo pago (auto-confirmado)
-    new_payment = Payment(
-        aplicacion_id=payment_data.aplicacion_id,
-        comprador_id=current_user.id,
-        codigo_qr=payment_data.codigo_qr,
-        estado="confirmado",  # Auto-confirmado
-        credenciales=credentials_json
+    # Crear nuevo pago (auto-confirmado); los índices únicos impiden duplicados
+    payment_id = payment_store.insert_confirmed_payment(
+        db, app, current_user.id, payment_data.codigo_qr, credentials_json, idempotency_key
     )
+    if payment_id is None:
+        # Conflicto: reintento simultáneo con la misma clave, compra repetida o codigo_qr ya usado
+        if idempotency_key:
+            existing_payment = payment_store.get_by_idempotency_key(db, current_user.id, idempotency_key)
+            if existing_payment:
+                return _replay_payment(existing_payment, payment_data, response)
+        if payment_store.get_confirmed(db, app.id, current_user.id):
+            raise HTTPException(status_code=400, detail="Ya has comprado esta aplicacion")
+        raise HTTPException(status_code=409, detail="El codigo QR ya fue usado en otro pago")
     
-    db.add(new_payment)
     db.commit()
-    db.refresh(new_payment)
+    record_purchase_for_recommendations(db, current_user.id, app.id)
     
     return PaymentResponse(
-        id=new_payment.id,
-        aplicacion_id=new_payment.aplicacion_id,
-        comprador_id=new_payment.comprador_id,
-        estado=new_payment.estado,
-        codigo_qr=new_payment.codigo_qr,
-        credenciales=new_payment.credenciales
+        id=payment_id,
+        aplicacion_id=app.id,
+        comprador_id=current_user.id,
+        estado="confirmado",
+        codigo_qr=payment_data.codigo_qr,
+        credenciales=credentials_json
     )
 
 @router.get("/payments", response_model=List[PurchaseResponse])
-def get_usuario_payments(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_usuario_payments(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Hacer JOIN con la tabla apps para obtener toda la informacion
-    payments = db.query(Payment, App).join(App, Payment.aplicacion_id == App.id).filter(
+    payments = with_category(db.query(Payment, App).join(App, Payment.aplicacion_id == App.id)).filter(
         Payment.comprador_id == current_user.id,
         Payment.estado == "confirmado"
     ).all()
@@ -196,9 +281,9 @@ def get_usuario_payments(current_user: User = Depends(get_current_user), db: Ses
     ]
 
 @router.post("/recommendations", response_model=List[AppResponse])
-def get_usuario_recommendations(request: RecommendationRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_usuario_recommendations(request: RecommendationRequest, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Obtener apps aleatorias como recomendaciones (simulacion de ML)
-    apps = db.query(App).limit(6).all()
+    apps = with_category(db.query(App)).limit(6).all()
     
     return [
         AppResponse(
@@ -216,7 +301,7 @@ def get_usuario_recommendations(request: RecommendationRequest, current_user: Us
     ]
 
 @router.post("/reviews", response_model=ReviewResponse)
-def create_review(review_data: ReviewCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_review(review_data: ReviewCreateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar que la app existe
     app = db.query(App).filter(App.id == review_data.aplicacion_id).first()
     if not app:
@@ -240,8 +325,10 @@ def create_review(review_data: ReviewCreateDTO, current_user: User = Depends(get
     )
     
     db.add(new_review)
+    app_stats.record_review(db, app.id, new_review.calificacion)
     db.commit()
     db.refresh(new_review)
+    record_review_for_recommendations(db, current_user.id, app.id, new_review.calificacion)
     
     return ReviewResponse(
         id=new_review.id,
@@ -252,7 +339,7 @@ def create_review(review_data: ReviewCreateDTO, current_user: User = Depends(get
     )
 
 @router.get("/reviews", response_model=List[ReviewResponse])
-def get_my_reviews(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_my_reviews(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     reviews = db.query(Review).filter(Review.autor_id == current_user.id).all()
     return [
         ReviewResponse(
@@ -266,9 +353,9 @@ def get_my_reviews(current_user: User = Depends(get_current_user), db: Session =
     ]
 
 @router.get("/purchases", response_model=PurchasesListResponse)
-def get_usuario_purchases(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_usuario_purchases(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Hacer JOIN con la tabla apps para obtener toda la informacion
-    payments = db.query(Payment, App).join(App, Payment.aplicacion_id == App.id).filter(
+    payments = with_category(db.query(Payment, App).join(App, Payment.aplicacion_id == App.id)).filter(
         Payment.comprador_id == current_user.id,
         Payment.estado == "confirmado"
     ).all()
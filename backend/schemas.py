@@ -17,6 +17,16 @@ class UserResponse(BaseModel):
     correo: str
     nombre: str
     token: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenDTO(BaseModel):
+    refresh_token: str
+
+class CurrentUser(BaseModel):
+    """Usuario autenticado según el token (sin cargar la fila de `usuarios`)"""
+    id: int
+    nombre: Optional[str] = None
+    rol: Optional[str] = None
 
 # App DTOs
 class AppCreateDTO(BaseModel):
@@ -51,6 +61,7 @@ class AppResponse(BaseModel):
 
 class AppsListResponse(BaseModel):
     aplicaciones: List[AppResponse]
+    siguiente_cursor: Optional[int] = None
 
 # Payment DTOs
 class PaymentCreateDTO(BaseModel):
@@ -88,6 +99,9 @@ class StatsResponse(BaseModel):
     calificacion_promedio: float
     pagos_recibidos: float
 
+class AppStatsResponse(StatsResponse):
+    aplicacion_id: int
+
 # Purchase DTOs
 class PurchaseResponse(BaseModel):
     id: int
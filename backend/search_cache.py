@@ -0,0 +1,127 @@
+"""
+Cache de resultados de /search/ai-search
+
+La clave es la consulta normalizada (mismos términos tras tokenizar, sin
+importar mayúsculas, acentos, stopwords u orden) más la versión del catálogo
+del índice y las opciones que cambian el resultado (reordenar con LLM y
+número de candidatos). Editar cualquier app cambia la versión del catálogo,
+así que las entradas antiguas dejan de usarse sin tener que borrarlas.
+
+Dos niveles:
+- memoria: TTLCache (LRU + TTL) en cada proceso
+- disco (opcional, AI_SEARCH_CACHE_DB): tabla SQLite compartida por los
+  workers que sobrevive a los reinicios
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from ttl_cache import TTLCache
+
+AI_SEARCH_CACHE_SIZE = int(os.getenv("AI_SEARCH_CACHE_SIZE", "1000"))
+AI_SEARCH_CACHE_TTL = float(os.getenv("AI_SEARCH_CACHE_TTL", "3600"))
+# Ruta del fichero SQLite; vacío desactiva la persistencia en disco
+AI_SEARCH_CACHE_DB = os.getenv("AI_SEARCH_CACHE_DB", "")
+# Cada cuántas escrituras se borran del disco las entradas caducadas
+DISK_PURGE_EVERY = 100
+
+class SearchResultCache:
+    def __init__(self, maxsize: int = AI_SEARCH_CACHE_SIZE, ttl: float = AI_SEARCH_CACHE_TTL,
+                 db_path: str = AI_SEARCH_CACHE_DB):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db_path = db_path
+        self._conn = self._open_disk(db_path) if db_path else None
+
+    def _open_disk(self, db_path: str):
+        try:
+            conn = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            return conn
+        except sqlite3.Error as e:
+            print(f"⚠️  Cache de búsqueda en disco no disponible ({db_path}): {e}")
+            return None
+
+    @staticmethod
+    def make_key(normalized_query: str, catalog_version: str, rerank: bool, candidates: int) -> str:
+        mode = f"llm{candidates}" if rerank else "local"
+        return f"{catalog_version}:{mode}:{normalized_query}"
+
+    def get(self, key: str):
+        value = self._memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT value, expires_at FROM search_cache WHERE key = ? AND expires_at > ?",
+                        (key, time.time())
+                    ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    # Subir a memoria con el TTL que le queda en disco
+                    self._memory.set(key, value, ttl=row[1] - time.time())
+                    self.disk_hits += 1
+                    return value
+            except sqlite3.Error as e:
+                print(f"⚠️  Error leyendo la cache de búsqueda en disco: {e}")
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value):
+        self._memory.set(key, value)
+        if self._conn is None:
+            return
+        try:
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now + self.ttl)
+                )
+                self._writes += 1
+                if self._writes % DISK_PURGE_EVERY == 0:
+                    self._conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️  Error guardando en la cache de búsqueda en disco: {e}")
+
+    def clear(self):
+        self._memory.clear()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM search_cache")
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._memory),
+            "maxsize": self._memory.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / total, 3) if total else 0.0,
+            "disk": self.db_path if self._conn is not None else None
+        }
+
+# Cache compartida por las rutas de este proceso
+search_cache = SearchResultCache()
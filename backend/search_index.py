@@ -0,0 +1,264 @@
+"""
+Índice de búsqueda local (BM25) sobre el catálogo de apps
+
+Índice invertido en memoria sobre nombre, categoría y descripción de cada app.
+Se construye al arrancar (o en la primera búsqueda), se actualiza en las
+escrituras de apps de este proceso y se reconstruye entero cada
+SEARCH_INDEX_MAX_AGE segundos para recoger cambios hechos por otros workers.
+Esa reconstrucción periódica la hace un único hilo en segundo plano: el índice
+nuevo se construye aparte y se publica de una vez, y mientras tanto las
+búsquedas siguen respondiendo con el anterior.
+Una consulta cuesta milisegundos y no depende de ningún servicio externo; el
+LLM queda como reordenador opcional de estos resultados.
+
+`fingerprint` identifica el contenido del catálogo (XOR de un hash por app):
+es el mismo en todos los workers y tras reiniciar mientras el catálogo no
+cambie, y sirve como versión del catálogo para cachear resultados. El hash
+incluye también los campos que devuelve la búsqueda sin indexarlos (precio,
+imagen y URLs, ver RESULT_FIELDS): editarlos invalida la cache.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from sqlalchemy.orm import Session
+
+SEARCH_INDEX_MAX_AGE = float(os.getenv("SEARCH_INDEX_MAX_AGE", "300"))
+
+# Peso de cada campo en la frecuencia de un término
+FIELD_WEIGHTS = {"nombre": 3.0, "categoria": 2.0, "descripcion": 1.0}
+
+STOPWORDS = {
+    "a", "al", "algo", "app", "apps", "aplicacion", "aplicaciones", "busco", "con", "como",
+    "de", "del", "el", "en", "es", "esta", "este", "hay", "la", "las", "lo", "los", "me",
+    "mi", "mis", "necesito", "o", "para", "por", "que", "quiero", "se", "sin", "su", "sus",
+    "tu", "un", "una", "unas", "uno", "unos", "y", "the", "and", "for", "of", "to", "with"
+}
+
+# Sufijos que se recortan para agrupar variantes ("gestionar"/"gestión", "proyectos"/"proyecto")
+SUFFIXES = (
+    "amientos", "amiento", "aciones", "adores", "adoras", "ciones", "idades", "mente",
+    "acion", "ador", "adora", "cion", "idad", "ando", "iendo", "ados", "idos", "ado", "ido",
+    "ar", "er", "ir", "es", "s"
+)
+MIN_STEM_LENGTH = 3
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _strip_accents(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+def _stem(token: str) -> str:
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+def tokenize(text: str):
+    """Minúsculas, sin acentos ni stopwords, con un stemming ligero para español"""
+    tokens = _TOKEN_RE.findall(_strip_accents((text or "").lower()))
+    return [_stem(token) for token in tokens if token not in STOPWORDS]
+
+def normalize_query(text: str) -> str:
+    """Forma canónica de una consulta: mismos términos -> misma cadena"""
+    return " ".join(sorted(tokenize(text)))
+
+# Columnas de App que la búsqueda devuelve pero no indexa; entran en el hash de cada app
+RESULT_FIELDS = ("precio", "imagen_portada", "url_video", "url_aplicacion")
+
+def _document_hash(app_id: int, nombre: str, descripcion: str, categoria: str, extra=()) -> int:
+    values = (app_id, nombre, descripcion, categoria, *extra)
+    content = "\x1f".join("" if value is None else str(value) for value in values)
+    return int.from_bytes(hashlib.blake2b(content.encode("utf-8"), digest_size=8).digest(), "big")
+
+def result_fields(app) -> tuple:
+    """Valores de RESULT_FIELDS de una app ORM"""
+    return tuple(getattr(app, field) for field in RESULT_FIELDS)
+
+class AppSearchIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()  # Una sola reconstrucción a la vez
+        self._generation = 0  # Cambia con invalidate(): descarta construcciones empezadas antes
+        self._journal = None  # Escrituras recibidas durante una construcción
+        self._reset()
+
+    def _reset(self):
+        self.postings = {}   # término -> {app_id: frecuencia ponderada}
+        self.doc_terms = {}  # app_id -> {término: frecuencia ponderada} (para actualizar/borrar)
+        self.doc_len = {}
+        self.doc_hash = {}
+        self.fingerprint = 0
+        self.total_len = 0.0
+        self.built_at = None
+        self.version = 0
+
+    def _index_document(self, app_id: int, nombre: str, descripcion: str, categoria: str, extra=()):
+        terms = Counter()
+        for field, text in (("nombre", nombre), ("categoria", categoria), ("descripcion", descripcion)):
+            for token in tokenize(text):
+                terms[token] += FIELD_WEIGHTS[field]
+        self.doc_terms[app_id] = terms
+        self.doc_hash[app_id] = _document_hash(app_id, nombre, descripcion, categoria, extra)
+        self.fingerprint ^= self.doc_hash[app_id]
+        self.doc_len[app_id] = sum(terms.values())
+        self.total_len += self.doc_len[app_id]
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[app_id] = tf
+
+    def _remove_document(self, app_id: int):
+        terms = self.doc_terms.pop(app_id, None)
+        if terms is None:
+            return
+        self.total_len -= self.doc_len.pop(app_id)
+        self.fingerprint ^= self.doc_hash.pop(app_id)
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(app_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def _begin_build(self) -> int:
+        with self._lock:
+            self._journal = []
+            return self._generation
+
+    def _publish(self, documents, generation: int) -> bool:
+        """
+        Indexar `documents` en un índice aparte (sin bloquear búsquedas) y
+        sustituir el estado actual. Las escrituras recibidas desde
+        _begin_build se reaplican antes de publicar. Retorna False si el índice
+        se invalidó entretanto (el resultado ya no vale).
+        """
+        fresh = AppSearchIndex(self.k1, self.b)
+        for app_id, nombre, descripcion, categoria, *extra in documents:
+            fresh._index_document(app_id, nombre, descripcion, categoria, extra)
+
+        with self._lock:
+            journal, self._journal = self._journal or [], None
+            if generation != self._generation:
+                return False
+            for args in journal:
+                fresh._remove_document(args[0])
+                if len(args) > 1:
+                    fresh._index_document(*args)
+            for name in ("postings", "doc_terms", "doc_len", "doc_hash", "fingerprint", "total_len"):
+                setattr(self, name, getattr(fresh, name))
+            self.built_at = time.monotonic()
+            self.version += 1
+        return True
+
+    def build(self, documents):
+        """Reconstruir desde (app_id, nombre, descripcion, categoria, *RESULT_FIELDS)"""
+        with self._build_lock:
+            self._publish(documents, self._begin_build())
+
+    def _build_from_db(self, db: Session):
+        from database import App, Categoria
+        generation = self._begin_build()  # Antes de leer: no perder escrituras concurrentes
+        try:
+            rows = db.query(App.id, App.nombre, App.descripcion, Categoria.nombre,
+                            *(getattr(App, field) for field in RESULT_FIELDS))\
+                .outerjoin(Categoria, Categoria.id == App.categoria_id).all()
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+        if self._publish(rows, generation):
+            print(f"🔎 Índice de búsqueda construido: {len(rows)} apps, {len(self.postings)} términos")
+
+    def build_from_db(self, db: Session):
+        with self._build_lock:
+            self._build_from_db(db)
+
+    def _rebuild_in_background(self):
+        """Hilo de reconstrucción periódica; entra con _build_lock ya adquirido"""
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            self._build_from_db(db)
+        except Exception as e:
+            print(f"⚠️  No se pudo reconstruir el índice de búsqueda: {e}")
+        finally:
+            db.close()
+            self._build_lock.release()
+
+    def ensure_built(self, db: Session):
+        """
+        Sin índice (arranque o tras invalidate) se construye aquí: un solo hilo
+        construye y el resto espera a ese resultado. Si solo ha caducado, se
+        lanza una reconstrucción en segundo plano (si no hay otra en curso) y
+        la búsqueda usa el índice actual.
+        """
+        if self.built_at is None:
+            with self._build_lock:
+                if self.built_at is None:  # Otro hilo pudo construirlo mientras se esperaba
+                    self._build_from_db(db)
+            return
+        if time.monotonic() - self.built_at > SEARCH_INDEX_MAX_AGE and self._build_lock.acquire(blocking=False):
+            threading.Thread(target=self._rebuild_in_background, daemon=True, name="search-index-rebuild").start()
+
+    def invalidate(self):
+        """Forzar la reconstrucción en la próxima búsqueda (p. ej. tras repoblar la BD)"""
+        with self._lock:
+            self.built_at = None
+            self._generation += 1
+            self.version += 1
+
+    def upsert(self, app_id: int, nombre: str, descripcion: str, categoria: str, extra=()):
+        """`extra`: valores de RESULT_FIELDS de la app, en ese orden"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((app_id, nombre, descripcion, categoria, extra))
+            if self.built_at is None:
+                return  # Se indexará al construir
+            self._remove_document(app_id)
+            self._index_document(app_id, nombre, descripcion, categoria, extra)
+            self.version += 1
+
+    def upsert_app(self, app):
+        """Indexar (o reindexar) una app ORM tras crearla o editarla"""
+        self.upsert(app.id, app.nombre, app.descripcion, app.categoria_obj.nombre if app.categoria_obj else "",
+                    result_fields(app))
+
+    def remove(self, app_id: int):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((app_id,))
+            self._remove_document(app_id)
+            self.version += 1
+
+    @property
+    def catalog_version(self) -> str:
+        """Versión del catálogo indexado (cambia con cualquier alta, edición o baja)"""
+        return f"{self.fingerprint:016x}"
+
+    def search(self, query: str, limit: int = 20):
+        """Top `limit` apps por BM25: lista de (app_id, score) de mayor a menor"""
+        with self._lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return []
+            avg_len = self.total_len / n_docs
+            scores = {}
+            for term, query_tf in Counter(tokenize(query)).items():
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for app_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[app_id] / avg_len)
+                    scores[app_id] = scores.get(app_id, 0.0) + query_tf * idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+# Índice compartido por las rutas de este proceso
+search_index = AppSearchIndex()
@@ -6,8 +6,9 @@ Preparado para escalar a datasets grandes para ML en el futuro.
 import json
 import random
 from datetime import datetime, timedelta
-from database import SessionLocal, User, App, Payment, Review, Rol, Categoria, Base, engine
+from database import SessionLocal, User, App, Payment, Review, Rol, Categoria, AppStats, AppVentasDiarias, RefreshToken, Base, engine
 from passlib.context import CryptContext
+import app_stats
 
 # Configuración de hashing de contraseñas
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -93,9 +94,12 @@ def generate_credentials(buyer_id: int, app_id: int) -> str:
 def clean_database(db):
     """Limpia todas las tablas de la base de datos"""
     print("🧹 Limpiando base de datos...")
+    db.query(AppVentasDiarias).delete()
+    db.query(AppStats).delete()
     db.query(Review).delete()
     db.query(Payment).delete()
     db.query(App).delete()
+    db.query(RefreshToken).delete()
     db.query(User).delete()
     db.commit()
     print("✅ Base de datos limpiada")
@@ -360,6 +364,7 @@ def seed_database(dataset_size="small", clean_first=True):
         vendors, buyers = create_users(db, config)
         apps = create_apps(db, vendors, config)
         payments, reviews = create_purchases_and_reviews(db, buyers, apps, config)
+        app_stats.rebuild(db)
         
         # Mostrar resumen
         print_summary(vendors, buyers, apps, payments, reviews)
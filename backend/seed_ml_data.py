@@ -6,7 +6,7 @@ Script para poblar la base de datos con datos realistas para ML
 - 50+ reviews con ratings variados
 """
 
-from database import SessionLocal, User, App, Payment, Review
+from database import SessionLocal, User, App, Payment, Review, RefreshToken
 from datetime import datetime, timedelta
 import random
 import json
@@ -18,6 +18,7 @@ print("🗑️  Limpiando base de datos...")
 db.query(Review).delete()
 db.query(Payment).delete()
 db.query(App).delete()
+db.query(RefreshToken).delete()
 db.query(User).delete()
 db.commit()
 
@@ -1,17 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db, Payment, App, User
+from typing import Optional
+from database import get_db, SessionLocal, App
+import json
 import os
 from pydantic import BaseModel
-from auth import verify_token
+from auth import get_current_user
+from schemas import CurrentUser
+import stripe_webhooks
 
 # Importar stripe después de configurar la API key
 import stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "sk_test_placeholder")
 
-router = APIRouter(prefix="/payments", tags=["payments"])
-security = HTTPBearer()
+router = APIRouter(
+    prefix="/payments", tags=["payments"],
+    on_startup=[stripe_webhooks.start_worker], on_shutdown=[stripe_webhooks.stop_worker]
+)
 
 SUCCESS_URL = os.getenv("APP_SUCCESS_URL", "http://localhost:5173/usuario/payment-success")
 CANCEL_URL = os.getenv("APP_CANCEL_URL", "http://localhost:5173/usuario/payment-cancel")
@@ -19,22 +25,10 @@ CANCEL_URL = os.getenv("APP_CANCEL_URL", "http://localhost:5173/usuario/payment-
 class CreatePaymentRequest(BaseModel):
     app_id: int
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    user_id = verify_token(credentials.credentials)
-    # Convertir a int si viene como string
-    if isinstance(user_id, str):
-        user_id = int(user_id)
-    user = db.query(User).filter(User.id == user_id).first()
-    
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    return user
-
 @router.post("/create-checkout-session")
 def create_checkout_session(
     request: CreatePaymentRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
@@ -75,72 +69,47 @@ def create_checkout_session(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
+@router.post("/webhook")
+async def stripe_webhook(request: Request, stripe_signature: Optional[str] = Header(None)):
+    """
+    Webhook de Stripe: verificar la firma, guardar el evento en la bandeja de
+    entrada y responder. El worker de stripe_webhooks lo aplica después.
+    """
+    if not stripe_webhooks.STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="STRIPE_WEBHOOK_SECRET no configurado")
+    
+    payload = await request.body()
+    try:
+        stripe.Webhook.construct_event(payload, stripe_signature or "", stripe_webhooks.STRIPE_WEBHOOK_SECRET)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Payload inválido")
+    except stripe.error.SignatureVerificationError:
+        raise HTTPException(status_code=400, detail="Firma de Stripe inválida")
+    
+    def store():
+        db = SessionLocal()
+        try:
+            return stripe_webhooks.store_event(db, json.loads(payload))
+        finally:
+            db.close()
+    
+    stored = await run_in_threadpool(store)
+    if stored:
+        stripe_webhooks.wake_worker()
+    return {"received": True, "duplicate": not stored}
+
+@router.get("/webhook/status")
+def get_webhook_status(db: Session = Depends(get_db)):
+    """
+    Estado de la bandeja de entrada de webhooks y del worker
+    """
+    return stripe_webhooks.inbox_stats(db)
+
 @router.get("/verify-session/{session_id}")
 def verify_session(session_id: str, db: Session = Depends(get_db)):
-    try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        
-        if session.payment_status == 'paid':
-            # Obtener datos del metadata
-            app_id = int(session.metadata.get('app_id'))
-            user_id = int(session.metadata.get('user_id'))
-            
-            # Verificar que el usuario existe
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return {
-                    "status": "error",
-                    "detail": "Usuario no encontrado. La sesión fue creada con un usuario que ya no existe."
-                }
-            
-            # Verificar que la app existe
-            app = db.query(App).filter(App.id == app_id).first()
-            if not app:
-                return {
-                    "status": "error",
-                    "detail": "Aplicación no encontrada"
-                }
-            
-            # Verificar si ya existe este pago (para evitar duplicados)
-            existing_payment = db.query(Payment).filter(
-                Payment.codigo_qr == f"STRIPE-{session_id}"
-            ).first()
-            
-            if existing_payment:
-                return {
-                    "status": "paid",
-                    "payment_id": existing_payment.id,
-                    "app_id": app_id,
-                    "already_exists": True
-                }
-            
-            # Generar credenciales desde la plantilla de la app
-            import json
-            credenciales = app.plantilla_credenciales if app.plantilla_credenciales else json.dumps({
-                "stripe_session": session_id,
-                "payment_intent": session.payment_intent
-            })
-            
-            # Crear el pago en la base de datos
-            payment = Payment(
-                aplicacion_id=app_id,
-                comprador_id=user_id,
-                estado="confirmado",
-                codigo_qr=f"STRIPE-{session_id}",
-                credenciales=credenciales
-            )
-            db.add(payment)
-            db.commit()
-            
-            return {
-                "status": "paid",
-                "payment_id": payment.id,
-                "app_id": app_id
-            }
-        
-        return {"status": session.payment_status}
-        
-    except stripe.error.StripeError as e:
-        raise HTTPException(status_code=400, detail=f"Error de Stripe: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    """
+    Estado de una sesión de Checkout para la página de éxito. Es una lectura de
+    la BD local: el pago lo crea el worker al recibir el webhook. Mientras tanto
+    responde "pending" (sin webhook aún) o "processing" y el frontend reintenta.
+    """
+    return stripe_webhooks.session_status(db, session_id)
@@ -0,0 +1,220 @@
+"""
+Ingesta de webhooks de Stripe: bandeja de entrada + worker por lotes
+
+1. /payments/webhook verifica la firma (STRIPE_WEBHOOK_SECRET), guarda el
+   evento en `stripe_eventos` con INSERT ... ON CONFLICT DO NOTHING (las
+   reentregas de Stripe se descartan por id) y responde 200 enseguida.
+2. Un worker en segundo plano (uno por proceso de uvicorn) lee los eventos
+   pendientes en lotes de STRIPE_WEBHOOK_BATCH_SIZE, crea los pagos y hace un
+   solo commit por lote. Se despierta al llegar un evento y, por si acaso, cada
+   STRIPE_WEBHOOK_POLL_INTERVAL segundos. En PostgreSQL los lotes se reservan con
+   FOR UPDATE SKIP LOCKED, así varios workers no se pisan; de todos modos
+   codigo_qr es único y un evento repetido no crea dos pagos.
+3. Un evento que falla se reintenta con espera exponencial (desde
+   STRIPE_WEBHOOK_RETRY_DELAY segundos) hasta STRIPE_WEBHOOK_MAX_ATTEMPTS
+   veces; después queda con su error para revisarlo.
+
+verify-session ya no llama a Stripe: lee el pago (o el último evento de la
+sesión) en la BD local.
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from database import SessionLocal, App, User, StripeEvent, dialect_insert
+import payment_store
+from ml_endpoints import record_purchase_for_recommendations
+
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+STRIPE_WEBHOOK_BATCH_SIZE = int(os.getenv("STRIPE_WEBHOOK_BATCH_SIZE", "100"))
+STRIPE_WEBHOOK_POLL_INTERVAL = float(os.getenv("STRIPE_WEBHOOK_POLL_INTERVAL", "5"))
+STRIPE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv("STRIPE_WEBHOOK_MAX_ATTEMPTS", "5"))
+# Espera antes del primer reintento de un evento fallido (se duplica en cada intento)
+STRIPE_WEBHOOK_RETRY_DELAY = float(os.getenv("STRIPE_WEBHOOK_RETRY_DELAY", "30"))
+
+# Eventos de Checkout que confirman el cobro. checkout.session.completed llega
+# con payment_status "unpaid" en métodos asíncronos: se espera al segundo evento.
+PAID_EVENTS = {"checkout.session.completed", "checkout.session.async_payment_succeeded"}
+# Eventos que cierran una sesión sin cobro (verify-session los informa)
+FAILED_EVENTS = {
+    "checkout.session.async_payment_failed": "unpaid",
+    "checkout.session.expired": "expired",
+}
+
+_worker = {"task": None, "wakeup": None}
+stats = {"received": 0, "duplicates": 0, "batches": 0, "applied": 0, "errors": 0}
+
+# ==================== BANDEJA DE ENTRADA ====================
+def store_event(db: Session, event: dict) -> bool:
+    """Guardar un evento ya verificado. Retorna False si ya estaba (reentrega)."""
+    obj = event.get("data", {}).get("object", {})
+    session_id = obj.get("id") if obj.get("object") == "checkout.session" else None
+    stmt = dialect_insert(db)(StripeEvent).values(
+        id=event["id"],
+        tipo=event["type"],
+        sesion_id=session_id,
+        payload=json.dumps(event),
+        recibido_en=datetime.utcnow()
+    ).on_conflict_do_nothing()
+    inserted = db.execute(stmt).rowcount > 0
+    db.commit()
+
+    stats["received"] += 1
+    if not inserted:
+        stats["duplicates"] += 1
+    return inserted
+
+# ==================== APLICAR EVENTOS ====================
+def _apply_paid_session(db: Session, session: dict) -> tuple[int, int] | None:
+    """Crear el pago de una sesión cobrada. Retorna (user_id, app_id) si es nuevo."""
+    if session.get("payment_status") != "paid":
+        return None  # Pago asíncrono pendiente: llegará async_payment_succeeded
+
+    metadata = session.get("metadata") or {}
+    app_id = int(metadata["app_id"])
+    user_id = int(metadata["user_id"])
+    if db.query(User.id).filter(User.id == user_id).first() is None:
+        raise ValueError(f"Usuario {user_id} no encontrado")
+    app = db.query(App).filter(App.id == app_id).first()
+    if not app:
+        raise ValueError(f"Aplicación {app_id} no encontrada")
+
+    credenciales = app.plantilla_credenciales or json.dumps({
+        "stripe_session": session["id"],
+        "payment_intent": session.get("payment_intent")
+    })
+    # Importe realmente cobrado por Stripe (en centavos), si viene en la sesión
+    amount_total = session.get("amount_total")
+    precio = amount_total / 100 if amount_total is not None else None
+    payment_id = payment_store.insert_confirmed_payment(
+        db, app, user_id, f"STRIPE-{session['id']}", credenciales, precio=precio
+    )
+    return (user_id, app_id) if payment_id is not None else None
+
+def process_batch(batch_size: int = STRIPE_WEBHOOK_BATCH_SIZE) -> int:
+    """
+    Aplicar hasta `batch_size` eventos pendientes en una transacción. Cada
+    evento va en un SAVEPOINT: si uno falla se revierte solo ese. Retorna el
+    número de eventos leídos (0 = bandeja vacía).
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        events = db.query(StripeEvent).filter(
+            StripeEvent.procesado_en.is_(None),
+            StripeEvent.intentos < STRIPE_WEBHOOK_MAX_ATTEMPTS,
+            or_(StripeEvent.reintentar_en.is_(None), StripeEvent.reintentar_en <= now)
+        ).order_by(StripeEvent.recibido_en).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not events:
+            return 0
+
+        purchases = []
+        for event in events:
+            event.intentos += 1
+            try:
+                with db.begin_nested():
+                    if event.tipo in PAID_EVENTS:
+                        purchase = _apply_paid_session(db, json.loads(event.payload)["data"]["object"])
+                        if purchase:
+                            purchases.append(purchase)
+                event.procesado_en = now
+                event.error = None
+            except Exception as e:
+                event.error = str(e)[:500]
+                event.reintentar_en = now + timedelta(seconds=STRIPE_WEBHOOK_RETRY_DELAY * 2 ** (event.intentos - 1))
+                stats["errors"] += 1
+                print(f"⚠️  Evento de Stripe {event.id} no aplicado (intento {event.intentos}): {e}")
+        db.commit()
+
+        stats["batches"] += 1
+        stats["applied"] += len(purchases)
+        for user_id, app_id in purchases:
+            record_purchase_for_recommendations(db, user_id, app_id)
+        return len(events)
+    finally:
+        db.close()
+
+def drain() -> int:
+    """Procesar lotes hasta vaciar la bandeja. Retorna el total de eventos leídos."""
+    total = 0
+    while True:
+        processed = process_batch()
+        total += processed
+        if processed < STRIPE_WEBHOOK_BATCH_SIZE:
+            return total
+
+# ==================== WORKER ====================
+async def _worker_loop():
+    wakeup = _worker["wakeup"]
+    while True:
+        try:
+            await run_in_threadpool(drain)
+        except Exception as e:
+            print(f"⚠️  Worker de webhooks de Stripe: {e}")
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=STRIPE_WEBHOOK_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+def start_worker():
+    _worker["wakeup"] = asyncio.Event()
+    _worker["task"] = asyncio.create_task(_worker_loop())
+
+async def stop_worker():
+    task = _worker["task"]
+    _worker.update(task=None, wakeup=None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+def wake_worker():
+    if _worker["wakeup"] is not None:
+        _worker["wakeup"].set()
+
+# ==================== LECTURAS ====================
+def session_status(db: Session, session_id: str) -> dict:
+    """Estado de una sesión de Checkout según la BD local (sin llamar a Stripe)"""
+    payment = payment_store.get_by_codigo_qr(db, f"STRIPE-{session_id}")
+    if payment:
+        return {"status": "paid", "payment_id": payment.id, "app_id": payment.aplicacion_id}
+
+    last_event = db.query(StripeEvent).filter(
+        StripeEvent.sesion_id == session_id
+    ).order_by(StripeEvent.recibido_en.desc()).first()
+    if last_event is None:
+        return {"status": "pending"}  # Stripe aún no ha enviado el webhook
+    if last_event.tipo in FAILED_EVENTS:
+        return {"status": FAILED_EVENTS[last_event.tipo]}
+    if last_event.procesado_en and last_event.tipo in PAID_EVENTS:
+        # Sesión aplicada sin pago nuevo: el comprador ya tenía la app confirmada
+        metadata = json.loads(last_event.payload)["data"]["object"].get("metadata") or {}
+        existing = payment_store.get_confirmed(db, int(metadata["app_id"]), int(metadata["user_id"]))
+        if existing:
+            return {"status": "paid", "payment_id": existing.id, "app_id": existing.aplicacion_id, "already_exists": True}
+    if last_event.error and last_event.intentos >= STRIPE_WEBHOOK_MAX_ATTEMPTS:
+        return {"status": "error", "detail": last_event.error}
+    return {"status": "processing"}
+
+def inbox_stats(db: Session) -> dict:
+    pending, failed, processed = db.query(
+        func.count().filter(StripeEvent.procesado_en.is_(None),
+                            StripeEvent.intentos < STRIPE_WEBHOOK_MAX_ATTEMPTS),
+        func.count().filter(StripeEvent.procesado_en.is_(None),
+                            StripeEvent.intentos >= STRIPE_WEBHOOK_MAX_ATTEMPTS),
+        func.count(StripeEvent.procesado_en)
+    ).one()
+    return {
+        "pending": pending,
+        "failed": failed,
+        "processed": processed,
+        "worker_running": _worker["task"] is not None and not _worker["task"].done(),
+        **stats
+    }
@@ -0,0 +1,64 @@
+"""
+Cache en memoria con expulsion LRU y expiracion (TTL) por entrada.
+
+Es seguro para hilos (FastAPI ejecuta los endpoints sincronos en un threadpool)
+y lleva contadores de aciertos/fallos para exponerlos en endpoints de estado.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+    
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
@@ -4,25 +4,17 @@ from sqlalchemy import func
 from typing import List
 from database import get_db, User, App, Payment, Review
 from schemas import (
+    CurrentUser,
     UserRegisterDTO, UserLoginDTO, UserResponse,
     AppCreateDTO, AppUpdateDTO, AppResponse,
     PaymentResponse, PaymentUpdateDTO,
     ReviewResponse, StatsResponse,
     RecommendationRequest, RecommendationsResponse, AppRecommendation
 )
-from auth import get_password_hash, verify_password, create_access_token, verify_token
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from auth import get_password_hash, verify_password, create_access_token, get_current_user
 from datetime import timedelta
 
 router = APIRouter(prefix="/vendor", tags=["vendor"])
-security = HTTPBearer()
-
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    user_id = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
 
 @router.post("/auth/register", response_model=UserResponse)
 def register_vendor(user_data: UserRegisterDTO, db: Session = Depends(get_db)):
@@ -84,7 +76,7 @@ def login_vendor(login_data: UserLoginDTO, db: Session = Depends(get_db)):
 
 # CRUD Apps
 @router.post("/apps", response_model=AppResponse)
-def create_app(app_data: AppCreateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_app(app_data: AppCreateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     new_app = App(
         name=app_data.name,
         description=app_data.description,
@@ -114,7 +106,7 @@ def create_app(app_data: AppCreateDTO, current_user: User = Depends(get_current_
     )
 
 @router.get("/apps", response_model=List[AppResponse])
-def get_vendor_apps(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_vendor_apps(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     apps = db.query(App).filter(App.owner_id == current_user.id).all()
     return [
         AppResponse(
@@ -132,7 +124,7 @@ def get_vendor_apps(current_user: User = Depends(get_current_user), db: Session
     ]
 
 @router.put("/apps/{app_id}", response_model=AppResponse)
-def update_app(app_id: int, app_data: AppUpdateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_app(app_id: int, app_data: AppUpdateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.owner_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App no encontrada")
@@ -164,7 +156,7 @@ def update_app(app_id: int, app_data: AppUpdateDTO, current_user: User = Depends
     )
 
 @router.delete("/apps/{app_id}")
-def delete_app(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def delete_app(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.owner_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App no encontrada")
@@ -175,7 +167,7 @@ def delete_app(app_id: int, current_user: User = Depends(get_current_user), db:
     return {"message": "App eliminada correctamente"}
 
 @router.get("/apps/{app_id}/stats", response_model=StatsResponse)
-def get_app_stats(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_app_stats(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.owner_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App no encontrada")
@@ -196,7 +188,7 @@ def get_app_stats(app_id: int, current_user: User = Depends(get_current_user), d
     )
 
 @router.get("/apps/{app_id}/reviews", response_model=List[ReviewResponse])
-def get_app_reviews(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_app_reviews(app_id: int, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     app = db.query(App).filter(App.id == app_id, App.owner_id == current_user.id).first()
     if not app:
         raise HTTPException(status_code=404, detail="App no encontrada")
@@ -215,7 +207,7 @@ def get_app_reviews(app_id: int, current_user: User = Depends(get_current_user),
 
 # Pagos
 @router.get("/payments", response_model=List[PaymentResponse])
-def get_vendor_payments(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_vendor_payments(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Obtener pagos de todas las apps del vendedor
     vendor_apps = db.query(App).filter(App.owner_id == current_user.id).all()
     app_ids = [app.id for app in vendor_apps]
@@ -233,7 +225,7 @@ def get_vendor_payments(current_user: User = Depends(get_current_user), db: Sess
     ]
 
 @router.patch("/payments/{payment_id}", response_model=PaymentResponse)
-def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar que el pago pertenece a una app del vendedor
     payment = db.query(Payment).join(App).filter(
         Payment.id == payment_id,
@@ -257,7 +249,7 @@ def update_payment_status(payment_id: int, payment_data: PaymentUpdateDTO, curre
 
 # Recomendaciones ML (simuladas)
 @router.post("/recommendations", response_model=RecommendationsResponse)
-def get_vendor_recommendations(request: RecommendationRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_vendor_recommendations(request: RecommendationRequest, current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # Simulación de recomendaciones ML
     mock_ideas = [
         "Sugerencia de app de productividad",
@@ -279,7 +271,7 @@ def get_vendor_recommendations(request: RecommendationRequest, current_user: Use
 
 # Mis Ventas - Lista completa de apps vendidas
 @router.get("/sales")
-def get_vendor_sales(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_vendor_sales(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obtener todas las ventas del vendedor (apps compradas por buyers)"""
     # Obtener todas las apps del vendedor
     vendor_apps = db.query(App).filter(App.owner_id == current_user.id).all()